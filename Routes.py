@@ -1,5 +1,401 @@
 import heapq
-from collections import defaultdict
+import math
+from collections import defaultdict, OrderedDict
+
+import numpy as np
+
+
+class NeighborDict(dict):
+    """
+    Neighbors of one stop in a StopGraph, every change is reported to the graph it belongs to.
+    """
+    def __init__(self, owner, stop):
+        super().__init__()
+        self.owner = owner
+        self.stop = stop
+
+    def __setitem__(self, key, value):
+        existed = key in self
+        super().__setitem__(key, value)
+        self.owner.edge_changed(self.stop, key, value, existed)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.owner.version += 1
+
+    # every other way of changing a dict goes through __setitem__ or bumps the version too
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        value = super().pop(key, *default)
+        self.owner.version += 1
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self.owner.version += 1
+        return item
+
+    def clear(self):
+        super().clear()
+        self.owner.version += 1
+
+    def __reduce__(self):
+        # on its own a neighbor dict has no graph to report to, StopGraph.__reduce__ rebuilds it with its owner
+        return dict, (dict(self),)
+
+
+class StopGraph(defaultdict):
+    """
+    The nested stop -> neighbor -> distance dictionary from build_graph_with_distances.
+    It works like before, and also keeps a CSRGraph copy for searching. Changing the distance of an existing
+    edge updates that copy in place, adding or removing stops and edges rebuilds it on the next search.
+    """
+    def __init__(self):
+        super().__init__()
+        self.version = 0
+        self.csr_version = None
+        self.csr_graph = None
+
+    def __missing__(self, key):
+        neighbors = self[key] = NeighborDict(self, key)
+        return neighbors
+
+    def __setitem__(self, key, value):
+        if not isinstance(value, NeighborDict) or value.owner is not self or value.stop != key:
+            neighbors = NeighborDict(self, key)
+            dict.update(neighbors, value)
+            value = neighbors
+        super().__setitem__(key, value)
+        self.version += 1
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.version += 1
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = {} if default is None else default
+        return self[key]
+
+    def pop(self, key, *default):
+        value = super().pop(key, *default)
+        self.version += 1
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self.version += 1
+        return item
+
+    def clear(self):
+        super().clear()
+        self.version += 1
+
+    def copy(self):
+        graph = StopGraph()
+        graph.update(self)
+        return graph
+
+    __copy__ = copy
+
+    def __reduce__(self):
+        return StopGraph, (), None, None, ((stop, dict(neighbors)) for stop, neighbors in self.items())
+
+    def edge_changed(self, stop1, stop2, distance, existed):
+        current = self.csr_version == self.version
+        self.version += 1
+        if existed and current and self.csr_graph.set_weight(stop1, stop2, distance):
+            self.csr_version = self.version
+
+    def csr(self):
+        if self.csr_version != self.version:
+            self.csr_graph = CSRGraph.from_graph(self)
+            self.csr_version = self.version
+        return self.csr_graph
+
+
+class CSRGraph:
+    """
+    Compact graph over a contiguous stop index: the neighbors of stop i are
+    neighbors[offsets[i]:offsets[i + 1]] with the matching weights, plus the same arrays for the reversed edges.
+    """
+    def __init__(self, stops, edges):
+        """
+        :param stops: Bus stop IDs, their position is the stop index.
+        :param edges: (from stop index, to stop index, distance) triples, parallel edges keep the shortest.
+        """
+        self.stops = list(stops)
+        self.index = {stop: i for i, stop in enumerate(self.stops)}
+        shortest = {}
+        for i, j, weight in edges:
+            if (i, j) not in shortest or weight < shortest[i, j]:
+                shortest[i, j] = weight
+        integral = all(isinstance(w, (int, np.integer)) for w in shortest.values())
+        dtype = np.int64 if integral else np.float64
+        n = len(self.stops)
+        source = np.fromiter((i for i, _ in shortest), dtype=np.int64, count=len(shortest))
+        target = np.fromiter((j for _, j in shortest), dtype=np.int64, count=len(shortest))
+        weight = np.fromiter(shortest.values(), dtype=dtype, count=len(shortest))
+        self.offsets, self.neighbors, self.weights = self.pack(n, source, target, weight)
+        self.reverse_offsets, self.reverse_neighbors, self.reverse_weights = self.pack(n, target, source, weight)
+        # python list copies, scalar indexing into numpy arrays is slow in the search loops
+        self.adjacency = self.unpack(self.offsets, self.neighbors, self.weights)
+        self.reverse_adjacency = self.unpack(self.reverse_offsets, self.reverse_neighbors, self.reverse_weights)
+        # (stop_coords, heuristic_scale(stop_coords)) of the last A* search, scanning every edge per query is slow
+        self.scale_cache = None
+
+    @staticmethod
+    def pack(n, source, target, weight):
+        order = np.argsort(source, kind='stable')
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(source, minlength=n), out=offsets[1:])
+        return offsets, target[order].astype(np.int32), weight[order]
+
+    @staticmethod
+    def unpack(offsets, neighbors, weights):
+        offsets, neighbors, weights = offsets.tolist(), neighbors.tolist(), weights.tolist()
+        return [list(zip(neighbors[offsets[i]:offsets[i + 1]], weights[offsets[i]:offsets[i + 1]]))
+                for i in range(len(offsets) - 1)]
+
+    @classmethod
+    def from_graph(cls, graph):
+        """
+        Pack a nested stop -> neighbor -> distance dictionary.
+        """
+        stops = set(graph)
+        for neighbors in graph.values():
+            stops.update(neighbors)
+        stops = sorted(stops)
+        index = {stop: i for i, stop in enumerate(stops)}
+        edges = [(index[stop], index[neighbor], weight)
+                 for stop, neighbors in graph.items() for neighbor, weight in neighbors.items()]
+        return cls(stops, edges)
+
+    @classmethod
+    def from_routes(cls, routes, distances):
+        """
+        Same edges as build_graph_with_distances, without building the nested dictionary.
+        """
+        stops = sorted({stop for route in routes.values() for stop in route})
+        index = {stop: i for i, stop in enumerate(stops)}
+        edges = []
+        for route in routes.values():
+            for stop1, stop2 in zip(route, route[1:]):
+                dist = distances.get((stop1, stop2), 1)
+                edges.append((index[stop1], index[stop2], dist))
+                edges.append((index[stop2], index[stop1], dist))
+        return cls(stops, edges)
+
+    def __len__(self):
+        return len(self.stops)
+
+    def weight(self, stop1, stop2):
+        """
+        :return: The distance of the edge from stop1 to stop2, or None if there's no such edge.
+        """
+        i, j = self.index.get(stop1), self.index.get(stop2)
+        if i is None or j is None:
+            return None
+        for neighbor, weight in self.adjacency[i]:
+            if neighbor == j:
+                return weight
+        return None
+
+    def set_weight(self, stop1, stop2, distance):
+        """
+        Change the distance of the existing edge from stop1 to stop2 in place.
+        :return: False if there's no such edge, adding edges needs a new CSRGraph.
+        """
+        i, j = self.index.get(stop1), self.index.get(stop2)
+        if i is None or j is None:
+            return False
+        self.scale_cache = None
+        if self.weights.dtype.kind == 'i' and not isinstance(distance, (int, np.integer)):
+            self.weights = self.weights.astype(np.float64)
+            self.reverse_weights = self.reverse_weights.astype(np.float64)
+        for adjacency, offsets, weights, row, column in ((self.adjacency, self.offsets, self.weights, i, j),
+                                                         (self.reverse_adjacency, self.reverse_offsets,
+                                                          self.reverse_weights, j, i)):
+            for k, (neighbor, _) in enumerate(adjacency[row]):
+                if neighbor == column:
+                    adjacency[row][k] = (column, distance)
+                    weights[offsets[row] + k] = distance
+                    break
+            else:
+                return False
+        return True
+
+    def path_from(self, previous, i):
+        path = []
+        while i is not None:
+            path.append(self.stops[i])
+            i = previous[i]
+        path.reverse()
+        return path
+
+    def dijkstra(self, start_stop):
+        """
+        Single source Dijkstra over every reachable stop.
+        :return: distance and previous stop index per stop index, None where unreachable.
+        """
+        n = len(self.stops)
+        distances = [None] * n
+        previous = [None] * n
+        if start_stop not in self.index:
+            return distances, previous
+        start = self.index[start_stop]
+        distances[start] = 0
+        settled = [False] * n
+        pq = [(0, start)]
+        adjacency = self.adjacency
+        while pq:
+            current_distance, current = heapq.heappop(pq)
+            if settled[current]:
+                continue
+            settled[current] = True
+            for neighbor, weight in adjacency[current]:
+                distance = current_distance + weight
+                if distances[neighbor] is None or distance < distances[neighbor]:
+                    distances[neighbor] = distance
+                    previous[neighbor] = current
+                    heapq.heappush(pq, (distance, neighbor))
+        return distances, previous
+
+    def shortest_path(self, start_stop, end_stop):
+        """
+        Bidirectional Dijkstra, searching forward from start_stop and backward from end_stop until they meet.
+        :return: The total shortest distance and the path, or None, None if there's no path.
+        """
+        if start_stop not in self.index or end_stop not in self.index:
+            return (0, [start_stop]) if start_stop == end_stop else (None, None)
+        start, end = self.index[start_stop], self.index[end_stop]
+        if start == end:
+            return 0, [start_stop]
+        # one side per direction: distances, previous / next stop index, settled flags, heap
+        sides = []
+        for origin, adjacency in ((start, self.adjacency), (end, self.reverse_adjacency)):
+            sides.append(({origin: 0}, {origin: None}, set(), [(0, origin)], adjacency))
+        best, meeting = None, None
+        while sides[0][3] and sides[1][3]:
+            if best is not None and sides[0][3][0][0] + sides[1][3][0][0] >= best:
+                break
+            # grow the side with the smaller frontier
+            side, other = (sides[0], sides[1]) if len(sides[0][3]) <= len(sides[1][3]) else (sides[1], sides[0])
+            distances, previous, settled, pq, adjacency = side
+            current_distance, current = heapq.heappop(pq)
+            if current in settled:
+                continue
+            settled.add(current)
+            for neighbor, weight in adjacency[current]:
+                distance = current_distance + weight
+                if neighbor not in distances or distance < distances[neighbor]:
+                    distances[neighbor] = distance
+                    previous[neighbor] = current
+                    heapq.heappush(pq, (distance, neighbor))
+                if neighbor in other[0]:
+                    total = distances[neighbor] + other[0][neighbor]
+                    if best is None or total < best:
+                        best, meeting = total, neighbor
+        if best is None:
+            return None, None
+        path = self.path_from(sides[0][1], meeting)
+        i = sides[1][1][meeting]
+        while i is not None:
+            path.append(self.stops[i])
+            i = sides[1][1][i]
+        return best, path
+
+    def heuristic_scale(self, stop_coords):
+        """
+        Largest factor that keeps factor * straight line distance at or below every edge distance,
+        so it never overestimates the remaining distance.
+        Cached for the stop_coords object until an edge weight changes, mutating stop_coords needs a new dict.
+        """
+        if self.scale_cache is not None and self.scale_cache[0] is stop_coords:
+            return self.scale_cache[1]
+        scale = math.inf
+        for i, adjacency in enumerate(self.adjacency):
+            if self.stops[i] not in stop_coords:
+                continue
+            x1, y1 = stop_coords[self.stops[i]]
+            for j, weight in adjacency:
+                if self.stops[j] in stop_coords:
+                    x2, y2 = stop_coords[self.stops[j]]
+                    length = math.hypot(x2 - x1, y2 - y1)
+                    if length > 0:
+                        scale = min(scale, weight / length)
+        scale = 0 if scale == math.inf else scale
+        self.scale_cache = (stop_coords, scale)
+        return scale
+
+    def astar(self, start_stop, end_stop, stop_coords, scale=None):
+        """
+        A* search guided by the straight line distance between stop_coords, scaled down to stay admissible.
+        Stops without coordinates get no guidance.
+        :return: The total shortest distance and the path, or None, None if there's no path.
+        """
+        if start_stop not in self.index or end_stop not in self.index:
+            return (0, [start_stop]) if start_stop == end_stop else (None, None)
+        if scale is None:
+            scale = self.heuristic_scale(stop_coords)
+        start, end = self.index[start_stop], self.index[end_stop]
+        target = stop_coords.get(end_stop)
+
+        def remaining(i):
+            coords = stop_coords.get(self.stops[i])
+            if target is None or coords is None:
+                return 0
+            return scale * math.hypot(coords[0] - target[0], coords[1] - target[1])
+
+        distances = {start: 0}
+        previous = {start: None}
+        pq = [(remaining(start), 0, start)]
+        while pq:
+            _, current_distance, current = heapq.heappop(pq)
+            if current_distance > distances[current]:
+                continue
+            if current == end:
+                return current_distance, self.path_from(previous, end)
+            for neighbor, weight in self.adjacency[current]:
+                distance = current_distance + weight
+                if neighbor not in distances or distance < distances[neighbor]:
+                    distances[neighbor] = distance
+                    previous[neighbor] = current
+                    heapq.heappush(pq, (distance + remaining(neighbor), distance, neighbor))
+        return None, None
+
+
+def as_csr(graph):
+    """
+    The CSRGraph to search for a StopGraph, CSRGraph or plain nested dictionary.
+    """
+    if isinstance(graph, StopGraph):
+        return graph.csr()
+    if isinstance(graph, CSRGraph):
+        return graph
+    return CSRGraph.from_graph(graph)
+
 
 def build_graph_with_distances(routes, distances):
     """
@@ -7,7 +403,7 @@ def build_graph_with_distances(routes, distances):
     :param routes: List of routes, where each route is a list of bus stop IDs.
     :param distances: A dictionary that stores custom distances between consecutive bus stops.
     """
-    graph = defaultdict(dict)  # Use nested dictionary to store distances
+    graph = StopGraph()  # Use nested dictionary to store distances
 
     for id, route in routes.items():
         for i in range(len(route) - 1):
@@ -22,125 +418,510 @@ def build_graph_with_distances(routes, distances):
 
 def dijkstra_shortest_path(graph, start_stop, end_stop):
     """
-    Use Dijkstra's algorithm to find the shortest path between two bus stops, considering custom distances.
+    Find the shortest path between two bus stops, considering custom distances.
+    Graphs from build_graph_with_distances and CSRGraph are searched with bidirectional Dijkstra on the CSR arrays.
     :param graph: The graph with custom distances.
     :param start_stop: The start bus stop ID.
     :param end_stop: The target bus stop ID.
-    :return: The total shortest distance, or None if there's no path.
+    :return: The total shortest distance and the path, or None, None if there's no path.
+    """
+    return as_csr(graph).shortest_path(start_stop, end_stop)
+
+
+def astar_shortest_path(graph, start_stop, end_stop, stop_coords):
+    """
+    Same answer as dijkstra_shortest_path, using A* with the straight line distance between stop_coords.
+    :param stop_coords: Bus stop ID -> (x, y), like stop_coords below.
+    """
+    return as_csr(graph).astar(start_stop, end_stop, stop_coords)
+
+
+def origin_searches(csr, origins):
+    return [csr.dijkstra(origin) for origin in origins]
+
+
+def batch_shortest_paths(graph, start_stops, end_stops, paths=True, workers=1):
+    """
+    Shortest paths for many (start, end) pairs at once, like a passanger OD matrix.
+    Pairs are grouped by start stop and every distinct start stop is searched once.
+    :param graph: The graph with custom distances, or a CSRGraph.
+    :param start_stops: Start bus stop ID per pair.
+    :param end_stops: Target bus stop ID per pair.
+    :param paths: Also return the path of every pair.
+    :param workers: Number of processes to spread the start stops over.
+    :return: The shortest distance per pair (-1 where there's no path), and the path per pair
+             (None where there's no path) or None when paths is False.
     """
-    # Priority queue to hold (current_distance, stop)
+    csr = as_csr(graph)
+    start_stops = np.asarray(start_stops)
+    end_stops = np.asarray(end_stops)
+    origins, inverse = np.unique(start_stops, return_inverse=True)
+    origins = origins.tolist()
+    known = [origin for origin in origins if origin in csr.index]
+    if workers > 1 and len(known) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        chunks = [known[i::workers] for i in range(min(workers, len(known)))]
+        with ProcessPoolExecutor(max_workers=len(chunks)) as pool:
+            searched = {}
+            for chunk, trees in zip(chunks, pool.map(origin_searches, [csr] * len(chunks), chunks)):
+                searched.update(zip(chunk, trees))
+    else:
+        searched = dict(zip(known, origin_searches(csr, known)))
+
+    dtype = np.int64 if csr.weights.dtype.kind == 'i' else np.float64
+    distances = np.full(len(start_stops), -1, dtype=dtype)
+    path_list = [None] * len(start_stops) if paths else None
+    end_index = np.array([csr.index.get(stop, -1) for stop in end_stops.tolist()], dtype=np.int64)
+    order = np.argsort(inverse, kind='stable')
+    groups = np.split(order, np.cumsum(np.bincount(inverse, minlength=len(origins)))[:-1])
+    for origin, rows in zip(origins, groups):
+        if origin not in searched:
+            # a stop missing from the graph only reaches itself
+            for row in rows[end_stops[rows] == origin].tolist():
+                distances[row] = 0
+                if paths:
+                    path_list[row] = [origin]
+            continue
+        origin_distances, previous = searched[origin]
+        reached = np.array([-1 if d is None else d for d in origin_distances], dtype=dtype)
+        targets = end_index[rows]
+        found = targets >= 0
+        distances[rows[found]] = reached[targets[found]]
+        if paths:
+            for row, target in zip(rows.tolist(), targets.tolist()):
+                if target >= 0 and origin_distances[target] is not None:
+                    path_list[row] = csr.path_from(previous, target)
+    return distances, path_list
+
+
+def dijkstra_tree(graph, start_stop):
+    """
+    Single source Dijkstra from start_stop to every reachable bus stop.
+    :param graph: The graph with custom distances.
+    :param start_stop: The start bus stop ID.
+    :return: The shortest distance to every reachable stop, and the previous stop on each of those paths.
+    """
+    if isinstance(graph, (StopGraph, CSRGraph)):
+        csr = graph.csr() if isinstance(graph, StopGraph) else graph
+        if start_stop not in csr.index:
+            return {start_stop: 0}, {start_stop: None}
+        distance_list, previous_list = csr.dijkstra(start_stop)
+        distances = {csr.stops[i]: d for i, d in enumerate(distance_list) if d is not None}
+        previous_stops = {csr.stops[i]: None if previous_list[i] is None else csr.stops[previous_list[i]]
+                          for i, d in enumerate(distance_list) if d is not None}
+        return distances, previous_stops
+
     pq = [(0, start_stop)]
-    distances = {start_stop: 0}  # Stores the shortest distance to each bus stop
-    previous_stops = {start_stop: None}  # To store the path
+    distances = {start_stop: 0}
+    previous_stops = {start_stop: None}
+    settled = set()
 
     while pq:
         current_distance, current_stop = heapq.heappop(pq)
+        if current_stop in settled:
+            continue
+        settled.add(current_stop)
 
-        # If we reached the destination, reconstruct the path
-        if current_stop == end_stop:
-            path = []
-            while current_stop is not None:
-                path.append(current_stop)
-                current_stop = previous_stops[current_stop]
-            path.reverse()
-            return distances[end_stop], path  # Return the distance and the path
-
-        # Explore neighbors
-        for neighbor, weight in graph[current_stop].items():
+        for neighbor, weight in graph.get(current_stop, {}).items():
             distance = current_distance + weight
-
             if neighbor not in distances or distance < distances[neighbor]:
                 distances[neighbor] = distance
                 previous_stops[neighbor] = current_stop
                 heapq.heappush(pq, (distance, neighbor))
 
-    return None, None  # No path found
-
+    return distances, previous_stops
 
-# Define Routes and Distances
 
-routes = {
-    1: [1, 2, 3, 4, 5, 6, 7, 8],  # Route 1 (1 -> 8)
-    2: [4, 9, 10, 11],             # Route 2 (4 -> 11)
-    3: [10, 12, 13, 14],           # Route 3 (10 -> 14)
-}
-
-# Define custom distances between consecutive stops
-distances = {
-    # Route 1
-    (1, 2): 5,  # 1 -> 2
-    (2, 3): 3,  # 2 -> 3
-    (3, 4): 2,  # 3 -> 4
-    (4, 5): 4,  # 4 -> 5
-    (5, 6): 6,  # 5 -> 6
-    (6, 7): 2,  # 6 -> 7
-    (7, 8): 3,  # 7 -> 8
-    # Route 2
-    (4, 9): 4,  # 4 -> 9
-    (9, 10): 5, # 9 -> 10
-    (10, 11): 2, # 10 -> 11
-    # Route 3
-    (10, 12): 4,  # 10 -> 12
-    (12, 13): 3,  # 12 -> 13
-    (13, 14): 2,  # 13 -> 14
-}
+class ShortestPathTree:
+    """
+    Single source Dijkstra tree over a CSRGraph that can be repaired after an edge distance changes,
+    touching only the stops whose distance actually changes instead of searching again from the source.
+    """
 
-# Build graph with custom distances
-graph = build_graph_with_distances(routes, distances)
+    def __init__(self, csr, start):
+        """
+        :param csr: The CSRGraph, its edges are read on every repair so change them before repairing.
+        :param start: Stop index of the source.
+        """
+        self.csr = csr
+        self.start = start
+        self.distances, self.previous = csr.dijkstra(csr.stops[start])
+        self.children = [set() for _ in self.distances]
+        for i, parent in enumerate(self.previous):
+            if parent is not None:
+                self.children[parent].add(i)
+
+    def reparent(self, i, parent):
+        if self.previous[i] is not None:
+            self.children[self.previous[i]].discard(i)
+        self.previous[i] = parent
+        if parent is not None:
+            self.children[parent].add(i)
+
+    def propagate(self, pq):
+        # Dijkstra from the changed stops, only going on through stops that got closer
+        distances = self.distances
+        adjacency = self.csr.adjacency
+        while pq:
+            current_distance, current = heapq.heappop(pq)
+            if current_distance > distances[current]:
+                continue
+            for neighbor, weight in adjacency[current]:
+                distance = current_distance + weight
+                if distances[neighbor] is None or distance < distances[neighbor]:
+                    distances[neighbor] = distance
+                    self.reparent(neighbor, current)
+                    heapq.heappush(pq, (distance, neighbor))
+
+    def edge_decreased(self, i, j, distance):
+        """
+        The edge from stop index i to j got shorter, only stops now reached more cheaply through it change.
+        """
+        if self.distances[i] is None:
+            return
+        through = self.distances[i] + distance
+        if self.distances[j] is None or through < self.distances[j]:
+            self.distances[j] = through
+            self.reparent(j, i)
+            self.propagate([(through, j)])
+
+    def edge_increased(self, i, j):
+        """
+        The edge from stop index i to j got longer, only the subtree hanging below it is searched again.
+        """
+        if self.previous[j] != i:
+            return
+        subtree = [j]
+        for k in subtree:
+            subtree.extend(self.children[k])
+        detached = set(subtree)
+        for k in subtree:
+            self.distances[k] = None
+        # best way back into the subtree from the part of the tree that kept its distances
+        pq = []
+        for k in subtree:
+            best, parent = None, None
+            for neighbor, weight in self.csr.reverse_adjacency[k]:
+                if neighbor not in detached and self.distances[neighbor] is not None:
+                    distance = self.distances[neighbor] + weight
+                    if best is None or distance < best:
+                        best, parent = distance, neighbor
+            self.reparent(k, parent)
+            if best is not None:
+                self.distances[k] = best
+                pq.append((best, k))
+        heapq.heapify(pq)
+        self.propagate(pq)
+
+    def distance(self, end):
+        return self.distances[end]
+
+    def path(self, end):
+        return self.csr.path_from(self.previous, end)
+
+
+class ShortestPathTable:
+    """
+    Answers shortest path queries on a graph from build_graph_with_distances without searching again per query.
+    Graphs with up to dense_limit stops get every pair computed up front with an array based Floyd-Warshall,
+    so a distance is one array lookup and a path is read back from the predecessor matrix.
+    Bigger graphs keep a bounded LRU cache of single source shortest path trees instead.
+    Change edge distances through update_edge / update_edges to keep what's computed and repair it.
+    A StopGraph changed directly is noticed through its version on the next query, plain dictionaries
+    need a call to invalidate.
+    """
 
-# Example usage: Find the shortest path between Stop 1 and Stop 14
-start_id = 1
-end_id = 14
+    def __init__(self, graph, dense_limit=1000, cache_size=256):
+        """
+        :param graph: The graph with custom distances.
+        :param dense_limit: Largest number of stops to compute all pairs for.
+        :param cache_size: Number of single source trees kept for graphs bigger than dense_limit.
+        """
+        self.graph = graph
+        self.dense_limit = dense_limit
+        self.cache_size = cache_size
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Forget everything computed so far, the next query works from the current graph.
+        """
+        self.csr = self.graph.csr() if isinstance(self.graph, StopGraph) else CSRGraph.from_graph(self.graph)
+        # graph version everything below was computed for
+        self.version = self.graph.version if isinstance(self.graph, StopGraph) else None
+        self.stops = self.csr.stops
+        self.index = self.csr.index
+        self.dense = len(self.stops) <= self.dense_limit
+        self.dist = None
+        self.pred = None
+        # rows of dist / pred that an edge getting longer made out of date
+        self.stale = set()
+        self.trees = OrderedDict()
+
+    def update_edge(self, stop1, stop2, distance):
+        """
+        Set the distance between two consecutive stops in both directions, same as build_graph_with_distances.
+        """
+        self.update_edges([(stop1, stop2, distance)])
+
+    def update_edges(self, changes):
+        """
+        Apply a batch of (stop1, stop2, distance) changes, each one in both directions.
+        Changing the distance of existing edges keeps everything computed so far and repairs only what the
+        change affects, new edges or new stops start over like invalidate.
+        """
+        self.check_version()
+        # the last change of an edge wins
+        final = {}
+        for stop1, stop2, distance in changes:
+            final[stop1, stop2] = final[stop2, stop1] = distance
+        directed = [(stop1, stop2, distance) for (stop1, stop2), distance in final.items()]
+        old = [self.csr.weight(stop1, stop2) for stop1, stop2, _ in directed]
+        for stop1, stop2, distance in directed:
+            self.graph[stop1][stop2] = distance
+        if any(weight is None for weight in old) or not self.set_weights(directed):
+            self.invalidate()
+            return
+        if self.version is not None:
+            self.version = self.graph.version
+
+        for (stop1, stop2, distance), weight in zip(directed, old):
+            i, j = self.index[stop1], self.index[stop2]
+            if distance > weight:
+                for tree in self.trees.values():
+                    tree.edge_increased(i, j)
+                if self.dist is not None:
+                    self.stale.update(np.flatnonzero(self.pred[:, j] == i).tolist())
+        for (stop1, stop2, distance), weight in zip(directed, old):
+            i, j = self.index[stop1], self.index[stop2]
+            if distance < weight:
+                for tree in self.trees.values():
+                    tree.edge_decreased(i, j, distance)
+                if self.dist is not None:
+                    self.edge_decreased(i, j, distance)
+
+    def check_version(self):
+        """
+        Start over if the StopGraph changed since the last query without going through update_edges.
+        """
+        if self.version is not None and self.version != self.graph.version:
+            self.invalidate()
+
+    def set_weights(self, directed):
+        if isinstance(self.graph, StopGraph):
+            # the graph already changed its CSR copy in place, unless it had to start over
+            if self.graph.csr() is not self.csr:
+                return False
+        else:
+            for stop1, stop2, distance in directed:
+                self.csr.set_weight(stop1, stop2, distance)
+        if self.dist is not None and self.dist.dtype.kind == 'i' and self.csr.weights.dtype.kind == 'f':
+            # the matrix can't hold fractional distances, compute it again
+            self.dist = None
+            self.pred = None
+            self.stale.clear()
+        return True
+
+    def edge_decreased(self, i, j, distance):
+        self.refresh_stale()
+        # every pair whose path gets shorter by going through the edge i -> j
+        through = self.dist[:, i, None] + distance + self.dist[j]
+        if self.dist.dtype.kind == 'i':
+            through[(self.dist[:, i] >= self.unreachable)[:, None] | (self.dist[j] >= self.unreachable)] = \
+                self.unreachable
+        shorter = through < self.dist
+        pred_through = self.pred[j].copy()
+        pred_through[j] = i
+        np.copyto(self.dist, through, where=shorter)
+        np.copyto(self.pred, pred_through[None, :], where=shorter)
+
+    def refresh_stale(self):
+        for i in self.stale:
+            distances, previous = self.csr.dijkstra(self.stops[i])
+            self.dist[i] = [self.unreachable if d is None else d for d in distances]
+            self.pred[i] = [-1 if p is None else p for p in previous]
+        self.stale.clear()
+
+    def compute_all_pairs(self):
+        n = len(self.stops)
+        integral = self.csr.weights.dtype.kind == 'i'
+        # integer distances stay exact, unreachable pairs hold `unreachable`
+        self.unreachable = np.iinfo(np.int64).max // 4 if integral else np.inf
+        dist = np.full((n, n), self.unreachable, dtype=np.int64 if integral else np.float64)
+        pred = np.full((n, n), -1, dtype=np.int64)
+        for i, neighbors in enumerate(self.csr.adjacency):
+            for j, weight in neighbors:
+                if weight < dist[i, j]:
+                    dist[i, j] = weight
+                    pred[i, j] = i
+        np.fill_diagonal(dist, 0)
+        np.fill_diagonal(pred, -1)
+
+        through_k = np.empty_like(dist)
+        shorter = np.empty((n, n), dtype=bool)
+        for k in range(n):
+            np.add(dist[:, k, None], dist[k], out=through_k)
+            np.less(through_k, dist, out=shorter)
+            np.copyto(dist, through_k, where=shorter)
+            np.copyto(pred, pred[k], where=shorter)
+        if integral:
+            dist[dist >= self.unreachable] = self.unreachable
+        self.dist = dist
+        self.pred = pred
+        self.stale.clear()
+
+    def tree(self, start_stop):
+        tree = self.trees.get(start_stop)
+        if tree is None:
+            tree = ShortestPathTree(self.csr, self.index[start_stop])
+            self.trees[start_stop] = tree
+            if len(self.trees) > self.cache_size:
+                self.trees.popitem(last=False)
+        else:
+            self.trees.move_to_end(start_stop)
+        return tree
+
+    def distance(self, start_stop, end_stop):
+        """
+        :return: The total shortest distance, or None if there's no path.
+        """
+        self.check_version()
+        if start_stop not in self.index or end_stop not in self.index:
+            return 0 if start_stop == end_stop else None
+        if self.dense:
+            if self.dist is None:
+                self.compute_all_pairs()
+            if self.stale:
+                self.refresh_stale()
+            distance = self.dist[self.index[start_stop], self.index[end_stop]]
+            return None if distance == self.unreachable else distance.item()
+        return self.tree(start_stop).distance(self.index[end_stop])
+
+    def path(self, start_stop, end_stop):
+        """
+        :return: The bus stops from start_stop to end_stop, or None if there's no path.
+        """
+        if self.distance(start_stop, end_stop) is None:
+            return None
+        if start_stop == end_stop:
+            return [start_stop]
+        if not self.dense:
+            return self.tree(start_stop).path(self.index[end_stop])
+        path = [end_stop]
+        i, j = self.index[start_stop], self.index[end_stop]
+        while j != i:
+            j = self.pred[i, j]
+            path.append(self.stops[j])
+        path.reverse()
+        return path
+
+    def shortest_path(self, start_stop, end_stop):
+        """
+        Same answer as dijkstra_shortest_path.
+        :return: The total shortest distance and the path, or None, None if there's no path.
+        """
+        distance = self.distance(start_stop, end_stop)
+        if distance is None:
+            return None, None
+        return distance, self.path(start_stop, end_stop)
+
+
+def route_colors(count: int) -> list[str]:
+    """
+    count colors, cycling through the plotly qualitative palette so any number of routes can be drawn.
+    """
+    import plotly.colors
 
-shortest_distance, path = dijkstra_shortest_path(graph, start_id, end_id)
+    palette = plotly.colors.qualitative.Plotly
+    return [palette[i % len(palette)] for i in range(count)]
 
-if shortest_distance is not None:
-    print(f"The shortest distance from Stop {start_id} to Stop {end_id} is {shortest_distance} units.")
-    print(f"The path is: {' -> '.join(map(str, path))}")
-else:
-    print(f"No path found between Stop {start_id} and Stop {end_id}.")
 
-import plotly.graph_objects as go
+def polyline(stop_coords, stops):
+    """
+    x and y of a line through stops, broken with None wherever a stop has no coordinates.
+    """
+    x_vals, y_vals = [], []
+    for stop in stops:
+        if stop in stop_coords:
+            x, y = stop_coords[stop]
+            x_vals.append(x)
+            y_vals.append(y)
+        elif x_vals and x_vals[-1] is not None:
+            x_vals.append(None)
+            y_vals.append(None)
+    return x_vals, y_vals
+
+
+def write_figure(fig, output=None):
+    """
+    Show a plotly figure, or write it to output without opening a browser:
+    .html as a standalone page, anything else (.png, .svg, .pdf) through kaleido.
+    """
+    if output is None:
+        fig.show()
+    elif str(output).lower().endswith(('.html', '.htm')):
+        fig.write_html(output)
+    else:
+        fig.write_image(output)
 
 
-def plot_bus_routes(stop_coords, routes, shortest_path=None):
+def plot_bus_routes(stop_coords, routes, shortest_path=None, output=None, webgl=None, label_limit=200,
+                    route_trace_limit=50):
     """
     Plots bus routes and their stops using Plotly.
     The shortest path can optionally be highlighted.
+    All stops go in one trace and every route in one line, so large networks stay a handful of traces.
+    :param output: .html or image file to write the figure to instead of showing it.
+    :param webgl: Draw with Scattergl, defaults to on once there are more than 10000 points.
+    :param label_limit: Stops are only labelled with their id up to this many stops.
+    :param route_trace_limit: Past this many routes they all go in a single grey trace, broken with None.
+    :return: The plotly Figure.
     """
-    fig = go.Figure()
-    # Plot bus stops as scatter points
-    for stop, (x, y) in stop_coords.items():
-        fig.add_trace(go.Scatter(
-            x=[x],
-            y=[y],
-            mode='markers+text',
-            text=[str(stop)],
-            textposition="top center",
-            marker=dict(size=10, color='blue', line=dict(width=2, color='black')),
-            showlegend=False
-        ))
+    import plotly.graph_objects as go
 
+    points = len(stop_coords) + sum(len(route) for route in routes.values())
+    scatter = go.Scattergl if (webgl if webgl is not None else points > 10000) else go.Scatter
+
+    fig = go.Figure()
     # Plot routes
-    colors = ['red', 'green', 'purple']  # Different colors for each route
-    for route_id, route in routes.items():
-        x_vals = [stop_coords[stop][0] for stop in route]
-        y_vals = [stop_coords[stop][1] for stop in route]
-        fig.add_trace(go.Scatter(
-            x=x_vals,
-            y=y_vals,
-            mode='lines+markers',
-            name=f"Route {route_id}",
-            line=dict(color=colors[route_id - 1], width=4),
-            marker=dict(size=8, color=colors[route_id - 1]),
-            showlegend=False
-        ))
+    if len(routes) <= route_trace_limit:
+        for color, (route_id, route) in zip(route_colors(len(routes)), routes.items()):
+            x_vals, y_vals = polyline(stop_coords, route)
+            fig.add_trace(scatter(
+                x=x_vals,
+                y=y_vals,
+                mode='lines+markers',
+                name=f"Route {route_id}",
+                line=dict(color=color, width=4),
+                marker=dict(size=8, color=color),
+                showlegend=False
+            ))
+    else:
+        x_vals, y_vals = [], []
+        for route in routes.values():
+            route_x, route_y = polyline(stop_coords, route)
+            x_vals += route_x + [None]
+            y_vals += route_y + [None]
+        fig.add_trace(scatter(x=x_vals, y=y_vals, mode='lines', name="Routes",
+                              line=dict(color='grey', width=1), showlegend=False))
+
+    # Plot bus stops as scatter points, over the routes
+    labelled = len(stop_coords) <= label_limit
+    fig.add_trace(scatter(
+        x=[x for x, _ in stop_coords.values()],
+        y=[y for _, y in stop_coords.values()],
+        mode='markers+text' if labelled else 'markers',
+        text=[str(stop) for stop in stop_coords],
+        textposition="top center",
+        hoverinfo='text',
+        marker=dict(size=10 if labelled else 4, color='blue', line=dict(width=2 if labelled else 0, color='black')),
+        showlegend=False
+    ))
 
     # Plot the shortest path if provided
     if shortest_path:
-        shortest_x = [stop_coords[stop][0] for stop in shortest_path]
-        shortest_y = [stop_coords[stop][1] for stop in shortest_path]
-        fig.add_trace(go.Scatter(
+        shortest_x, shortest_y = polyline(stop_coords, shortest_path)
+        fig.add_trace(scatter(
             x=shortest_x,
             y=shortest_y,
             mode='lines+markers',
@@ -169,7 +950,8 @@ def plot_bus_routes(stop_coords, routes, shortest_path=None):
         plot_bgcolor="white"
     )
 
-    fig.show()
+    write_figure(fig, output)
+    return fig
 
 
 # Example data to plot
@@ -202,20 +984,3 @@ distances = {
     (4, 9): 4, (9, 10): 5, (10, 11): 2,  # Route 2
     (10, 12): 4, (12, 13): 3, (13, 14): 2,  # Route 3
 }
-
-# Build the graph with custom distances
-graph = build_graph_with_distances(routes, distances)
-
-# Find the shortest path from Stop 1 to Stop 14
-start_id = 8
-end_id = 11
-shortest_distance, path = dijkstra_shortest_path(graph, start_id, end_id)
-
-if shortest_distance is not None:
-    print(f"The shortest distance from Stop {start_id} to Stop {end_id} is {shortest_distance} units.")
-    print(f"The path is: {' -> '.join(map(str, path))}")
-    # Plot routes and highlight the shortest path
-    plot_bus_routes(stop_coords, routes, path)
-else:
-    print(f"No path found between Stop {start_id} and Stop {end_id}.")
-
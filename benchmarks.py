@@ -0,0 +1,366 @@
+"""
+Scaling benchmarks for the simulation and routing hot paths.
+
+    python -m benchmarks run --scale small medium --label my-change --output bench.json
+    python -m benchmarks compare baseline.json bench.json
+
+Every case runs in a fresh process so peak RSS belongs to that case alone.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+
+# stops, routes, buses, passangers, shortest path queries
+scales = {
+    'small': dict(stops=15, routes=3, buses=20, passangers=2_000, queries=1_000),
+    'medium': dict(stops=100, routes=10, buses=200, passangers=50_000, queries=10_000),
+    'large': dict(stops=1_000, routes=50, buses=2_000, passangers=1_000_000, queries=10_000),
+}
+# one SimPy process per passanger stops being reasonable to run past this
+maxPassangerModeSize = 200_000
+
+
+def synthetic_routes(stops: int, routes: int, rng: np.random.Generator) -> dict[int, list[int]]:
+    """
+    Routes over stop ids 1..stops, each one an increasing run of at least 2 stops so travel_time stays positive.
+    """
+    network = {}
+    for routeId in range(1, routes + 1):
+        length = int(rng.integers(2, min(stops, 40) + 1))
+        network[routeId] = sorted(rng.choice(np.arange(1, stops + 1), size=length, replace=False).tolist())
+    return network
+
+
+def synthetic_scenario(stops: int, routes: int, buses: int, passangers: int, seed: int = 0, **_):
+    """
+    Buses spread over synthetic routes, and passangers who can all be served by at least one route,
+    arriving uniformly over the service period.
+    :return: routes, buses and a PassengerTable.
+    """
+    import bus
+
+    rng = np.random.default_rng(seed)
+    network = synthetic_routes(stops, routes, rng)
+    routeIds = list(network)
+    fleet = []
+    horizon = 0
+    for busId in range(buses):
+        routeId = routeIds[busId % len(routeIds)]
+        startTime = int(rng.integers(0, 3_600_000))
+        fleet.append(bus.Bus(id=busId, route=bus.Route(routeId, network[routeId]), startTime=startTime))
+        horizon = max(horizon, startTime)
+
+    taken = rng.integers(0, len(routeIds), size=passangers)
+    departBusStop = np.empty(passangers, dtype=np.int32)
+    arriveBusStop = np.empty(passangers, dtype=np.int32)
+    for routeIdx, routeId in enumerate(routeIds):
+        rows = np.flatnonzero(taken == routeIdx)
+        sequence = np.array(network[routeId])
+        first = rng.integers(0, len(sequence) - 1, size=len(rows))
+        last = first + 1 + (rng.random(len(rows)) * (len(sequence) - 1 - first)).astype(np.int64)
+        departBusStop[rows] = sequence[first]
+        arriveBusStop[rows] = sequence[last]
+    timeAtStop = np.sort(rng.integers(0, horizon + 1, size=passangers))
+    return network, fleet, bus.PassengerTable.from_arrays(departBusStop, arriveBusStop, timeAtStop)
+
+
+def build_timetables(fleet):
+    import bus
+
+    return bus.Timetable.from_buses(fleet)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is kilobytes on linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if platform.system() == 'Darwin' else peak / (1 << 10)
+
+
+def measure(run, trackAllocations: bool, repeat: int):
+    """
+    Time run() repeat times keeping the fastest, then run it again under tracemalloc when allocations are wanted.
+    run returns a dict of extra numbers for the record.
+    """
+    walls = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        extra = run() or {}
+        walls.append(time.perf_counter() - start)
+    record = {'wall': min(walls), 'walls': walls, **extra}
+    if trackAllocations:
+        tracemalloc.start()
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        record['allocPeakBytes'] = peak
+    return record
+
+
+def case_generate_passangers(params, trackAllocations, repeat):
+    import bus
+
+    perStop = max(1, params['passangers'] // (len(bus.busStopDict) - 1))
+
+    def run():
+        bus.generatePassangers(random.Random(0), perStop=perStop)
+        return {'passangers': perStop * (len(bus.busStopDict) - 1)}
+    return measure(run, trackAllocations, repeat)
+
+
+def case_generate_demand(params, trackAllocations, repeat):
+    import demand
+
+    origins = list(range(1, params['stops']))
+    perStop = max(1, params['passangers'] // len(origins))
+
+    def run():
+        demand.generate_demand(0, stops=range(1, params['stops'] + 1), perStop=perStop)
+        return {'passangers': perStop * len(origins)}
+    return measure(run, trackAllocations, repeat)
+
+
+def case_define_bus_table(params, trackAllocations, repeat):
+    _, fleet, _ = synthetic_scenario(**params)
+
+    def run():
+        build_timetables(fleet)
+        return {'segments': sum(len(b.route.busStopSequence) - 1 for b in fleet)}
+    return measure(run, trackAllocations, repeat)
+
+
+def case_travel_time_model(params, trackAllocations, repeat):
+    from traveltime import TravelTimeModel
+    import bus
+
+    _, fleet, _ = synthetic_scenario(**params)
+    model = TravelTimeModel(bandStarts=[0, 1_800_000], multipliers=[1.5, 1.0], noise=0.2)
+
+    def run():
+        bus.Timetable.from_model(fleet, model, np.random.default_rng(0))
+        return {'segments': sum(len(b.route.busStopSequence) - 1 for b in fleet)}
+    return measure(run, trackAllocations, repeat)
+
+
+def simulation_case(mode, engine='simpy'):
+    def case(params, trackAllocations, repeat):
+        import simpy
+        import bus
+
+        _, fleet, table = synthetic_scenario(**params)
+        timetable = build_timetables(fleet)
+
+        def run():
+            table.onBus[:] = -1
+            table.leaveBus[:] = -1
+            table.busId[:] = -1
+            table.status[:] = bus.PassengerTable.WAITING
+            sim = bus.BusSimulation(buses=timetable, passangers=table, mode=mode, engine=engine)
+            events = 0
+            if engine == 'heap':
+                sim.env.run()
+                events = sim.env.handled
+            else:
+                try:
+                    while True:
+                        sim.env.step()
+                        events += 1
+                except simpy.core.EmptySchedule:
+                    pass
+            sim.runAirSim()
+            return {'passangers': len(table), 'events': events, 'served': int((table.onBus >= 0).sum())}
+        record = measure(run, trackAllocations, repeat)
+        record['eventsPerSec'] = record['events'] / record['wall'] if record['wall'] else None
+        # the heap engine handles fewer events for the same passangers, so compare engines on this instead
+        record['passangersPerSec'] = record['passangers'] / record['wall'] if record['wall'] else None
+        return record
+    return case
+
+
+def case_solve_analytic(params, trackAllocations, repeat):
+    import bus
+
+    _, fleet, table = synthetic_scenario(**params)
+    timetable = build_timetables(fleet)
+
+    def run():
+        onBus, _, _ = bus.solve_analytic(timetable, table)
+        return {'passangers': len(table), 'served': int((onBus >= 0).sum())}
+    return measure(run, trackAllocations, repeat)
+
+
+def routing_queries(params):
+    """
+    Synthetic network with random integer distances and random (start, end) stop pairs on it.
+    """
+    rng = np.random.default_rng(params.get('seed', 0))
+    network = synthetic_routes(params['stops'], params['routes'], rng)
+    distances = {}
+    for route in network.values():
+        for stop1, stop2 in zip(route, route[1:]):
+            distances[stop1, stop2] = int(rng.integers(1, 10))
+    stops = sorted({stop for route in network.values() for stop in route})
+    return network, distances, rng.choice(stops, size=(params['queries'], 2)).tolist()
+
+
+def case_dijkstra(params, trackAllocations, repeat):
+    import Routes
+
+    network, distances, queries = routing_queries(params)
+
+    def run():
+        graph = Routes.build_graph_with_distances(network, distances)
+        found = 0
+        for start, end in queries:
+            found += Routes.dijkstra_shortest_path(graph, start, end)[0] is not None
+        return {'queries': len(queries), 'found': found}
+    record = measure(run, trackAllocations, repeat)
+    record['queriesPerSec'] = record['queries'] / record['wall'] if record['wall'] else None
+    return record
+
+
+def case_batch_shortest_paths(params, trackAllocations, repeat):
+    import Routes
+
+    network, distances, queries = routing_queries(params)
+    start_stops, end_stops = np.array(queries).T
+
+    def run():
+        graph = Routes.build_graph_with_distances(network, distances)
+        found, _ = Routes.batch_shortest_paths(graph, start_stops, end_stops)
+        return {'queries': len(queries), 'found': int((found >= 0).sum())}
+    record = measure(run, trackAllocations, repeat)
+    record['queriesPerSec'] = record['queries'] / record['wall'] if record['wall'] else None
+    return record
+
+
+cases = {
+    'generatePassangers': case_generate_passangers,
+    'generate_demand': case_generate_demand,
+    'define_bus_table': case_define_bus_table,
+    'TravelTimeModel': case_travel_time_model,
+    'BusSimulation-passanger': simulation_case('passanger'),
+    'BusSimulation-batched': simulation_case('batched'),
+    'BusSimulation-passanger-heap': simulation_case('passanger', 'heap'),
+    'BusSimulation-batched-heap': simulation_case('batched', 'heap'),
+    'solve_analytic': case_solve_analytic,
+    'dijkstra_shortest_path': case_dijkstra,
+    'batch_shortest_paths': case_batch_shortest_paths,
+}
+
+
+def run_case(name, params, trackAllocations, repeat):
+    record = cases[name](params, trackAllocations, repeat)
+    record['peakRssMB'] = peak_rss_mb()
+    if trackAllocations and record.get('passangers'):
+        record['allocBytesPerPassanger'] = record['allocPeakBytes'] / record['passangers']
+    return record
+
+
+def run_isolated(name, params, trackAllocations, repeat):
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(run_case, (name, params, trackAllocations, repeat))
+
+
+def git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmarks(scaleNames=('small',), caseNames=None, trackAllocations=True, label=None, seed=0, repeat=3):
+    """
+    Run every case at every scale, each in its own process.
+    :return: JSON serialisable report, see compare_reports.
+    """
+    report = {
+        'label': label or git_version(),
+        'version': git_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'results': [],
+    }
+    for scaleName in scaleNames:
+        params = dict(scales[scaleName], seed=seed)
+        for name in caseNames or cases:
+            if name == 'BusSimulation-passanger' and params['passangers'] > maxPassangerModeSize:
+                continue
+            record = run_isolated(name, params, trackAllocations, repeat)
+            report['results'].append({'case': name, 'scale': scaleName, 'params': params, **record})
+            print(f'{scaleName:>6} {name:<28} {record["wall"]:9.3f}s  rss {record["peakRssMB"]:8.1f} MB'
+                  + (f'  {record["eventsPerSec"]:,.0f} events/s' if record.get('eventsPerSec') else '')
+                  + (f'  {record["passangersPerSec"]:,.0f} passangers/s' if record.get('passangersPerSec') else ''))
+    return report
+
+
+def compare_reports(old: dict, new: dict, threshold: float = 0.1, minWall: float = 0.01):
+    """
+    Pair up the cases of two reports and flag any that got slower or bigger by more than threshold.
+    Wall times below minWall seconds are too noisy to flag.
+    :return: list of (case, scale, metric, old value, new value, ratio, regressed).
+    """
+    oldResults = {(r['case'], r['scale']): r for r in old['results']}
+    rows = []
+    for result in new['results']:
+        previous = oldResults.get((result['case'], result['scale']))
+        if previous is None:
+            continue
+        for metric in ('wall', 'peakRssMB', 'allocBytesPerPassanger'):
+            if previous.get(metric) and result.get(metric) is not None:
+                ratio = result[metric] / previous[metric]
+                regressed = ratio > 1 + threshold and (metric != 'wall' or result[metric] >= minWall)
+                rows.append((result['case'], result['scale'], metric, previous[metric], result[metric], ratio,
+                             regressed))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run')
+    run.add_argument('--scale', nargs='+', choices=list(scales), default=['small'])
+    run.add_argument('--case', nargs='+', choices=list(cases), default=None)
+    run.add_argument('--no-alloc', action='store_true', help='skip the tracemalloc pass')
+    run.add_argument('--label', default=None, help='name for this run, defaults to git describe')
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--repeat', type=int, default=3, help='timed runs per case, the fastest one is kept')
+    run.add_argument('--output', default='bench.json')
+    compare = commands.add_parser('compare')
+    compare.add_argument('old')
+    compare.add_argument('new')
+    compare.add_argument('--threshold', type=float, default=0.1, help='allowed relative growth, 0.1 is 10%%')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        report = run_benchmarks(args.scale, args.case, not args.no_alloc, args.label, args.seed, args.repeat)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        return 0
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    rows = compare_reports(old, new, args.threshold)
+    for case, scale, metric, before, after, ratio, regressed in rows:
+        print(f'{scale:>6} {case:<24} {metric:<22} {before:12.3f} -> {after:12.3f}  x{ratio:5.2f}'
+              + ('  REGRESSION' if regressed else ''))
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,16 +1,30 @@
 
 import math
+import bisect
+from datetime import datetime
 
-import pandas
-import simpy
+import numpy as np
 import collections
+import itertools
 import random
+
+import eventlog
+from eventcore import EventCore
+from eventlog import EventLog, EventKind
+from metrics import Metrics
+from results import ResultsWriter
+from simtime import SimTime
+from transfers import TransferPlanner
+from traveltime import TravelTimeModel
 fly_seg = collections.namedtuple('flyseg', 'bus segId')
 busStopDict = {1: 'Oruamo Domain', 2: 'Roberts Road', 3: 'Coronation Road', 4: 'McDowell Crescent',
                5:'Coroglen Avenue', 6:'Pupuke Road', 7:'Waratah Street', 8:'Birkenhead Avenue', 9:'Aorangi Place',
                10:'Park Avenue', 11:'Onewa Road', 12:'St Mary Catholic Church', 13:'Northcote Primary School', 14:'Bruce Street',15:'Fanshawe Street'}
 busNameToId = {value: key for key, value in busStopDict.items()}
+# bus id -> BusTime list per segment, filled by define_bus_table. Timetable is the compiled form the engines run on
 flyTime = {}
+# a passanger gives up waiting after 100s -> 100000 millonsec
+leaveAngryTime = 100 * 1000
 
 class Busstation:
     def __init__(self, id, name):
@@ -55,7 +69,6 @@ class Passanger:
         self.timeAtStop = timeAtStop
         self.on_bus = None
         self.leave_bus = None
-        self.busId = None
     def __str__(self):
         return f'passange {self.id} fly from  {busStopDict[self.departBusStop]} to {busStopDict[self.arriveBusStop]}'
     def __repr__(self):
@@ -71,6 +84,257 @@ class Passanger:
     def get_on_bus(self):
         return self.on_bus
 
+class PassengerTable:
+    """
+    Struct of arrays storage for a whole passanger population, one numpy column per field.
+    Engines read and write it by passanger index, -1 marks a bus / time that is not set yet.
+    A passanger changing bus keeps onBus / busId of the first bus he got on, leaveBus is when he last got off
+    and transfers counts the changes so far, which is also the leg of his journey he is on.
+    """
+    # status codes
+    WAITING = 0
+    ON_BUS = 1
+    ARRIVED = 2
+    ANGRY = 3
+    NO_BUS = 4
+    columns = ('id', 'departBusStop', 'arriveBusStop', 'timeAtStop', 'onBus', 'leaveBus', 'busId', 'status',
+               'transfers')
+
+    def __init__(self, size: int = 0):
+        self.id = np.arange(size, dtype=np.int64)
+        self.departBusStop = np.zeros(size, dtype=np.int32)
+        self.arriveBusStop = np.zeros(size, dtype=np.int32)
+        self.timeAtStop = np.zeros(size, dtype=np.int64)
+        self.onBus = np.full(size, -1, dtype=np.int64)
+        self.leaveBus = np.full(size, -1, dtype=np.int64)
+        self.busId = np.full(size, -1, dtype=np.int32)
+        self.status = np.zeros(size, dtype=np.int8)
+        self.transfers = np.zeros(size, dtype=np.int8)
+
+    @classmethod
+    def from_arrays(cls, departBusStop, arriveBusStop, timeAtStop, id=None):
+        table = cls(len(timeAtStop))
+        table.departBusStop[:] = departBusStop
+        table.arriveBusStop[:] = arriveBusStop
+        table.timeAtStop[:] = timeAtStop
+        if id is not None:
+            table.id[:] = id
+        return table
+
+    @classmethod
+    def from_passangers(cls, passangers: list[Passanger]):
+        n = len(passangers)
+        table = cls.from_arrays(np.fromiter((p.departBusStop for p in passangers), dtype=np.int32, count=n),
+                                np.fromiter((p.arriveBusStop for p in passangers), dtype=np.int32, count=n),
+                                np.fromiter((p.timeAtStop for p in passangers), dtype=np.int64, count=n),
+                                id=np.fromiter((p.id for p in passangers), dtype=np.int64, count=n))
+        for idx, p in enumerate(passangers):
+            if p.on_bus is not None:
+                table.set_on_bus(idx, p.on_bus, p.busId)
+            if p.leave_bus is not None:
+                table.set_leave_bus(idx, p.leave_bus)
+        return table
+
+    def copy_results_to(self, passangers: list[Passanger]):
+        """
+        Write on bus / leave bus results back into Passanger objects, for code that still uses them.
+        """
+        for p, onBus, busId, leaveBus in zip(passangers, self.onBus.tolist(), self.busId.tolist(),
+                                             self.leaveBus.tolist()):
+            p.on_bus = None if onBus < 0 else onBus
+            p.busId = None if busId < 0 else busId
+            p.leave_bus = None if leaveBus < 0 else leaveBus
+
+    def __len__(self):
+        return len(self.timeAtStop)
+
+    def resize(self, size: int):
+        """
+        Grow or shrink every column, rows added at the end start unset.
+        """
+        fresh = PassengerTable(size)
+        keep = min(size, len(self))
+        for name in self.columns:
+            column = getattr(fresh, name)
+            column[:keep] = getattr(self, name)[:keep]
+            setattr(self, name, column)
+
+    def __getitem__(self, idx):
+        return PassangerView(self, idx)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield PassangerView(self, idx)
+
+    def set_on_bus(self, idx, onBusTime: int, busId: int):
+        self.onBus[idx] = onBusTime
+        self.busId[idx] = busId
+        self.status[idx] = self.ON_BUS
+
+    def set_leave_bus(self, idx, leaveBusTime: int):
+        self.leaveBus[idx] = leaveBusTime
+        self.status[idx] = self.ARRIVED
+
+
+class PassangerView:
+    """
+    Passanger-like view of one row of a PassengerTable, so code written against Passanger keeps working.
+    """
+    __slots__ = ('table', 'idx')
+
+    def __init__(self, table: PassengerTable, idx: int):
+        self.table = table
+        self.idx = idx
+
+    @property
+    def id(self):
+        return int(self.table.id[self.idx])
+
+    @property
+    def departBusStop(self):
+        return int(self.table.departBusStop[self.idx])
+
+    @property
+    def arriveBusStop(self):
+        return int(self.table.arriveBusStop[self.idx])
+
+    @property
+    def timeAtStop(self):
+        return int(self.table.timeAtStop[self.idx])
+
+    @property
+    def busId(self):
+        busId = int(self.table.busId[self.idx])
+        return None if busId < 0 else busId
+
+    @property
+    def on_bus(self):
+        onBus = int(self.table.onBus[self.idx])
+        return None if onBus < 0 else onBus
+
+    @property
+    def leave_bus(self):
+        leaveBus = int(self.table.leaveBus[self.idx])
+        return None if leaveBus < 0 else leaveBus
+
+    def __str__(self):
+        return f'passange {self.id} fly from  {busStopDict[self.departBusStop]} to {busStopDict[self.arriveBusStop]}'
+    def __repr__(self):
+        return self.__str__()
+
+    def set_on_bus(self, onBusTime:int, butId: int):
+        self.table.set_on_bus(self.idx, onBusTime, butId)
+
+    def set_leave_bus(self, leaveBusTime:int):
+        self.table.set_leave_bus(self.idx, leaveBusTime)
+
+    def get_on_bus(self):
+        return self.on_bus
+
+
+class ArrivalStream:
+    """
+    Passangers in show up order, handed out as blocks of (id, departBusStop, arriveBusStop, timeAtStop) arrays,
+    so a simulation only has to hold the ones who already showed up.
+    """
+    def __init__(self, blocks):
+        """
+        :param blocks: Iterable of (id, departBusStop, arriveBusStop, timeAtStop) array tuples in show up order.
+        """
+        self.blocks = blocks
+
+    def __iter__(self):
+        last = None
+        for block in self.blocks:
+            id, departBusStop, arriveBusStop, timeAtStop = (np.asarray(column, dtype=np.int64) for column in block)
+            if len(timeAtStop) == 0:
+                continue
+            if np.any(np.diff(timeAtStop) < 0) or (last is not None and timeAtStop[0] < last):
+                raise ValueError('passangers must arrive in show up order, sort them by show time first '
+                                 '(from_csv(..., sort=True) does)')
+            last = timeAtStop[-1]
+            yield id, departBusStop, arriveBusStop, timeAtStop
+
+    @classmethod
+    def from_table(cls, table: PassengerTable, blockSize: int = 1 << 14):
+        order = np.argsort(table.timeAtStop, kind='stable')
+
+        def blocks():
+            for start in range(0, len(order), blockSize):
+                rows = order[start:start + blockSize]
+                yield table.id[rows], table.departBusStop[rows], table.arriveBusStop[rows], table.timeAtStop[rows]
+        return cls(blocks())
+
+    @classmethod
+    def from_arrays(cls, id, departBusStop, arriveBusStop, timeAtStop, blockSize: int = 1 << 14):
+        """
+        Columns already in show up order, handed out blockSize rows at a time.
+        """
+        def blocks():
+            for start in range(0, len(timeAtStop), blockSize):
+                end = start + blockSize
+                yield id[start:end], departBusStop[start:end], arriveBusStop[start:end], timeAtStop[start:end]
+        return cls(blocks())
+
+    @classmethod
+    def from_iterable(cls, passangers, blockSize: int = 1 << 14):
+        """
+        :param passangers: (id, departBusStop, arriveBusStop, timeAtStop) tuples in show up order, e.g. a generator.
+        """
+        def blocks():
+            iterator = iter(passangers)
+            while True:
+                chunk = list(itertools.islice(iterator, blockSize))
+                if not chunk:
+                    return
+                yield np.array(chunk, dtype=np.int64).reshape(-1, 4).T
+        return cls(blocks())
+
+    @classmethod
+    def from_csv(cls, path: str, blockSize: int = 1 << 16, stopIds: dict[str, int] = None, sort: bool = False):
+        """
+        Replay a csv with 'id', 'start', 'dest' and 'show time' columns, like the ResultsWriter output.
+        Only blockSize rows are read at a time, so the file has to be sorted by show time already, unless sort
+        is set: then the whole file is read and sorted first, ResultsWriter writes passangers as they get off.
+        :param stopIds: Bus stop name -> ID for stops written by name, defaults to busNameToId.
+        """
+        stopIds = busNameToId if stopIds is None else stopIds
+
+        def stop_column(values):
+            names, inverse = np.unique(values, return_inverse=True)
+            try:
+                ids = np.array([int(name) if name.isdigit() else stopIds[name] for name in names.tolist()],
+                               dtype=np.int64)
+            except KeyError as e:
+                raise ValueError(f'unknown bus stop {e.args[0]!r} in {path}') from None
+            return ids[inverse.reshape(-1)]
+
+        def blocks():
+            with open(path) as f:
+                header = f.readline().strip().split(',')
+                usecols = [header.index(name) for name in ('id', 'start', 'dest', 'show time')]
+                while True:
+                    lines = list(itertools.islice(f, blockSize))
+                    if not lines:
+                        return
+                    id, start, dest, showTime = np.loadtxt(lines, dtype=str, delimiter=',', usecols=usecols,
+                                                           ndmin=2).T
+                    yield id.astype(np.int64), stop_column(start), stop_column(dest), showTime.astype(np.int64)
+
+        if not sort:
+            return cls(blocks())
+        columns = [np.concatenate(column) for column in zip(*blocks())] or [np.zeros(0, dtype=np.int64)] * 4
+        order = np.argsort(columns[3], kind='stable')
+        return cls.from_arrays(*(column[order] for column in columns), blockSize=blockSize)
+
+    def to_table(self) -> PassengerTable:
+        blocks = list(self)
+        if not blocks:
+            return PassengerTable(0)
+        id, departBusStop, arriveBusStop, timeAtStop = (np.concatenate(column) for column in zip(*blocks))
+        return PassengerTable.from_arrays(departBusStop, arriveBusStop, timeAtStop, id=id)
+
+
 class BusTime:
     def __init__(self, departureId, arriveId, departTime, duration):
         self.departureId = departureId
@@ -80,49 +344,36 @@ class BusTime:
 
 
 def travel_time(start, finish):
-    # uniform travel time
-    sorted_start = min(start, finish)
-    sorted_finish = max(start, finish)
-    travel_dict = {(1,2): 4, (1,3): 3, (2,3): 5, (1,4): 9, (2,4): 3, (3,4): 2}
-    isPeak = random.choices([True, False], weights=[0.25, 0.75], k=1)[0]
-    isPeak = True
-    if isPeak:
-        # 5min -> 5s -> 500 ms
-        return 500 * (finish - start)
-        return int(travel_dict[sorted_start, sorted_finish] * (1+ random.uniform(0,1)))
-    else:
-        # 5min -> 5s -> 5000 ms
-        return 500* (finish - start)
-        return travel_dict[sorted_start, sorted_finish]
-
-
+    # 5min -> 5s -> 500 ms per stop, traveltime.TravelTimeModel has time of day and random travel times
+    return 500 * (finish - start)
 
 
-def get_next_arrive_time():
+def get_next_arrive_time(rng: random.Random = random):
     # time is in sec unit, covert to millonsec
     rate_per_sec = 10
     while True:
-        x = random.expovariate(rate_per_sec) * 4000
+        x = rng.expovariate(rate_per_sec) * 4000
         yield math.ceil(x)
 
-def generatePassangers():
-    passangers: list[Passanger] = []
-    gen = get_next_arrive_time()
+def generatePassangers(rng: random.Random = random, perStop: int = 120, stops: list[int] = None) -> PassengerTable:
+    """
+    :param stops: Stops passangers show up at, each going to a later one. Defaults to every stop of busStopDict.
+    """
+    departBusStop, arriveBusStop, timeAtStop = [], [], []
+    gen = get_next_arrive_time(rng)
+    stops = sorted(busStopDict.keys()) if stops is None else sorted(stops)
 
-    for stop in list(busStopDict.keys()):
-        if stop == 15: continue
+    for position, stop in enumerate(stops[:-1]):
         start = 0
-        for i in range(120):
+        for i in range(perStop):
             startStop = stop
-            endStop = random.randint(startStop + 1, 15)
-            print(f'start stop {startStop} end stop {endStop}')
+            endStop = stops[rng.randint(position + 1, len(stops) - 1)]
             x = next(gen)
             start += x
-            print(f'next arrival at time {start} millionsec')
-            p = Passanger(id=len(passangers), busId=None, departBusStop=startStop, arriveBusStop=endStop,
-                          timeAtStop=start)
-            passangers.append(p)
-    return passangers
+            departBusStop.append(startStop)
+            arriveBusStop.append(endStop)
+            timeAtStop.append(start)
+    return PassengerTable.from_arrays(departBusStop, arriveBusStop, timeAtStop)
 
 def define_bus_table(bus: Bus):
     flyTime[bus.id] = []
@@ -142,186 +393,1229 @@ def define_bus_table(bus: Bus):
         totalDurationBeforeThisStop += travelTime
 
 
-def generateBuses():
+class Timetable:
+    """
+    Compiled timetable of a fleet, one row per trip (bus) and one column per position along its route:
+        stopSequence[t, i]  i-th stop of trip t
+        depart[t, i]        when trip t leaves its i-th stop, -1 at its last stop
+        arrive[t, i]        when trip t gets to its i-th stop, arrive[t, 0] is its start time
+        duration[t, i]      travel time from the i-th to the (i + 1)-th stop, -1 at its last stop
+    Positions past the end of a route hold -1 everywhere. The arrays are read-only, so one Timetable can be
+    shared by several simulations and pickled or forked into worker processes as is.
+    """
+    def __init__(self, buses: list[Bus], depart: np.ndarray, duration: np.ndarray):
+        """
+        :param buses: One bus per trip, its route gives the stop sequence.
+        :param depart: trip x segment departure times, only the first len(route) - 1 columns of a trip are read.
+        :param duration: trip x segment travel times, same layout as depart.
+        """
+        self.buses = list(buses)
+        self.busIds = np.array([bus.id for bus in self.buses], dtype=np.int64)
+        self.tripIndex = {bus.id: trip for trip, bus in enumerate(self.buses)}
+        self.segments = np.array([max(len(bus.route.busStopSequence) - 1, 0) for bus in self.buses], dtype=np.int64)
+        width = max((len(bus.route.busStopSequence) for bus in self.buses), default=0)
+        n = len(self.buses)
+        self.stopSequence = np.full((n, width), -1, dtype=np.int64)
+        for trip, bus in enumerate(self.buses):
+            self.stopSequence[trip, :len(bus.route.busStopSequence)] = bus.route.busStopSequence
+        # every (trip, position) a bus leaves from
+        self.isSegment = np.arange(width)[None, :] < self.segments[:, None]
+        self.depart = np.where(self.isSegment, self.pad(depart, width), -1)
+        self.duration = np.where(self.isSegment, self.pad(duration, width), -1)
+        self.arrive = np.full((n, width), -1, dtype=np.int64)
+        if width:
+            self.arrive[:, 0] = [bus.get_depart_time() for bus in self.buses]
+            self.arrive[:, 0] = np.where(self.segments > 0, self.depart[:, 0], self.arrive[:, 0])
+            self.arrive[:, 1:] = np.where(self.isSegment[:, :-1], (self.depart + self.duration)[:, :-1], -1)
+        self.stops = np.unique(self.stopSequence[self.stopSequence >= 0])
+
+        # stop -> departure times there in time order, with the trip and position of each
+        trips, positions = np.nonzero(self.isSegment)
+        stops, times = self.stopSequence[trips, positions], self.depart[trips, positions]
+        order = np.lexsort((trips, times, stops))
+        trips, positions, stops, times = trips[order], positions[order], stops[order], times[order]
+        splits = np.flatnonzero(stops[1:] != stops[:-1]) + 1
+        self.stopDepartures: dict[int, tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        for start, end in zip(np.r_[0, splits], np.r_[splits, len(stops)]):
+            if end > start:
+                self.stopDepartures[int(stops[start])] = (times[start:end], trips[start:end], positions[start:end])
+        for array in (self.busIds, self.segments, self.stopSequence, self.isSegment, self.depart, self.duration,
+                      self.arrive, self.stops, *(a for arrays in self.stopDepartures.values() for a in arrays)):
+            array.setflags(write=False)
+
+    @classmethod
+    def from_bus_table(cls, buses: list[Bus], busTable: dict[int, list[BusTime]] = None):
+        """
+        Compile BusTime lists as filled in by define_bus_table, from flyTime unless busTable is given.
+        """
+        busTable = flyTime if busTable is None else busTable
+        width = max((len(busTable[bus.id]) for bus in buses), default=0)
+        depart = np.full((len(buses), width), -1, dtype=np.int64)
+        duration = np.full((len(buses), width), -1, dtype=np.int64)
+        for trip, bus in enumerate(buses):
+            segments = busTable[bus.id]
+            depart[trip, :len(segments)] = [segInfo.departureTime for segInfo in segments]
+            duration[trip, :len(segments)] = [segInfo.duration for segInfo in segments]
+        return cls(buses, depart, duration)
+
+    @classmethod
+    def from_buses(cls, buses: list[Bus]):
+        """
+        Travel times for every bus the way define_bus_table works them out, without touching flyTime.
+        """
+        width = max((len(bus.route.busStopSequence) - 1 for bus in buses), default=0)
+        duration = np.full((len(buses), width), -1, dtype=np.int64)
+        for trip, bus in enumerate(buses):
+            sequence = bus.route.busStopSequence
+            duration[trip, :len(sequence) - 1] = travel_time(np.asarray(sequence[:-1], dtype=np.int64),
+                                                             np.asarray(sequence[1:], dtype=np.int64))
+        start = np.array([bus.get_depart_time() for bus in buses], dtype=np.int64)
+        return cls(buses, cls.departures(start, duration), duration)
+
+    @classmethod
+    def from_model(cls, buses: list[Bus], model: TravelTimeModel, rng=None):
+        """
+        Travel times for every bus from a traveltime.TravelTimeModel, drawn in one go.
+        :param rng: numpy Generator, seed, random.Random or the random module for the model's noise.
+        """
+        depart, duration = model.schedule([bus.route.busStopSequence for bus in buses],
+                                          [bus.get_depart_time() for bus in buses], rng)
+        return cls(buses, depart, duration)
+
+    @classmethod
+    def from_headway(cls, route: Route, count: int, headway: int, firstDeparture: int = 0, firstId: int = 0,
+                     durations=None, rng: random.Random = random, model: TravelTimeModel = None):
+        """
+        count buses running route, the first one leaving at firstDeparture and then one every headway.
+        :param firstId: Bus id of the first bus, the others follow on.
+        :param durations: Travel time per segment shared by every bus, or one row per bus.
+                          Worked out per bus like define_bus_table when left out.
+        :param model: Draw travel times from this TravelTimeModel instead.
+        """
+        buses = [Bus(id=firstId + k, route=route, startTime=firstDeparture + k * headway) for k in range(count)]
+        if model is not None:
+            return cls.from_model(buses, model, rng)
+        if durations is None:
+            return cls.from_buses(buses)
+        duration = np.broadcast_to(np.asarray(durations, dtype=np.int64),
+                                   (count, max(len(route.busStopSequence) - 1, 0)))
+        start = firstDeparture + np.arange(count, dtype=np.int64) * headway
+        return cls(buses, cls.departures(start, duration), duration)
+
+    @classmethod
+    def from_routes(cls, routes: list[Route], counts, headways, firstDepartures=0, rng: random.Random = random,
+                    model: TravelTimeModel = None):
+        """
+        Buses on several routes, each route with its own count and headway, see from_headway.
+        Bus ids number on from one route to the next.
+        :param counts: Buses per route, or one count for all of them. Likewise headways and firstDepartures.
+        """
+        counts, headways, firstDepartures = (np.broadcast_to(values, len(routes)).tolist()
+                                             for values in (counts, headways, firstDepartures))
+        timetables = []
+        firstId = 0
+        for route, count, headway, firstDeparture in zip(routes, counts, headways, firstDepartures):
+            timetables.append(cls.from_headway(route, count, headway, firstDeparture, firstId, rng=rng, model=model))
+            firstId += count
+        return cls.concat(timetables)
+
+    @classmethod
+    def concat(cls, timetables: list['Timetable']):
+        """
+        One timetable with the trips of all of them, in order.
+        """
+        width = max((t.depart.shape[1] for t in timetables), default=0)
+        buses = [bus for t in timetables for bus in t.buses]
+        depart = np.full((len(buses), width), -1, dtype=np.int64)
+        duration = np.full((len(buses), width), -1, dtype=np.int64)
+        row = 0
+        for t in timetables:
+            depart[row:row + len(t), :t.depart.shape[1]] = t.depart
+            duration[row:row + len(t), :t.duration.shape[1]] = t.duration
+            row += len(t)
+        return cls(buses, depart, duration)
+
+    @staticmethod
+    def pad(array, width: int) -> np.ndarray:
+        array = np.asarray(array, dtype=np.int64)
+        padded = np.full((len(array), width), -1, dtype=np.int64)
+        columns = min(width, array.shape[1])
+        padded[:, :columns] = array[:, :columns]
+        return padded
+
+    @staticmethod
+    def departures(start: np.ndarray, duration: np.ndarray) -> np.ndarray:
+        # a bus leaves each stop as soon as it gets there
+        depart = np.zeros(duration.shape, dtype=np.int64)
+        if duration.shape[1]:
+            depart[:, 0] = start
+            np.cumsum(np.maximum(duration[:, :-1], 0), axis=1, out=depart[:, 1:])
+            depart[:, 1:] += start[:, None]
+        return depart
+
+    def __len__(self):
+        return len(self.buses)
+
+    def segment(self, trip: int, segId: int) -> BusTime:
+        """
+        The segId-th leg of trip as a BusTime.
+        """
+        return BusTime(departureId=int(self.stopSequence[trip, segId]), arriveId=int(self.stopSequence[trip, segId + 1]),
+                       departTime=int(self.depart[trip, segId]), duration=int(self.duration[trip, segId]))
+
+    def bus_table(self) -> dict[int, list[BusTime]]:
+        """
+        The same timetable as BusTime lists keyed by bus id, like flyTime.
+        """
+        return {bus.id: [self.segment(trip, segId) for segId in range(self.segments[trip])]
+                for trip, bus in enumerate(self.buses)}
+
+    def next_departure(self, stop: int, time: int):
+        """
+        First bus leaving stop at or after time, whatever route it runs.
+        :return: (departure time, trip, position), or None if no bus leaves stop from then on.
+        """
+        departures = self.stopDepartures.get(stop)
+        if departures is None:
+            return None
+        times, trips, positions = departures
+        i = int(np.searchsorted(times, time, side='left'))
+        if i == len(times):
+            return None
+        return int(times[i]), int(trips[i]), int(positions[i])
+
+
+class DepartureIndex:
+    """
+    Precomputed stop -> (bus, position, departure time) lookup, built once from a Timetable.
+    Departures at each stop are grouped by stop sequence, so "next bus serving A before B"
+    is one bisect per matching stop sequence instead of a scan over every bus.
+    """
+    def __init__(self, timetable: Timetable):
+        self.buses = timetable.buses
+        # stop sequence -> position of every stop on it (first visit, same as list.index)
+        self.sequencePosition: dict[tuple, dict[int, int]] = {}
+        # stop -> stop sequence -> sorted departure times and the matching (bus index, segment id)
+        self.departTimes: dict[int, dict[tuple, list[int]]] = collections.defaultdict(dict)
+        self.departBuses: dict[int, dict[tuple, list[tuple[int, int]]]] = collections.defaultdict(dict)
+        self.sequencesBetween: dict[tuple[int, int], list[tuple]] = {}
+        self.stopsAfter: dict[tuple[tuple, int], list[int]] = {}
+        self.departArrays: dict[tuple[int, tuple], tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        self.flat = None
+
+        departures = collections.defaultdict(list)
+        for busIdx, bus in enumerate(self.buses):
+            sequence = tuple(bus.route.busStopSequence)
+            if sequence not in self.sequencePosition:
+                position = {}
+                for idx, stop in enumerate(sequence):
+                    position.setdefault(stop, idx)
+                self.sequencePosition[sequence] = position
+            for segId, departTime in enumerate(timetable.depart[busIdx, :timetable.segments[busIdx]].tolist()):
+                departures[sequence[segId], sequence].append((departTime, busIdx, segId))
+
+        for (stop, sequence), items in departures.items():
+            items.sort()
+            self.departTimes[stop][sequence] = [item[0] for item in items]
+            self.departBuses[stop][sequence] = [(item[1], item[2]) for item in items]
+
+    def sequences_between(self, departStop: int, arriveStop: int) -> list[tuple]:
+        key = (departStop, arriveStop)
+        sequences = self.sequencesBetween.get(key)
+        if sequences is None:
+            sequences = []
+            for sequence in self.departTimes.get(departStop, {}):
+                position = self.sequencePosition[sequence]
+                if arriveStop in position and position[departStop] < position[arriveStop]:
+                    sequences.append(sequence)
+            self.sequencesBetween[key] = sequences
+        return sequences
+
+    def departure_arrays(self, stop: int, sequence: tuple) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Sorted departure times at stop for one stop sequence, and the bus index and segment id of each, as numpy arrays.
+        """
+        key = (stop, sequence)
+        arrays = self.departArrays.get(key)
+        if arrays is None:
+            buses = np.array(self.departBuses[stop][sequence], dtype=np.int64).reshape(-1, 2)
+            arrays = (np.array(self.departTimes[stop][sequence], dtype=np.int64), buses[:, 0], buses[:, 1])
+            self.departArrays[key] = arrays
+        return arrays
+
+    def stops_after(self, sequence: tuple, stop: int) -> list[int]:
+        """
+        Stops a bus on this stop sequence can still drop a passanger at once it leaves stop.
+        """
+        key = (sequence, stop)
+        stops = self.stopsAfter.get(key)
+        if stops is None:
+            position = self.sequencePosition[sequence]
+            stops = [s for s, idx in position.items() if idx > position[stop]]
+            self.stopsAfter[key] = stops
+        return stops
+
+    def next_departure(self, departStop: int, arriveStop: int, time: int):
+        """
+        Find the first bus leaving departStop at or after time that later reaches arriveStop.
+        :return: (departure time, bus index, segment id), or None if no such bus is left.
+        """
+        best = None
+        for sequence in self.sequences_between(departStop, arriveStop):
+            times = self.departTimes[departStop][sequence]
+            i = bisect.bisect_left(times, time)
+            if i < len(times):
+                candidate = (times[i], *self.departBuses[departStop][sequence][i])
+                if best is None or candidate < best:
+                    best = candidate
+        return best
+
+    def flat_departures(self):
+        """
+        Every departure_arrays slot one after the other, keyed so a single searchsorted covers all of them:
+        slot s holds keys s * span + (time - first time), each slot sorted and every key below the next slot's.
+        :return: slot id per (stop, sequence), slot start offsets, keys, bus indices, segment ids, first time, span.
+        """
+        if self.flat is None:
+            slots = {}
+            times, busIdxs, segIds, lengths = [], [], [], []
+            for stop, sequences in self.departTimes.items():
+                for sequence in sequences:
+                    slots[stop, sequence] = len(slots)
+                    slotTimes, slotBuses, slotSegs = self.departure_arrays(stop, sequence)
+                    times.append(slotTimes)
+                    busIdxs.append(slotBuses)
+                    segIds.append(slotSegs)
+                    lengths.append(len(slotTimes))
+            empty = np.zeros(0, dtype=np.int64)
+            times, busIdxs, segIds = (np.concatenate(column) if column else empty for column in (times, busIdxs, segIds))
+            starts = np.zeros(len(slots) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=starts[1:])
+            first = int(times.min()) if len(times) else 0
+            # a time past the last departure searches to the end of its slot, one before the first to the start
+            span = (int(times.max()) - first + 2) if len(times) else 1
+            slotOf = np.repeat(np.arange(len(slots), dtype=np.int64), np.diff(starts))
+            self.flat = (slots, starts, slotOf * span + (times - first), busIdxs, segIds, first, span)
+        return self.flat
+
+    def next_departures(self, departStop: np.ndarray, arriveStop: np.ndarray, time: np.ndarray):
+        """
+        next_departure for many passangers at once: one searchsorted over flat_departures for every
+        stop sequence each passanger could take, then the best of them per passanger.
+        :return: departure time, bus index and segment id per passanger as int64 arrays, -1 where no bus is left.
+        """
+        departStop, arriveStop = np.asarray(departStop, dtype=np.int64), np.asarray(arriveStop, dtype=np.int64)
+        time = np.asarray(time, dtype=np.int64)
+        n = len(time)
+        bestTime = np.full(n, -1, dtype=np.int64)
+        bestBus = np.full(n, -1, dtype=np.int64)
+        bestSeg = np.full(n, -1, dtype=np.int64)
+        if n == 0:
+            return bestTime, bestBus, bestSeg
+        slots, starts, keys, busIdxs, segIds, first, span = self.flat_departures()
+        # one int key per stop pair, np.unique over rows of a 2d array sorts far slower
+        low = int(min(departStop.min(), arriveStop.min()))
+        width = int(arriveStop.max()) - low + 1
+        pairs, inverse = np.unique((departStop - low) * width + (arriveStop - low), return_inverse=True)
+        inverse = inverse.reshape(-1)
+        pairSlots = [[slots[fromStop, sequence] for sequence in self.sequences_between(fromStop, toStop)]
+                     for fromStop, toStop in zip((pairs // width + low).tolist(), (pairs % width + low).tolist())]
+        pairCounts = np.fromiter(map(len, pairSlots), dtype=np.int64, count=len(pairSlots))
+        pairStarts = np.cumsum(pairCounts) - pairCounts
+        pairSlots = np.fromiter(itertools.chain.from_iterable(pairSlots), dtype=np.int64, count=int(pairCounts.sum()))
+        # one query per passanger and stop sequence he could take
+        counts = pairCounts[inverse]
+        rows = np.repeat(np.arange(n), counts)
+        if len(rows) == 0:
+            return bestTime, bestBus, bestSeg
+        within = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+        slot = pairSlots[pairStarts[inverse[rows]] + within]
+        found = np.searchsorted(keys, slot * span + np.clip(time[rows] - first, -1, span - 1), side='left')
+        hit = found < starts[slot + 1]
+        rows, found = rows[hit], found[hit]
+        if len(rows) == 0:
+            return bestTime, bestBus, bestSeg
+        candidateTime = keys[found] - slot[hit] * span + first
+        candidateBus = busIdxs[found]
+        # same tie break as next_departure: earliest departure, then lowest bus index
+        order = np.lexsort((candidateBus, candidateTime, rows))
+        rows = rows[order]
+        firstOfRow = np.r_[True, rows[1:] != rows[:-1]]
+        best, rows = order[firstOfRow], rows[firstOfRow]
+        bestTime[rows], bestBus[rows], bestSeg[rows] = candidateTime[best], candidateBus[best], segIds[found[best]]
+        return bestTime, bestBus, bestSeg
+
+
+def solve_analytic(buses: list[Bus] | Timetable, passangers: PassengerTable | list[Passanger],
+                   transfers: bool = False):
+    """
+    Closed-form version of BusSimulation.runAirSim for a fixed timetable and buses with no capacity.
+    A passanger boards the first bus leaving his stop at or after timeAtStop that later reaches his destination,
+    unless that bus leaves leaveAngryTime or more after he showed up, and gets off when it lands there.
+    :param buses: A Timetable, or buses whose timetable is already in flyTime.
+    :param passangers: Passangers to route, they are not modified.
+    :param transfers: Route passangers over several buses like BusSimulation(transfers=True), one leg at a time:
+                      each leg waits from when the last one landed.
+    :return: on bus time, bus id and leave bus time per passanger as int64 arrays, -1 where he never got on a bus.
+    """
+    timetable = buses if isinstance(buses, Timetable) else Timetable.from_bus_table(buses)
+    buses = timetable.buses
+    index = DepartureIndex(timetable)
+    if not isinstance(passangers, PassengerTable):
+        passangers = PassengerTable.from_passangers(passangers)
+    n = len(passangers)
+    departStop = passangers.departBusStop
+    arriveStop = passangers.arriveBusStop
+    timeAtStop = passangers.timeAtStop
+
+    stopPosition = {stop: i for i, stop in enumerate(sorted({s for bus in buses for s in bus.route.busStopSequence}))}
+    # time each bus lands at each stop, -1 where it never lands there
+    landTime = np.full((len(buses), len(stopPosition)), -1, dtype=np.int64)
+    for busIdx in range(len(buses)):
+        segments = timetable.segments[busIdx]
+        for stop, arrive in zip(timetable.stopSequence[busIdx, 1:segments + 1].tolist(),
+                                timetable.arrive[busIdx, 1:segments + 1].tolist()):
+            landTime[busIdx, stopPosition[stop]] = arrive
+    busIds = timetable.busIds
+
+    onBus = np.full(n, -1, dtype=np.int64)
+    busId = np.full(n, -1, dtype=np.int64)
+    leaveBus = np.full(n, -1, dtype=np.int64)
+
+    planner = TransferPlanner(timetable, index) if transfers else None
+    stops = np.fromiter(stopPosition, dtype=np.int64)
+    # passangers still on their way, where their current leg goes from and to and when they got there
+    rows = np.arange(n)
+    fromStop, waitStart = departStop.astype(np.int64), timeAtStop.astype(np.int64)
+    toStop = arriveStop.astype(np.int64) if planner is None else planner.leg_ends(departStop, arriveStop)
+    leg = 0
+    while len(rows):
+        bestTime, bestBus, _ = index.next_departures(fromStop, toStop, waitStart)
+        took = (bestTime >= 0) & (bestTime < waitStart + leaveAngryTime)
+        rows, bestTime, bestBus, toStop = rows[took], bestTime[took], bestBus[took], toStop[took]
+        if leg == 0:
+            onBus[rows] = bestTime
+            busId[rows] = busIds[bestBus]
+        leaveBus[rows] = landTime[bestBus, np.searchsorted(stops, toStop)]
+        changing = toStop != arriveStop[rows]
+        rows, fromStop, waitStart = rows[changing], toStop[changing], leaveBus[rows[changing]]
+        leg += 1
+        if len(rows):
+            toStop = planner.leg_ends(departStop[rows], arriveStop[rows], leg)
+    return onBus, busId, leaveBus
+
+
+def generateBuses(count: int = 10, step: int = 5000):
     # run bus every 10 mins- > 10s -> 10000 millonsec
-    step = 5000
     start = 0
     buses: list[Bus] = []
     stops = sorted(busStopDict.keys())
-    for i in range(10):
+    for i in range(count):
         bus = Bus(id=len(buses), route=Route(len(buses), stops), startTime=start)
         define_bus_table(bus)
         start += step
         buses.append(bus)
     return buses
 
-passangers = generatePassangers()
-buses = generateBuses()
+
+def generateTimetable(rng: random.Random = random, count: int = 10, step: int = 5000,
+                      model: TravelTimeModel = None) -> Timetable:
+    """
+    Same buses and travel times as generateBuses, compiled into a Timetable instead of flyTime.
+    Travel times are drawn from model with rng instead when one is given.
+    """
+    stops = sorted(busStopDict.keys())
+    buses = [Bus(id=i, route=Route(i, stops), startTime=i * step) for i in range(count)]
+    if model is not None:
+        return Timetable.from_model(buses, model, rng)
+    return Timetable.from_buses(buses)
+
+
+class StopQueue:
+    """
+    Passangers waiting at one stop in batched mode, one group per stop they go to, in show up order within each,
+    and how far down each group buses have got. Every group lives in one sorted key array, group g holding
+    g * span + (show time - first show time), so a bus finds everybody it can take with one searchsorted
+    over the groups of the stops it still goes to.
+    """
+    def __init__(self, queues: dict[int, np.ndarray], timeAtStop: np.ndarray):
+        """
+        :param queues: Stop they go to -> passanger indices in show up order.
+        :param timeAtStop: Show time of every passanger.
+        """
+        self.arriveStops = list(queues)
+        self.group = {arriveStop: g for g, arriveStop in enumerate(self.arriveStops)}
+        lengths = np.array([len(queue) for queue in queues.values()], dtype=np.int64)
+        self.waiting = np.concatenate(list(queues.values())) if queues else np.zeros(0, dtype=np.int64)
+        self.times = timeAtStop[self.waiting]
+        self.starts = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.starts[1:])
+        self.first = int(self.times.min()) if len(self.times) else 0
+        # a time past the last show time searches to the end of its group, one before the first to the start
+        self.span = int(self.times.max()) - self.first + 2 if len(self.times) else 1
+        self.keys = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths) * self.span + (self.times - self.first)
+        self.next = self.starts[:-1].copy()
+        # bus index -> groups of the stops it can drop passangers at after this one
+        self.busGroups: dict[int, np.ndarray] = {}
+
+    def add_bus(self, busIdx: int, stopsAfter: list[int]) -> np.ndarray:
+        """
+        :param stopsAfter: Stops bus busIdx can drop passangers at after this one.
+        :return: The groups it can take, in the order of stopsAfter.
+        """
+        groups = self.busGroups[busIdx] = np.array([self.group[stop] for stop in stopsAfter if stop in self.group],
+                                                   dtype=np.int64)
+        return groups
+
+    def take(self, groups: np.ndarray, now: int):
+        """
+        Everyone in groups who showed up by now, except whoever waited leaveAngryTime or longer
+        and has already gone home, leaves the queue.
+        :return: The stops they go to, and first, onTime and last per group somebody left:
+                 waiting[first:onTime] gave up, waiting[onTime:last] get on. None if nobody left.
+        """
+        if len(groups) == 0:
+            return None
+        base = groups * self.span
+        first = self.next[groups]
+        last = np.searchsorted(self.keys, base + min(max(now - self.first, -1), self.span - 1), side='right')
+        gaveUp = min(max(now - leaveAngryTime - self.first, -1), self.span - 1)
+        onTime = np.maximum(first, np.searchsorted(self.keys, base + gaveUp, side='right'))
+        left = last > first
+        if not left.any():
+            return None
+        groups, first, onTime, last = groups[left], first[left], onTime[left], last[left]
+        self.next[groups] = last
+        return [self.arriveStops[g] for g in groups.tolist()], first, onTime, last
+
+    def rows(self, start: np.ndarray, end: np.ndarray) -> np.ndarray:
+        """
+        :return: waiting[start[0]:end[0]], waiting[start[1]:end[1]], ... in one array.
+        """
+        lengths = end - start
+        offsets = np.repeat(start - (np.cumsum(lengths) - lengths), lengths)
+        return self.waiting[offsets + np.arange(int(lengths.sum()))]
 
 
 class BusSimulation:
-    def __init__(self, buses: list[Bus], passangers:list[Passanger]):
-        self.env  = simpy.Environment()
-        self.buses: list[Bus] = buses
-        self.passangers: list[Passanger] = passangers
-        self.busReadyAtDepartureEvent = {}
-        self.busDepartureEvent: dict[(int, int), simpy.Event] = {}
-        self.busLandEvent = {}
+    def __init__(self, buses: list[Bus] | Timetable, passangers: PassengerTable | list[Passanger],
+                 mode: str = 'passanger', eventLog: EventLog = None, resultsWriter: ResultsWriter = None,
+                 metrics: Metrics = None, engine: str = 'simpy', serviceStart: datetime = None,
+                 transfers: bool = False):
+        """
+        :param buses: The Timetable to run, or buses whose timetable is already in flyTime.
+        :param passangers: A PassengerTable the results are written into, a list of Passanger objects
+                           that get their results copied back when the run ends, or an ArrivalStream.
+                           Streamed passangers are only read in as their show time comes; with a resultsWriter
+                           each one is written out when done and his row is reused, so read results from there.
+        :param mode: 'passanger' runs one process per passanger, 'batched' runs one queue manager per stop
+                     that boards and drops passangers in bulk when a bus leaves or lands.
+        :param eventLog: Where to record the trace of the run, nothing is recorded by default.
+        :param resultsWriter: Where to stream passangers as they get off the bus, the ones who never got on
+                              are written when the run ends.
+        :param metrics: Statistics to keep up to date while the run goes, see metrics.Metrics.
+        :param engine: 'simpy' runs the model as SimPy processes, 'heap' as callbacks on an eventcore.EventCore,
+                       which gives the same passanger results several times faster.
+        :param serviceStart: Wall clock time of tick 0. Both engines count integer millonsec,
+                             simTime reads that clock as datetimes without touching the run.
+        :param transfers: Let passangers change bus where no single bus goes all the way, along the legs
+                          transfers.TransferPlanner plans over the routes of the timetable. Each change is one more
+                          wait at the stop the last bus landed at, and he gives up leaveAngryTime after landing there.
+                          Passanger mode only.
+        """
+        if engine == 'simpy':
+            import simpy
+            self.env = simpy.Environment()
+        elif engine == 'heap':
+            self.env = EventCore()
+        else:
+            raise ValueError(f'unknown simulation engine {engine}')
+        self.engine = engine
+        self.simTime = SimTime(serviceStart, clock=self.env)
+        self.eventLog = eventLog if eventLog is not None else EventLog()
+        self.logBus = self.eventLog.level >= eventlog.BUS
+        self.logPassanger = self.eventLog.level >= eventlog.PASSANGER
+        self.resultsWriter = resultsWriter
+        self.timetable = buses if isinstance(buses, Timetable) else Timetable.from_bus_table(buses)
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.attach(self.timetable)
+        self.buses: list[Bus] = self.timetable.buses
+        self.passangerObjects: list[Passanger] = None
+        self.arrivals: ArrivalStream = None
+        if isinstance(passangers, ArrivalStream):
+            if mode == 'batched':
+                # the stop queues need everybody up front
+                passangers = passangers.to_table()
+            else:
+                self.arrivals = passangers
+                passangers = PassengerTable(0)
+        elif not isinstance(passangers, PassengerTable):
+            self.passangerObjects = passangers
+            passangers = PassengerTable.from_passangers(passangers)
+        self.passangers: PassengerTable = passangers
+        # rows of streamed passangers already written out, free for the next ones to show up
+        self.recycle = self.arrivals is not None and resultsWriter is not None
+        self.freeRows: list[int] = []
+        self.usedRows = 0
+        # bus leaving / landing events keyed by (bus index, segment id), only made once somebody waits on them.
+        # the heap engine keeps the passanger indices waiting there instead, and schedules a handler per key
+        self.departEvents: dict[tuple[int, int], object] = {}
+        self.landEvents: dict[tuple[int, int], object] = {}
+        # segments each bus has left / finished so far, so whoever comes late sees it already happened
+        self.departed = [0] * len(self.buses)
+        self.landed = [0] * len(self.buses)
+        self.busStops = [self.timetable.stopSequence[busIdx, :self.timetable.segments[busIdx] + 1].tolist()
+                         for busIdx in range(len(self.buses))]
+        self.busDurations = [self.timetable.duration[busIdx, :self.timetable.segments[busIdx]].tolist()
+                             for busIdx in range(len(self.buses))]
+        self.busDeparts = [self.timetable.depart[busIdx, :self.timetable.segments[busIdx]].tolist()
+                           for busIdx in range(len(self.buses))] if engine == 'heap' else None
+        # (deadline, passanger) of whoever will give up before his bus comes, in the order they started waiting
+        self.angryQueue: collections.deque[tuple[int, int]] = collections.deque()
+        self.angryWake = None
+        self.departureIndex = DepartureIndex(self.timetable)
+        if transfers and mode == 'batched':
+            raise ValueError('batched mode does not do transfers')
+        self.planner = TransferPlanner(self.timetable, self.departureIndex) if transfers else None
+        # nothing is recorded per passanger, so the heap engine can board, drop and give up on them in bulk
+        self.bulk = engine == 'heap' and self.planner is None and metrics is None and not self.logPassanger
         for busIdx, bus in enumerate(self.buses):
-            for idx, busStopId in enumerate(bus.route.busStopSequence):
-                if idx < len(bus.route.busStopSequence) - 1:
-                    self.busDepartureEvent[bus.id, busStopId] = self.env.event()
-                if idx > 0:
-                    self.busLandEvent[bus.id, busStopId] = self.env.event()
-            self.env.process(self.busRunSim(busIdx))
+            if engine == 'simpy':
+                self.env.process(self.busRunSim(busIdx))
+            elif self.logBus and self.busDurations[busIdx]:
+                # passangers and stop queues schedule the bus events they need themselves, whole runs only get
+                # handlers for the trace
+                self.env.at(bus.get_depart_time(), self.busDepartHandler, busIdx)
+
+        if mode == 'batched':
+            self.init_stop_queues()
+        elif mode == 'passanger':
+            if self.arrivals is None:
+                blocks = [np.argsort(self.passangers.timeAtStop, kind='stable')]
+            else:
+                blocks = (self.admit(block) for block in self.arrivals)
+            if engine == 'simpy':
+                self.env.process(self.arrivalSource(blocks))
+                self.env.process(self.angrySweeper())
+            else:
+                self.showUps = self.show_up_stream(blocks)
+                self.nextShowUp = next(self.showUps, None)
+                if self.nextShowUp is not None:
+                    self.env.at(self.nextShowUp[1], self.arrivalHandler)
+        else:
+            raise ValueError(f'unknown simulation mode {mode}')
 
-        for idx, passanger in enumerate(self.passangers):
-            self.env.process(self.passangerSim(idx))
+    def init_stop_queues(self):
+        table = self.passangers
+        # passangers going from each stop to each other stop, in arrival order
+        order = np.lexsort((table.timeAtStop, table.arriveBusStop, table.departBusStop))
+        departStop, arriveStop = table.departBusStop[order], table.arriveBusStop[order]
+        changes = np.flatnonzero((departStop[1:] != departStop[:-1]) | (arriveStop[1:] != arriveStop[:-1])) + 1
+        self.stopQueues: dict[int, dict[int, np.ndarray]] = collections.defaultdict(dict)
+        for group in np.split(order, changes):
+            if len(group):
+                self.stopQueues[int(table.departBusStop[group[0]])][int(table.arriveBusStop[group[0]])] = group
+        # every bus landing (kind 0) and leaving (kind 1) at each stop, in time order
+        self.stopEvents: dict[int, list[tuple[int, int, int, int]]] = collections.defaultdict(list)
+        timetable = self.timetable
+        for busIdx in range(len(self.buses)):
+            segments = timetable.segments[busIdx]
+            stops = timetable.stopSequence[busIdx, :segments + 1].tolist()
+            for segId, (departTime, arriveTime) in enumerate(zip(timetable.depart[busIdx, :segments].tolist(),
+                                                                 timetable.arrive[busIdx, 1:segments + 1].tolist())):
+                self.stopEvents[stops[segId]].append((departTime, 1, busIdx, segId))
+                self.stopEvents[stops[segId + 1]].append((arriveTime, 0, busIdx, segId))
+        # passangers on board of each bus, keyed by the stop they get off at
+        self.onBoard: dict[tuple[int, int], list[np.ndarray]] = collections.defaultdict(list)
+        # stop -> how far down its stopEvents the heap engine has got, and its queues
+        self.stopNext: dict[int, int] = {}
+        self.stopStates: dict[int, StopQueue] = {}
+        for stopId, events in self.stopEvents.items():
+            events.sort()
+            if self.engine == 'simpy':
+                self.env.process(self.stopQueueSim(stopId))
+            else:
+                self.stopNext[stopId] = 0
+                self.stopStates[stopId] = self.stop_queue_state(stopId)
+                self.env.at(events[0][0], self.stopQueueHandler, stopId)
 
 
+    def admit(self, block):
+        """
+        Copy a block of streamed passangers into free rows of the table.
+        :return: Their row indices.
+        """
+        id, departBusStop, arriveBusStop, timeAtStop = block
+        table = self.passangers
+        reuse = min(len(timeAtStop), len(self.freeRows))
+        added = len(timeAtStop) - reuse
+        if self.usedRows + added > len(table):
+            table.resize(max(self.usedRows + added, 2 * len(table)))
+        rows = np.concatenate((np.array(self.freeRows[len(self.freeRows) - reuse:], dtype=np.int64),
+                               np.arange(self.usedRows, self.usedRows + added, dtype=np.int64)))
+        del self.freeRows[len(self.freeRows) - reuse:]
+        self.usedRows += added
+        table.id[rows] = id
+        table.departBusStop[rows] = departBusStop
+        table.arriveBusStop[rows] = arriveBusStop
+        table.timeAtStop[rows] = timeAtStop
+        table.onBus[rows] = -1
+        table.leaveBus[rows] = -1
+        table.busId[rows] = -1
+        table.status[rows] = PassengerTable.WAITING
+        table.transfers[rows] = 0
+        return rows
+
     def runAirSim(self):
         self.env.run()
+        table = self.passangers
+        if self.arrivals is not None:
+            table.resize(self.usedRows)
+        # whoever is still waiting never saw a bus that could take him
+        waiting = table.status == PassengerTable.WAITING
+        if self.metrics is not None:
+            self.metrics.no_bus(table.departBusStop[waiting])
+        table.status[waiting] = PassengerTable.NO_BUS
+        if self.resultsWriter is not None:
+            if not self.recycle:
+                self.write_results(np.flatnonzero(table.status != PassengerTable.ARRIVED))
+            self.resultsWriter.flush()
+        if self.passangerObjects is not None:
+            table.copy_results_to(self.passangerObjects)
+
+    def write_result(self, idx):
+        table = self.passangers
+        self.resultsWriter.add(int(table.id[idx]), int(table.departBusStop[idx]), int(table.arriveBusStop[idx]),
+                               int(table.timeAtStop[idx]), int(table.onBus[idx]), int(table.busId[idx]),
+                               int(table.leaveBus[idx]))
+
+    def write_results(self, idx):
+        table = self.passangers
+        self.resultsWriter.add_arrays({'id': table.id[idx], 'start': table.departBusStop[idx],
+                                       'dest': table.arriveBusStop[idx], 'show time': table.timeAtStop[idx],
+                                       'on bus': table.onBus[idx], 'bus': table.busId[idx],
+                                       'leave': table.leaveBus[idx]})
+
+    def arrivalSource(self, blocks):
+        # start every passanger process only when he shows up, so the event queue holds just the ones waiting
+        env = self.env
+        for rows in blocks:
+            for idx, showTime in zip(rows.tolist(), self.passangers.timeAtStop[rows].tolist()):
+                if showTime > env.now:
+                    yield env.timeout(showTime - env.now)
+                env.process(self.passangerSim(idx))
+
+    def departure_event(self, busIdx: int, segId: int):
+        """
+        Event fired when bus busIdx leaves the start of segment segId, None if it already has.
+        """
+        if self.departed[busIdx] > segId:
+            return None
+        event = self.departEvents.get((busIdx, segId))
+        if event is None:
+            event = self.departEvents[busIdx, segId] = self.env.event()
+        return event
+
+    def land_event(self, busIdx: int, segId: int):
+        """
+        Event fired when bus busIdx gets to the end of segment segId, None if it already has.
+        """
+        if self.landed[busIdx] > segId:
+            return None
+        event = self.landEvents.get((busIdx, segId))
+        if event is None:
+            event = self.landEvents[busIdx, segId] = self.env.event()
+        return event
+
+    def log_key(self, idx):
+        # streamed passangers share rows, so the trace names them by id
+        return int(self.passangers.id[idx]) if self.arrivals is not None else idx
+
+    def angry_later(self, idx):
+        deadline = self.env.now + leaveAngryTime
+        self.angryQueue.append((deadline, idx))
+        if self.engine == 'heap':
+            # the handler is due whenever the queue is not empty
+            if len(self.angryQueue) == 1:
+                self.env.at(deadline, self.angryHandler)
+        elif self.angryWake is not None:
+            self.angryWake.succeed()
+            self.angryWake = None
+
+    def angrySweeper(self):
+        # one process gives up for every passanger whose bus comes too late, instead of a timer each.
+        # passangers join as they start waiting so their deadlines only ever grow
+        while True:
+            if not self.angryQueue:
+                self.angryWake = self.env.event()
+                yield self.angryWake
+            deadline, idx = self.angryQueue[0]
+            if deadline > self.env.now:
+                yield self.env.timeout(deadline - self.env.now)
+            self.angryQueue.popleft()
+            self.give_up(idx)
+
+    def leg_stops(self, idx):
+        """
+        :return: (from stop, to stop) of the leg passanger idx is riding or waiting for,
+                 None if no buses can get him to his destination.
+        """
+        table = self.passangers
+        departStop, arriveStop = int(table.departBusStop[idx]), int(table.arriveBusStop[idx])
+        if self.planner is None:
+            return departStop, arriveStop
+        legs = self.planner.plan(departStop, arriveStop)
+        return legs[table.transfers[idx]] if legs else None
+
+    def waiting_since(self, idx) -> int:
+        # after a change of bus he waits from when the last one landed
+        table = self.passangers
+        return int(table.timeAtStop[idx] if table.transfers[idx] == 0 else table.leaveBus[idx])
+
+    def give_up(self, idx):
+        self.passangers.status[idx] = PassengerTable.ANGRY
+        if self.metrics is not None or self.logPassanger:
+            stop = self.leg_stops(idx)[0]
+            if self.metrics is not None:
+                self.metrics.give_up(stop, self.waiting_since(idx), self.env.now)
+            if self.logPassanger:
+                self.eventLog.record(self.env.now, EventKind.PASSANGER_ANGRY, stop=stop, passanger=self.log_key(idx))
+        self.release(idx)
+
+    def release(self, idx):
+        # a streamed passanger who is done gets written out and gives his row to the next one
+        if self.recycle:
+            if self.passangers.status[idx] != PassengerTable.ARRIVED:
+                self.write_result(idx)
+            self.freeRows.append(idx)
+
+    def show_up(self, idx, nextDeparture):
+        """
+        Passanger idx gets to his stop now.
+        :param nextDeparture: The first (departure time, bus index, segment id) that can take him, or None.
+        :return: (bus index, segment id) of the bus he is going to take, None if he never will.
+        """
+        departStop = int(self.passangers.departBusStop[idx])
+        if self.logPassanger:
+            self.eventLog.record(self.env.now, EventKind.PASSANGER_ARRIVE, stop=departStop,
+                                 passanger=self.log_key(idx))
+        return self.wait_for(idx, departStop, nextDeparture)
+
+    def wait_for(self, idx, stop: int, nextDeparture):
+        """
+        Passanger idx starts waiting at stop now for nextDeparture, see show_up.
+        """
+        if nextDeparture is None:
+            self.passangers.status[idx] = PassengerTable.NO_BUS
+            if self.metrics is not None:
+                self.metrics.no_bus(stop)
+            if self.logPassanger:
+                self.eventLog.record(self.env.now, EventKind.PASSANGER_NO_BUS, stop=stop, passanger=self.log_key(idx))
+            self.release(idx)
+            return None
+        departTime, busIdx, segId = nextDeparture
+        if departTime >= self.env.now + leaveAngryTime:
+            # he gives up before that bus comes
+            self.angry_later(idx)
+            return None
+        return busIdx, segId
+
+    def board(self, idx, busIdx: int, segId: int) -> int:
+        """
+        Passanger idx gets on bus busIdx as it leaves the start of segment segId.
+        :return: The segment at whose end he gets off.
+        """
+        table = self.passangers
+        busId = self.buses[busIdx].id
+        # he gets on where the bus is leaving from
+        departStop = self.busStops[busIdx][segId]
+        arriveStop = int(table.arriveBusStop[idx]) if self.planner is None else self.leg_stops(idx)[1]
+        if self.logPassanger:
+            self.eventLog.record(self.env.now, EventKind.PASSANGER_ON_BUS, bus=busId, stop=departStop,
+                                 passanger=self.log_key(idx))
+        if self.metrics is not None:
+            waitingSince = self.waiting_since(idx)
+        if self.planner is None or table.transfers[idx] == 0:
+            table.set_on_bus(idx, self.env.now, busId)
+        else:
+            table.status[idx] = PassengerTable.ON_BUS
+        landSeg = self.busStops[busIdx].index(arriveStop, segId + 1) - 1
+        if self.metrics is not None:
+            self.metrics.board(departStop, waitingSince, self.env.now, busIdx, segId, landSeg)
+        return landSeg
+
+    def alight(self, idx, busIdx: int):
+        """
+        Passanger idx gets off bus busIdx now, at his destination or to change bus.
+        :return: (bus index, segment id) of the bus he changes to, None if he is done.
+        """
+        table = self.passangers
+        changing = self.planner is not None and self.leg_stops(idx)[1] != table.arriveBusStop[idx]
+        if self.logPassanger:
+            self.eventLog.record(self.env.now, EventKind.PASSANGER_LEAVE_BUS, bus=self.buses[busIdx].id,
+                                 stop=self.leg_stops(idx)[1], passanger=self.log_key(idx))
+        if changing:
+            return self.change_bus(idx)
+        table.set_leave_bus(idx, self.env.now)
+        if self.metrics is not None:
+            # the ride is door to door, from the first bus to the last
+            self.metrics.alight(int(table.onBus[idx]), self.env.now)
+        if self.resultsWriter is not None:
+            self.write_result(idx)
+        self.release(idx)
+        return None
+
+    def change_bus(self, idx):
+        # the next leg is one more indexed lookup at the stop he got off at, however many routes there are
+        table = self.passangers
+        table.leaveBus[idx] = self.env.now
+        table.status[idx] = PassengerTable.WAITING
+        table.transfers[idx] += 1
+        departStop, arriveStop = self.leg_stops(idx)
+        return self.wait_for(idx, departStop, self.departureIndex.next_departure(departStop, arriveStop, self.env.now))
 
     def passangerSim(self, idx):
-        yield self.env.timeout(self.passangers[idx].timeAtStop)
-
-        # passanger can wait for any bus he can catch
-
-        successOnBus = False
-        busLeft = []
-        busTaken: Bus = None
-        leaveAngry = self.env.timeout(100 * 1000, value='leave')
-        while not successOnBus:
-
-            waitForBuses = []
-
-            for bus in self.buses:
-                # this bus already left the waiting stop, wait for next bus
-                if bus in busLeft: continue
-                try:
-                    departIndx =  bus.route.busStopSequence.index(self.passangers[idx].departBusStop)
-                    arriveIdx = bus.route.busStopSequence.index(self.passangers[idx].arriveBusStop)
-                    if departIndx < arriveIdx:
-                        waitForBuses.append(self.busDepartureEvent[bus.id, self.passangers[idx].departBusStop])
-                except ValueError:
-                    continue
-            if len(waitForBuses) == 0:
-                print(f'no bus for me {idx}')
-                return
-            result = yield self.env.any_of(waitForBuses) | leaveAngry
-            if leaveAngry in result:
-                print(f'passanger {idx} leave angry')
-                return
-            print(f' time is {self.env.now}')
-            for key, value in result.items():
-                flyInfo: fly_seg = value
-                bus = flyInfo.bus
-                segInfo : BusTime = flyTime[bus.id][flyInfo.segId]
-                departTime = segInfo.departureTime
-                if departTime < self.env.now:
-                    print(f'bus {bus.id} already left')
-                    busLeft.append(bus)
-                else:
-                    successOnBus = True
-                    busTaken = bus
-                    break
-            if successOnBus:
-                break
+        # buses run to a fixed timetable, so the passanger only needs to wait for the next bus that can take him
+        leg = self.leg_stops(idx)
+        nextDeparture = self.show_up(idx, None if leg is None else self.departureIndex.next_departure(*leg, self.env.now))
+        while nextDeparture is not None:
+            busIdx, segId = nextDeparture
+            departure = self.departure_event(busIdx, segId)
+            if departure is not None:
+                yield departure
+            landSeg = self.board(idx, busIdx, segId)
+            landing = self.land_event(busIdx, landSeg)
+            if landing is not None:
+                yield landing
+            nextDeparture = self.alight(idx, busIdx)
 
-        #yield self.airplaneDepartureEvent[airplaneId, self.passangers[idx].departAir]
-        print(f'passanger {idx} ready to on borad of bus {busTaken.id} at {self.env.now} at {busStopDict[self.passangers[idx].departBusStop]}')
-        self.passangers[idx].set_on_bus(self.env.now, busTaken.id)
-        yield  self.busLandEvent[busTaken.id, self.passangers[idx].arriveBusStop]
-        print(f'passanger {idx} ready to leave of bus {busTaken.id} at {self.env.now} at {busStopDict[self.passangers[idx].arriveBusStop]}')
-        self.passangers[idx].set_leave_bus(self.env.now)
+    def stop_queue_state(self, stopId) -> StopQueue:
+        return StopQueue(self.stopQueues.get(stopId, {}), self.passangers.timeAtStop)
+
+    def alight_batch(self, busIdx: int, stopId: int):
+        table = self.passangers
+        bus = self.buses[busIdx]
+        leaving = self.onBoard.pop((bus.id, stopId), None)
+        if not leaving:
+            return
+        leaving = np.concatenate(leaving)
+        table.set_leave_bus(leaving, self.env.now)
+        if self.metrics is not None:
+            self.metrics.alight(table.onBus[leaving], self.env.now)
+        if self.resultsWriter is not None:
+            self.write_results(leaving)
+        if self.logPassanger:
+            for idx in leaving.tolist():
+                self.eventLog.record(self.env.now, EventKind.PASSANGER_LEAVE_BUS, bus=bus.id, stop=stopId,
+                                     passanger=idx)
+        if self.logBus:
+            self.eventLog.record(self.env.now, EventKind.BATCH_LEAVE_BUS, bus=bus.id, stop=stopId,
+                                 count=len(leaving))
+
+    def board_batch(self, busIdx: int, segId: int, stopId: int, queue: StopQueue):
+        table = self.passangers
+        bus = self.buses[busIdx]
+        groups = queue.busGroups.get(busIdx)
+        if groups is None:
+            groups = queue.add_bus(busIdx, self.departureIndex.stops_after(tuple(bus.route.busStopSequence), stopId))
+        taken = queue.take(groups, self.env.now)
+        if taken is None:
+            return
+        arriveStops, first, onTime, last = taken
+        table.status[queue.rows(first, onTime)] = PassengerTable.ANGRY
+        boarded = queue.rows(onTime, last)
+        table.set_on_bus(boarded, self.env.now, bus.id)
+        for arriveStop, first, onTime, last in zip(arriveStops, first.tolist(), onTime.tolist(), last.tolist()):
+            boarding = queue.waiting[onTime:last]
+            if len(boarding):
+                self.onBoard[bus.id, arriveStop].append(boarding)
+            if self.metrics is not None:
+                times = queue.times
+                self.metrics.give_up(stopId, times[first:onTime], times[first:onTime] + leaveAngryTime)
+                if len(boarding):
+                    self.metrics.board(stopId, times[onTime:last], self.env.now, busIdx, segId,
+                                       self.busStops[busIdx].index(arriveStop, segId + 1) - 1)
+            if self.logPassanger:
+                for idx in queue.waiting[first:last].tolist():
+                    self.eventLog.record(int(table.timeAtStop[idx]), EventKind.PASSANGER_ARRIVE, stop=stopId,
+                                         passanger=idx)
+                for idx in queue.waiting[first:onTime].tolist():
+                    self.eventLog.record(int(table.timeAtStop[idx]) + leaveAngryTime, EventKind.PASSANGER_ANGRY,
+                                         stop=stopId, passanger=idx)
+                for idx in boarding.tolist():
+                    self.eventLog.record(self.env.now, EventKind.PASSANGER_ON_BUS, bus=bus.id, stop=stopId,
+                                         passanger=idx)
+        if len(boarded) and self.logBus:
+            self.eventLog.record(self.env.now, EventKind.BATCH_ON_BUS, bus=bus.id, stop=stopId, count=len(boarded))
+
+    def stopQueueSim(self, stopId):
+        state = self.stop_queue_state(stopId)
+        for _, isDeparture, busIdx, segId in self.stopEvents[stopId]:
+            if not isDeparture:
+                landing = self.land_event(busIdx, segId)
+                if landing is not None:
+                    yield landing
+                self.alight_batch(busIdx, stopId)
+            else:
+                departure = self.departure_event(busIdx, segId)
+                if departure is not None:
+                    yield departure
+                self.board_batch(busIdx, segId, stopId, state)
 
     def busRunSim(self, busIdx):
         bus = self.buses[busIdx]
         yield self.env.timeout(bus.get_depart_time())
-        busStopSequence = self.buses[busIdx].route.busStopSequence
-        for idx, location in enumerate(busStopSequence):
+        busStopSequence = self.busStops[busIdx]
+        for idx, duration in enumerate(self.busDurations[busIdx]):
+            location, arriveId = busStopSequence[idx], busStopSequence[idx + 1]
+
+            self.departed[busIdx] = idx + 1
+            departure = self.departEvents.pop((busIdx, idx), None)
+            if departure is not None:
+                departure.succeed(fly_seg(bus=bus, segId=idx))
+
+            if self.logBus:
+                self.eventLog.record(self.env.now, EventKind.BUS_DEPART, bus=bus.id, stop=location)
+            yield self.env.timeout(duration)
+            if self.logBus:
+                self.eventLog.record(self.env.now, EventKind.BUS_ARRIVE, bus=bus.id, stop=arriveId)
+
+            self.landed[busIdx] = idx + 1
+            landing = self.landEvents.pop((busIdx, idx), None)
+            if landing is not None:
+                landing.succeed()
 
-            if idx < len(busStopSequence) - 1:
-                flyTimeData = flyTime[busIdx][idx]
+    # heap engine handlers, the same model as the processes above written as callbacks on an EventCore
 
-                if self.busDepartureEvent.get(bus.id, location) is not None:
-                    self.busDepartureEvent[bus.id, location].succeed(fly_seg(bus=bus, segId=idx))
+    def busDepartHandler(self, busIdx):
+        segId = self.departed[busIdx]
+        self.departed[busIdx] = segId + 1
+        self.eventLog.record(self.env.now, EventKind.BUS_DEPART, bus=self.buses[busIdx].id,
+                             stop=self.busStops[busIdx][segId])
+        self.env.at(self.env.now + self.busDurations[busIdx][segId], self.busLandHandler, busIdx)
 
-                print(f'bus {busIdx} time to fly at {self.env.now} at {busStopDict[flyTimeData.departureId]}')
-                yield self.env.timeout(flyTimeData.duration)
-                print(f'bus {busIdx} arrive at {busStopDict[flyTimeData.arriveId]} at time {self.env.now}')
+    def busLandHandler(self, busIdx):
+        segId = self.landed[busIdx]
+        self.landed[busIdx] = segId + 1
+        self.eventLog.record(self.env.now, EventKind.BUS_ARRIVE, bus=self.buses[busIdx].id,
+                             stop=self.busStops[busIdx][segId + 1])
+        # the bus heads straight on down the next segment
+        if segId + 1 < len(self.busDurations[busIdx]):
+            self.busDepartHandler(busIdx)
 
-                if self.busLandEvent.get(bus.id, flyTimeData.arriveId) is not None:
-                    self.busLandEvent[bus.id, flyTimeData.arriveId].succeed()
+    def departHandler(self, key):
+        busIdx, segId = key
+        waiting = self.departEvents.pop(key)
+        if self.bulk:
+            self.board_all(waiting, busIdx, segId)
+        else:
+            for idx in waiting:
+                self.board_heap(idx, busIdx, segId)
 
+    def landHandler(self, key):
+        busIdx = key[0]
+        leaving = self.landEvents.pop(key)
+        if self.bulk:
+            self.alight_all(leaving)
+            return
+        for idx in leaving:
+            nextDeparture = self.alight(idx, busIdx)
+            if nextDeparture is not None:
+                self.wait_heap(idx, *nextDeparture)
 
-sim = BusSimulation(buses=buses, passangers=passangers)
-sim.runAirSim()
+    def board_heap(self, idx, busIdx: int, segId: int):
+        self.land_heap(idx, busIdx, self.board(idx, busIdx, segId))
 
+    def land_heap(self, idx, busIdx: int, landSeg: int):
+        # the first passanger riding to the end of a segment schedules the bus landing there
+        key = (busIdx, landSeg)
+        landing = self.landEvents.get(key)
+        if landing is None:
+            landing = self.landEvents[key] = []
+            self.env.at(self.busDeparts[busIdx][landSeg] + self.busDurations[busIdx][landSeg], self.landHandler, key)
+        landing.append(idx)
 
+    def board_all(self, idxs: list[int], busIdx: int, segId: int):
+        """
+        board for everybody waiting on a bus, when all of them ride one leg and nothing is recorded:
+        one array write per column instead of one per passanger.
+        """
+        table = self.passangers
+        rows = np.array(idxs, dtype=np.int64)
+        table.set_on_bus(rows, self.env.now, self.buses[busIdx].id)
+        stops = self.busStops[busIdx]
+        for idx, arriveStop in zip(idxs, table.arriveBusStop[rows].tolist()):
+            self.land_heap(idx, busIdx, stops.index(arriveStop, segId + 1) - 1)
 
-for id, busTimes in flyTime.items():
-    for busSegTime in busTimes:
-        busSegTime: BusTime = busSegTime
-        print(f'bus {id} leave from {busStopDict[busSegTime.departureId]} '
-              f'at {busSegTime.departureTime} to {busStopDict[busSegTime.arriveId]} with {busSegTime.duration} seconds')
-pData = []
-for p in passangers:
-    print(f'{p.id} on bus {p.busId} at time {p.get_on_bus()} from stop {busStopDict[p.departBusStop]} '
-          f' wait at {p.timeAtStop} to {busStopDict[p.arriveBusStop]} arrive at time {p.leave_bus} ')
-    pData.append([p.id, busStopDict[p.departBusStop], busStopDict[p.arriveBusStop], p.timeAtStop, p.get_on_bus(), p.leave_bus])
+    def alight_all(self, idxs: list[int]):
+        """
+        alight for everybody getting off a bus at their destination, see board_all.
+        """
+        rows = np.array(idxs, dtype=np.int64)
+        self.passangers.set_leave_bus(rows, self.env.now)
+        if self.resultsWriter is not None:
+            self.write_results(rows)
+        if self.recycle:
+            self.freeRows.extend(idxs)
 
-pLog = pandas.DataFrame(pData, columns = ['id', 'start', 'dest', 'show time', 'on bus', 'leave'])
-pLog.to_csv('passangers.csv', index=False)
+    def wait_heap(self, idx, busIdx: int, segId: int):
+        # the first passanger waiting for a bus to leave schedules it, a bus leaving right now is scheduled again
+        # for whoever comes after its handler ran
+        key = (busIdx, segId)
+        waiting = self.departEvents.get(key)
+        if waiting is None:
+            waiting = self.departEvents[key] = []
+            self.env.at(self.busDeparts[busIdx][segId], self.departHandler, key)
+        waiting.append(idx)
 
-import matplotlib.pyplot as plt
-def plot_bus_table(buses: list[Bus], passengers:list[Passanger] = []):
+    def show_up_stream(self, blocks):
+        """
+        (row, show time, departure time, bus index, segment id) of every passanger in show up order,
+        the bus each one will take is looked up a whole block at a time. A departure time of -1 means no bus.
+        """
+        # chained zips, so handing out the next passanger runs no python code
+        return itertools.chain.from_iterable(map(self.show_up_block, blocks))
 
-    fig = plt.figure()
+    def show_up_block(self, rows):
+        table = self.passangers
+        showTimes = table.timeAtStop[rows]
+        departStops, arriveStops = table.departBusStop[rows], table.arriveBusStop[rows]
+        if self.planner is not None:
+            arriveStops = self.planner.leg_ends(departStops, arriveStops)
+        departTimes, busIdxs, segIds = self.departureIndex.next_departures(departStops, arriveStops, showTimes)
+        if self.bulk and not self.recycle:
+            # nobody sees when they give up or find there's no bus, only how they end up
+            angry = (departTimes >= 0) & (departTimes >= showTimes + leaveAngryTime)
+            table.status[rows[angry]] = PassengerTable.ANGRY
+            boarding = (departTimes >= 0) & ~angry
+            rows, showTimes, departTimes, busIdxs, segIds = (column[boarding] for column in
+                                                             (rows, showTimes, departTimes, busIdxs, segIds))
+        return zip(rows.tolist(), showTimes.tolist(), departTimes.tolist(), busIdxs.tolist(), segIds.tolist())
+
+    def arrivalHandler(self, _):
+        # passangers show up one after the other until something else is due first,
+        # then the handler comes back for the next one
+        env = self.env
+        showUp = self.nextShowUp
+        queue = env.queue
+        while showUp is not None:
+            idx, showTime, departTime, busIdx, segId = showUp
+            if showTime > env.now:
+                if queue and queue[0][0] < showTime:
+                    break
+                env.advance(showTime)
+            if departTime < 0 or self.logPassanger:
+                if self.show_up(idx, (departTime, busIdx, segId) if departTime >= 0 else None) is not None:
+                    self.wait_heap(idx, busIdx, segId)
+            # what show_up does for everybody with a bus when there's no trace to record
+            elif departTime >= showTime + leaveAngryTime:
+                self.angry_later(idx)
+            else:
+                self.wait_heap(idx, busIdx, segId)
+            showUp = next(self.showUps, None)
+        self.nextShowUp = showUp
+        if showUp is not None:
+            self.env.at(showUp[1], self.arrivalHandler)
+
+    def angryHandler(self, _):
+        # the same catching up as arrivalHandler
+        env = self.env
+        queue = env.queue
+        angryQueue = self.angryQueue
+        while angryQueue:
+            deadline, idx = angryQueue[0]
+            if deadline > env.now:
+                if queue and queue[0][0] < deadline:
+                    env.at(deadline, self.angryHandler)
+                    return
+                env.advance(deadline)
+            angryQueue.popleft()
+            self.give_up(idx)
+
+    def stopQueueHandler(self, stopId):
+        events = self.stopEvents[stopId]
+        position = self.stopNext[stopId]
+        _, isDeparture, busIdx, segId = events[position]
+        if isDeparture:
+            self.board_batch(busIdx, segId, stopId, self.stopStates[stopId])
+        else:
+            self.alight_batch(busIdx, stopId)
+        self.stopNext[stopId] = position + 1
+        if position + 1 < len(events):
+            self.env.at(events[position + 1][0], self.stopQueueHandler, stopId)
+
+
+def plot_bus_table(buses: list[Bus] | Timetable, passengers: list[Passanger] | PassengerTable = [], output: str = None,
+                   maxTrips: int = 2000, maxPassangers: int = 20000):
+    """
+    Time space diagram of the timetable, stops up the side and time along the bottom.
+    Every trip goes in one LineCollection and every passanger in one scatter, so thousands of trips draw quickly.
+    :param passengers: Passangers to mark where and when they show up.
+    :param output: File to save the figure to (.png, .svg, .pdf ...) instead of showing it, works without a display.
+    :param maxTrips: Draw every k-th trip past this many.
+    :param maxPassangers: Draw every k-th passanger past this many.
+    :return: The matplotlib Figure.
+    """
+    from matplotlib.collections import LineCollection
+    from matplotlib.figure import Figure
+    from matplotlib.lines import Line2D
+
+    timetable = buses if isinstance(buses, Timetable) else Timetable.from_bus_table(buses)
+    if output is None:
+        import matplotlib.pyplot as plt
+        fig = plt.figure()
+    else:
+        # no pyplot, so nothing needs a display
+        fig = Figure()
     ax = fig.add_subplot(111)
-    stops = list(busStopDict.values())
-    #print(stops)
-    yLabelPosition = [s * 10 for s in range(len(stops))]
-    #print(yLabelPosition)
-    xLabelPosition = [i for i in range(20)]
-    #print(xLabelPosition)
-
-    for bus in buses:
-        x = []
-        y = []
-        for idx, busSegTime in enumerate(flyTime[bus.id]):
-            busSegTime: BusTime = busSegTime
-            #print(f'bus {bus.id} leave from {busStopDict[busSegTime.departureId]} '
-            #      f'at {busSegTime.departureTime} to {busStopDict[busSegTime.arriveId]} with {busSegTime.duration} seconds')
-            x.append(busSegTime.departureTime)
-            #x.append(busSegTime.departureTime + busSegTime.duration)
-            y.append(yLabelPosition[(busSegTime.departureId - 1)])
-            #y.append(yLabelPosition[(busSegTime.arriveId - 1)])
-            if idx == len(flyTime[bus.id]) - 1:
-                x.append(busSegTime.departureTime + busSegTime.duration)
-                y.append(yLabelPosition[(busSegTime.arriveId - 1)])
-
-            #print(x,y)
-        ax.plot(x, y, marker='o', label=f'bus {bus.id}')
-    plt.xticks(xLabelPosition)
-    plt.xlabel('Time')
-
-    ax.set_yticks(yLabelPosition)
-    ax.set_yticklabels(stops)
-
-    if False:
-        no_of_colors = 5
-        colors = ["#" + ''.join([random.choice('0123456789ABCDEF') for i in range(6)])
-                 for j in range(no_of_colors)]
-
-        for passanger in passengers:
-            x = []
-            y = []
-            x.append(passanger.timeAtStop)
-            y.append(yLabelPosition[passanger.departBusStop - 1])
-            ax.plot(x, y, marker='o', color=colors[passanger.id], label=f'passanger {passanger.id}')
-
-    plt.legend()
-    plt.show()
-
-plot_bus_table(buses, passangers)
\ No newline at end of file
+
+    stops = np.union1d(np.fromiter(busStopDict, dtype=np.int64), timetable.stops)
+    yLabelPosition = np.arange(len(stops)) * 10
+
+    tripStride = -(-len(timetable) // maxTrips) if len(timetable) > maxTrips else 1
+    trips = np.arange(0, len(timetable), tripStride)
+    trips = trips[timetable.segments[trips] > 0]
+    # leave each stop at its departure time, the last one is where the bus gets in
+    positions = np.arange(timetable.stopSequence.shape[1])
+    x = np.where(timetable.isSegment, timetable.depart, timetable.arrive)[trips]
+    y = yLabelPosition[np.searchsorted(stops, np.maximum(timetable.stopSequence[trips], 0))]
+    ends = timetable.segments[trips] + 1
+    lines = [np.column_stack((x[k, :end], y[k, :end])) for k, end in enumerate(ends.tolist())]
+    palette = [f'C{i}' for i in range(10)]
+    colors = [palette[k % len(palette)] for k in range(len(lines))]
+    ax.add_collection(LineCollection(lines, colors=colors))
+    valid = positions[None, :] < ends[:, None]
+    if valid.sum() <= 5000:
+        ax.scatter(x[valid], y[valid], c=np.repeat(colors, ends), marker='o', s=16, zorder=3)
+    if len(lines) <= 20:
+        ax.legend([Line2D([], [], color=color, marker='o') for color in colors],
+                  [f'bus {busId}' for busId in timetable.busIds[trips].tolist()])
+
+    if len(passengers):
+        if not isinstance(passengers, PassengerTable):
+            passengers = PassengerTable.from_passangers(passengers)
+        stride = -(-len(passengers.timeAtStop) // maxPassangers)
+        departBusStop = passengers.departBusStop[::stride]
+        ax.scatter(passengers.timeAtStop[::stride], yLabelPosition[np.searchsorted(stops, departBusStop)],
+                   s=4, color='grey', alpha=0.5, zorder=2)
+
+    ax.autoscale_view()
+    ax.set_xlabel('Time')
+    if tripStride > 1:
+        ax.set_title(f'1 in {tripStride} of {len(timetable)} trips')
+    if len(stops) <= 60:
+        ax.set_yticks(yLabelPosition)
+        ax.set_yticklabels([busStopDict.get(stop, str(stop)) for stop in stops.tolist()])
+    fig.tight_layout()
+
+    if output is None:
+        plt.show()
+    else:
+        fig.savefig(output)
+    return fig
+
+
+if __name__ == '__main__':
+    import cli
+    cli.main(['simulate', '--plot'])
@@ -0,0 +1,255 @@
+"""
+Command line entry point for the bus model demos.
+
+    python -m cli simulate --mode batched --seed 1 --output passangers.csv
+    python -m cli replicate -n 64 --workers 8
+    python -m cli route --start 8 --end 11 --plot
+    python -m cli v2 --plot
+    python -m cli plan --source 3 --target 20 --at 0
+    python -m cli network --seed 1 --headway 5000 --headway2 8000
+    python -m cli feed path/to/gtfs --start 06:00:00 --end 09:00:00 --transfers
+"""
+import argparse
+import random
+from datetime import datetime
+
+
+def simulate(args):
+    import bus
+    import eventlog
+    from eventlog import EventLog
+    from metrics import Metrics
+    from results import ResultsWriter
+
+    rng = random.Random(args.seed) if args.seed is not None else random
+    passangers = bus.generatePassangers(rng, perStop=args.passangers_per_stop)
+    model = None
+    if args.travel_noise or args.peak_factor != 1:
+        from traveltime import TravelTimeModel
+        # rush hours in the first and third quarter of every dayLength millonsec
+        model = TravelTimeModel(bandStarts=[0, args.day_length // 4, args.day_length // 2, 3 * args.day_length // 4],
+                                multipliers=[args.peak_factor, 1, args.peak_factor, 1], dayLength=args.day_length,
+                                noise=args.travel_noise)
+    timetable = bus.generateTimetable(rng, count=args.buses, step=args.headway, model=model)
+    if args.analytic:
+        onBus, busId, leaveBus = bus.solve_analytic(timetable, passangers)
+        with ResultsWriter(args.output, format=args.format) as resultsWriter:
+            resultsWriter.add_arrays({'id': passangers.id, 'start': passangers.departBusStop,
+                                      'dest': passangers.arriveBusStop, 'show time': passangers.timeAtStop,
+                                      'on bus': onBus, 'bus': busId, 'leave': leaveBus})
+    else:
+        eventLog = EventLog(level=args.log_level)
+        collector = Metrics() if args.metrics else None
+        with ResultsWriter(args.output, format=args.format) as resultsWriter:
+            sim = bus.BusSimulation(buses=timetable, passangers=passangers, mode=args.mode, eventLog=eventLog,
+                                    resultsWriter=resultsWriter, metrics=collector, engine=args.engine,
+                                    serviceStart=args.service_start)
+            sim.runAirSim()
+        if args.log_level > eventlog.OFF:
+            for line in eventLog.format_lines(bus.busStopDict, sim.simTime if args.service_start else None):
+                print(line)
+        if collector is not None:
+            summary = collector.summary()
+            for name in ('wait', 'ride'):
+                stat = summary[name]
+                print(f'{name:>5}  count {stat["count"]}  mean {stat["mean"]:.0f}  p50 {stat["p50"]:.0f}  '
+                      f'p95 {stat["p95"]:.0f}  p99 {stat["p99"]:.0f}')
+            print(f'angry {summary["angry"]}  no bus {summary["noBus"]}  peak bus load {summary["peakBusLoad"]}')
+    if args.plot or args.plot_output:
+        bus.plot_bus_table(timetable, passangers, output=args.plot_output)
+
+
+def replicate(args):
+    import replications
+
+    summary = replications.run_replications(args.replications, seed=args.seed, workers=args.workers, mode=args.mode,
+                                            engine=args.engine)
+    print(f'{args.replications} replications')
+    for name in replications.statNames:
+        stat = summary[name]
+        print(f'{name:>10}  mean {stat["mean"]:.3f}  std {stat["std"]:.3f}  '
+              f'95% ci [{stat["ci95"][0]:.3f}, {stat["ci95"][1]:.3f}]')
+
+
+def route(args):
+    import Routes
+
+    graph = Routes.build_graph_with_distances(Routes.routes, Routes.distances)
+    shortest_distance, path = Routes.dijkstra_shortest_path(graph, args.start, args.end)
+    if shortest_distance is not None:
+        print(f"The shortest distance from Stop {args.start} to Stop {args.end} is {shortest_distance} units.")
+        print(f"The path is: {' -> '.join(map(str, path))}")
+        if args.plot or args.plot_output:
+            Routes.plot_bus_routes(Routes.stop_coords, Routes.routes, path, output=args.plot_output)
+    else:
+        print(f"No path found between Stop {args.start} and Stop {args.end}.")
+
+
+def v2(args):
+    import bus_v2
+
+    bus_v2.display_route(bus_v2.route1, 1)
+    bus_v2.display_route(bus_v2.route2, 2)
+    bus_v2.sim_time_demo()
+    if args.plot or args.plot_output:
+        bus_v2.plot_routes_v2(output=args.plot_output)
+
+
+def plan(args):
+    import bus
+    import bus_v2
+    from raptor import Raptor
+
+    # buses on both bus_v2 routes, they meet at the transit stop 8
+    timetable = bus.Timetable.from_routes([bus.Route(1, bus_v2.route1), bus.Route(2, bus_v2.route2)],
+                                          args.buses, args.headway)
+    planner = Raptor.from_timetable(timetable, minTransferTime=args.transfer_time)
+    journeys = planner.pareto(args.source, args.target, args.at, maxTransfers=args.max_transfers)
+    if not journeys:
+        print(f'No journey from {bus_v2.busStopDictV2[args.source]} to {bus_v2.busStopDictV2[args.target]}')
+    for journey in journeys:
+        print(f'arrive at {journey.arrival} with {journey.transfers} transfers')
+        for leg in journey.legs:
+            print(f'    bus {leg.bus} from {bus_v2.busStopDictV2[leg.fromStop]} at {leg.departTime} '
+                  f'to {bus_v2.busStopDictV2[leg.toStop]} at {leg.arriveTime}')
+
+
+def network(args):
+    import bus
+    import bus_v2
+    from metrics import Metrics
+    from results import ResultsWriter
+
+    rng = random.Random(args.seed) if args.seed is not None else random
+    # each bus_v2 route on its own headway, passangers going between any two stops change bus at stop 8
+    timetable = bus.Timetable.from_routes([bus.Route(1, bus_v2.route1), bus.Route(2, bus_v2.route2)], args.buses,
+                                          [args.headway, args.headway2 or args.headway], rng=rng)
+    passangers = bus.generatePassangers(rng, perStop=args.passangers_per_stop, stops=sorted(bus_v2.busStopDictV2))
+    collector = Metrics()
+    with ResultsWriter(args.output, format=args.format) as resultsWriter:
+        bus.BusSimulation(buses=timetable, passangers=passangers, resultsWriter=resultsWriter, metrics=collector,
+                          engine=args.engine, transfers=True).runAirSim()
+    arrived = passangers.status == bus.PassengerTable.ARRIVED
+    for count in range(int(passangers.transfers.max(initial=0)) + 1):
+        print(f'arrived with {count} transfers: {int((arrived & (passangers.transfers == count)).sum())}')
+    summary = collector.summary()
+    print(f'angry {summary["angry"]}  no bus {summary["noBus"]}  peak bus load {summary["peakBusLoad"]}')
+
+
+def feed(args):
+    import time
+
+    import bus
+    import gtfs
+    from metrics import Metrics
+    from results import ResultsWriter
+
+    started = time.perf_counter()
+    network = gtfs.load_feed(args.path, cache=not args.no_cache)
+    print(f'{len(network.stopIds)} stops, {len(network.routeIds)} routes, {len(network)} trips, '
+          f'{len(network.stopTimeStop)} stop times loaded in {time.perf_counter() - started:.2f}s')
+    # the window starts with the first trip of the day unless told otherwise
+    start = gtfs.TimeCache()[args.start] if args.start else int(network.departure.min()) if len(network.departure) else 0
+    end = gtfs.TimeCache()[args.end] if args.end else None
+    timetable = network.timetable(start, end, ticksPerSecond=args.ticks_per_second)
+    rng = random.Random(args.seed) if args.seed is not None else random
+    passangers = bus.generatePassangers(rng, perStop=args.passangers_per_stop, stops=timetable.stops.tolist())
+    collector = Metrics()
+    with ResultsWriter(args.output, format=args.format) as resultsWriter:
+        bus.BusSimulation(buses=timetable, passangers=passangers, resultsWriter=resultsWriter, metrics=collector,
+                          engine=args.engine, transfers=args.transfers).runAirSim()
+    summary = collector.summary()
+    print(f'{len(timetable)} trips simulated, {summary["ride"]["count"]} passangers arrived  '
+          f'angry {summary["angry"]}  no bus {summary["noBus"]}  peak bus load {summary["peakBusLoad"]}')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m cli', description='Bus model demos')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    sim = commands.add_parser('simulate', help='generate a scenario, simulate it and write passanger results')
+    sim.add_argument('--seed', type=int, default=None, help='random seed, unseeded when left out')
+    sim.add_argument('--mode', choices=['passanger', 'batched'], default='passanger')
+    sim.add_argument('--engine', choices=['simpy', 'heap'], default='simpy', help='event engine to run the model on')
+    sim.add_argument('--analytic', action='store_true', help='use solve_analytic instead of simulating')
+    sim.add_argument('--buses', type=int, default=10, help='number of buses')
+    sim.add_argument('--headway', type=int, default=5000, help='millonsec between bus starts')
+    sim.add_argument('--passangers-per-stop', type=int, default=120)
+    sim.add_argument('--travel-noise', type=float, default=0.0, help='coefficient of variation of travel times')
+    sim.add_argument('--peak-factor', type=float, default=1.0, help='travel time multiplier in rush hours')
+    sim.add_argument('--day-length', type=int, default=100_000, help='millonsec before the rush hours come round again')
+    sim.add_argument('--output', default='passangers.csv')
+    sim.add_argument('--format', choices=['csv', 'npy', 'parquet'], default='csv')
+    sim.add_argument('--log-level', type=int, default=0, help='0 silent, 1 buses, 2 every passanger')
+    sim.add_argument('--service-start', type=datetime.fromisoformat, default=None,
+                     help='print the trace with timestamps, millonsec 0 being this date and time')
+    sim.add_argument('--metrics', action='store_true', help='print wait / ride quantiles, angry passangers and loads')
+    sim.add_argument('--plot', action='store_true', help='plot the bus timetable')
+    sim.add_argument('--plot-output', default=None, help='save the timetable plot to this image file instead')
+    sim.set_defaults(run=simulate)
+
+    rep = commands.add_parser('replicate', help='run seeded replications in parallel and print statistics')
+    rep.add_argument('-n', '--replications', type=int, default=32)
+    rep.add_argument('--seed', type=int, default=0)
+    rep.add_argument('--workers', type=int, default=None, help='worker processes, defaults to the cpu count')
+    rep.add_argument('--mode', choices=['passanger', 'batched'], default='batched')
+    rep.add_argument('--engine', choices=['simpy', 'heap'], default='simpy')
+    rep.set_defaults(run=replicate)
+
+    path = commands.add_parser('route', help='shortest path between two stops of the Routes.py network')
+    path.add_argument('--start', type=int, default=8)
+    path.add_argument('--end', type=int, default=11)
+    path.add_argument('--plot', action='store_true')
+    path.add_argument('--plot-output', default=None, help='write the plot to this .html or image file instead')
+    path.set_defaults(run=route)
+
+    demo = commands.add_parser('v2', help='show the two route bus_v2 network')
+    demo.add_argument('--plot', action='store_true')
+    demo.add_argument('--plot-output', default=None, help='write the plot to this .html or image file instead')
+    demo.set_defaults(run=v2)
+
+    journey = commands.add_parser('plan', help='plan a journey on the bus_v2 routes, changing bus at stop 8')
+    journey.add_argument('--source', type=int, default=3)
+    journey.add_argument('--target', type=int, default=20)
+    journey.add_argument('--at', type=int, default=0, help='millonsec to leave the source stop')
+    journey.add_argument('--buses', type=int, default=10, help='buses per route')
+    journey.add_argument('--headway', type=int, default=5000, help='millonsec between bus starts')
+    journey.add_argument('--transfer-time', type=int, default=0)
+    journey.add_argument('--max-transfers', type=int, default=3)
+    journey.set_defaults(run=plan)
+
+    net = commands.add_parser('network', help='simulate both bus_v2 routes with passangers changing bus at stop 8')
+    net.add_argument('--seed', type=int, default=None, help='random seed, unseeded when left out')
+    net.add_argument('--engine', choices=['simpy', 'heap'], default='simpy')
+    net.add_argument('--buses', type=int, default=10, help='buses per route')
+    net.add_argument('--headway', type=int, default=5000, help='millonsec between bus starts on route 1')
+    net.add_argument('--headway2', type=int, default=None, help='millonsec between bus starts on route 2, '
+                                                                  'same as route 1 when left out')
+    net.add_argument('--passangers-per-stop', type=int, default=40)
+    net.add_argument('--output', default='passangers.csv')
+    net.add_argument('--format', choices=['csv', 'npy', 'parquet'], default='csv')
+    net.set_defaults(run=network)
+
+    gtfsFeed = commands.add_parser('feed', help='load a GTFS-like feed directory and simulate a time window of it')
+    gtfsFeed.add_argument('path', help='directory with stops.txt, routes.txt, trips.txt and stop_times.txt')
+    gtfsFeed.add_argument('--start', default=None, help='run trips leaving from this, H:MM:SS, tick 0 of the run')
+    gtfsFeed.add_argument('--end', default=None, help='run trips leaving before this, H:MM:SS')
+    gtfsFeed.add_argument('--ticks-per-second', type=float, default=1000, help='engine millonsec per feed second')
+    gtfsFeed.add_argument('--no-cache', action='store_true', help='parse the text files, ignoring the binary cache')
+    gtfsFeed.add_argument('--seed', type=int, default=None, help='random seed, unseeded when left out')
+    gtfsFeed.add_argument('--engine', choices=['simpy', 'heap'], default='heap')
+    gtfsFeed.add_argument('--transfers', action='store_true', help='let passangers change between trips')
+    gtfsFeed.add_argument('--passangers-per-stop', type=int, default=20)
+    gtfsFeed.add_argument('--output', default='passangers.csv')
+    gtfsFeed.add_argument('--format', choices=['csv', 'npy', 'parquet'], default='csv')
+    gtfsFeed.set_defaults(run=feed)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Vectorised passanger demand: Poisson arrivals per stop drawn with a numpy Generator,
+piecewise time of day rates by thinning, and destinations from an origin -> destination matrix.
+"""
+import numpy as np
+
+import bus
+
+# generatePassangers shows one passanger per stop every 400 millonsec on average
+defaultRate = 1 / 400
+
+
+class RateProfile:
+    """
+    Piecewise constant arrival rate in passangers per millonsec: band i runs from starts[i] to starts[i + 1],
+    the last one runs on forever and nobody arrives before starts[0].
+    """
+    def __init__(self, starts, rates):
+        """
+        :param starts: Start time of each band in millonsec, increasing.
+        :param rates: Rate per band, or band x origin stop for a different rate at every stop.
+        """
+        self.starts = np.asarray(starts, dtype=np.float64)
+        self.rates = np.asarray(rates, dtype=np.float64)
+        if self.rates.ndim == 1:
+            self.rates = self.rates[:, None]
+        if len(self.starts) != len(self.rates) or np.any(np.diff(self.starts) <= 0):
+            raise ValueError('need one increasing start time per rate band')
+        if np.any(self.rates < 0):
+            raise ValueError('arrival rates can not be negative')
+
+    @classmethod
+    def constant(cls, rate: float = defaultRate):
+        return cls([0], [rate])
+
+    def peak(self, stops: int) -> np.ndarray:
+        return np.broadcast_to(self.rates.max(axis=0), (stops,))
+
+    def at(self, times: np.ndarray, stopIdx: int) -> np.ndarray:
+        band = np.searchsorted(self.starts, times, side='right') - 1
+        rates = self.rates[:, min(stopIdx, self.rates.shape[1] - 1)]
+        return np.where(band >= 0, rates[np.maximum(band, 0)], 0.0)
+
+
+def default_od(stops: list[int]) -> np.ndarray:
+    """
+    Same destinations as generatePassangers: any later stop, all equally likely.
+    """
+    return np.triu(np.ones((len(stops), len(stops))), k=1)
+
+
+def arrival_times(rng: np.random.Generator, rate: float, horizon: float) -> np.ndarray:
+    """
+    Homogeneous Poisson arrivals in [0, horizon), drawn in blocks sized for the expected count.
+    """
+    if rate <= 0:
+        return np.zeros(0)
+    expected = rate * horizon
+    size = int(expected + 6 * np.sqrt(expected) + 16)
+    times = np.cumsum(rng.exponential(1 / rate, size))
+    while times[-1] < horizon:
+        times = np.concatenate((times, times[-1] + np.cumsum(rng.exponential(1 / rate, size))))
+    return times[:np.searchsorted(times, horizon)]
+
+
+def generate_demand(rng: np.random.Generator | int = None, stops: list[int] = None, rates: RateProfile = None,
+                    horizon: int = None, perStop: int = None, od=None) -> bus.PassengerTable:
+    """
+    Generate a whole population in one go, grouped by origin stop in the order of stops and by arrival time within.
+    Give either horizon, to run every origin for that long, or perStop for a fixed number of passangers
+    per origin at a constant rate like generatePassangers.
+    :param rng: numpy Generator or seed.
+    :param stops: Stop ids the od matrix refers to, defaults to every stop in busStopDict.
+    :param rates: Arrival rate over time, defaults to the generatePassangers rate all day.
+                  Varying rates are sampled at their peak and thinned.
+    :param horizon: Millonsec to generate arrivals for.
+    :param perStop: Passangers per origin stop, only for a constant rate.
+    :param od: origin x destination weights over stops, each row is normalised. Defaults to default_od.
+               Stops whose row is all zero never get anyone.
+    :return: A PassengerTable with every column filled in.
+    """
+    rng = rng if isinstance(rng, np.random.Generator) else np.random.default_rng(rng)
+    stops = sorted(bus.busStopDict) if stops is None else list(stops)
+    rates = rates if rates is not None else RateProfile.constant()
+    od = default_od(stops) if od is None else np.asarray(od, dtype=np.float64)
+    if od.shape != (len(stops), len(stops)):
+        raise ValueError(f'od must be {len(stops)} x {len(stops)}')
+    if (horizon is None) == (perStop is None):
+        raise ValueError('give exactly one of horizon and perStop')
+    if perStop is not None and (len(rates.starts) > 1 or rates.starts[0] != 0):
+        raise ValueError('perStop needs a constant rate, use horizon with a time varying one')
+
+    origins = np.flatnonzero(od.sum(axis=1) > 0)
+    peaks = rates.peak(len(stops))
+    times = []
+    for stopIdx in origins.tolist():
+        if peaks[stopIdx] <= 0:
+            # nobody ever shows up there, arrival_times draws nothing for it in horizon mode either
+            times.append(np.zeros(0))
+            continue
+        if perStop is not None:
+            # the same rounded up gaps as get_next_arrive_time
+            times.append(np.cumsum(np.ceil(rng.exponential(1 / peaks[stopIdx], perStop))))
+            continue
+        candidates = arrival_times(rng, peaks[stopIdx], horizon - rates.starts[0]) + rates.starts[0]
+        keep = rng.random(len(candidates)) * peaks[stopIdx] < rates.at(candidates, stopIdx)
+        times.append(np.ceil(candidates[keep]))
+
+    counts = np.array([len(t) for t in times], dtype=np.int64)
+    table = bus.PassengerTable(int(counts.sum()))
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    stopIds = np.asarray(stops, dtype=np.int64)
+    for k, stopIdx in enumerate(origins.tolist()):
+        rows = slice(offsets[k], offsets[k + 1])
+        table.departBusStop[rows] = stopIds[stopIdx]
+        table.timeAtStop[rows] = times[k]
+        cdf = np.cumsum(od[stopIdx])
+        destination = np.searchsorted(cdf, rng.random(counts[k]) * cdf[-1], side='right')
+        table.arriveBusStop[rows] = stopIds[np.minimum(destination, len(stops) - 1)]
+    return table
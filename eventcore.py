@@ -0,0 +1,71 @@
+"""
+Minimal discrete event core BusSimulation can run on instead of SimPy (engine='heap').
+The clock is an integer number of millonsec and the schedule a heapq of plain (time, seq, handler, arg) tuples.
+There are no processes, events or conditions: a handler is any callable, run with its arg once its time comes,
+and it schedules whatever has to happen next itself.
+"""
+import heapq
+import itertools
+
+
+class EventCore:
+    def __init__(self, start: int = 0):
+        self.now = start
+        self.queue: list[tuple] = []
+        # ties on time run in the order they were scheduled
+        self.seq = itertools.count()
+        self.handled = 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def at(self, time: int, handler, arg=None):
+        """
+        Run handler(arg) at time, which must not be in the past.
+        """
+        heapq.heappush(self.queue, (time, next(self.seq), handler, arg))
+
+    def after(self, delay: int, handler, arg=None):
+        self.at(self.now + delay, handler, arg)
+
+    def peek(self) -> int:
+        """
+        :return: When the next handler is due, None if nothing is scheduled.
+        """
+        return self.queue[0][0] if self.queue else None
+
+    def advance(self, time: int):
+        """
+        Move the clock on to time without running anything, for a handler catching up on work due
+        no later than the next scheduled one.
+        """
+        if time < self.now or (self.queue and time > self.queue[0][0]):
+            raise ValueError(f'can not move the clock from {self.now} to {time}')
+        self.now = time
+
+    def step(self) -> bool:
+        """
+        Run the next handler.
+        :return: False if there was nothing left to run.
+        """
+        if not self.queue:
+            return False
+        self.now, _, handler, arg = heapq.heappop(self.queue)
+        handler(arg)
+        self.handled += 1
+        return True
+
+    def run(self, until: int = None):
+        """
+        Run handlers until there are none left, or until the next one is due after until.
+        """
+        queue = self.queue
+        pop = heapq.heappop
+        handled = 0
+        while queue and (until is None or queue[0][0] <= until):
+            self.now, _, handler, arg = pop(queue)
+            handler(arg)
+            handled += 1
+        self.handled += handled
+        if until is not None and until > self.now:
+            self.now = until
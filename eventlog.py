@@ -0,0 +1,100 @@
+import enum
+
+import numpy as np
+
+# verbosity levels, each one records everything the levels below it record
+OFF = 0
+BUS = 1  # bus departures / arrivals and batched boarding counts
+PASSANGER = 2  # every passanger arrival, boarding, leaving and giving up
+
+
+class EventKind(enum.IntEnum):
+    BUS_DEPART = 1
+    BUS_ARRIVE = 2
+    PASSANGER_ARRIVE = 3
+    PASSANGER_ON_BUS = 4
+    PASSANGER_LEAVE_BUS = 5
+    PASSANGER_ANGRY = 6
+    PASSANGER_NO_BUS = 7
+    BATCH_ON_BUS = 8
+    BATCH_LEAVE_BUS = 9
+
+
+class EventLog:
+    """
+    Fixed size ring buffer of simulation events stored as int64 columns.
+    Once the buffer is full the oldest events are overwritten, so a long run keeps its latest capacity events.
+    Callers check `level` before recording, so a log at OFF costs one comparison per event site.
+    """
+    columns = ('time', 'kind', 'bus', 'stop', 'passanger', 'count')
+
+    def __init__(self, level: int = OFF, capacity: int = 1 << 20):
+        self.level = level
+        self.capacity = capacity
+        self.buffer = np.zeros((capacity, len(self.columns)), dtype=np.int64) if level > OFF else None
+        self.total = 0  # events recorded so far, including overwritten ones
+
+    def record(self, time: int, kind: EventKind, bus: int = -1, stop: int = -1, passanger: int = -1, count: int = 0):
+        self.buffer[self.total % self.capacity] = (time, kind, bus, stop, passanger, count)
+        self.total += 1
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """
+        Events still in the buffer in the order they were recorded, one array per column.
+        """
+        if self.buffer is None:
+            rows = np.zeros((0, len(self.columns)), dtype=np.int64)
+        elif self.total <= self.capacity:
+            rows = self.buffer[:self.total]
+        else:
+            rows = np.roll(self.buffer, -(self.total % self.capacity), axis=0)
+        return {name: rows[:, i].copy() for i, name in enumerate(self.columns)}
+
+    def to_dataframe(self, simTime=None):
+        """
+        :param simTime: simtime.SimTime to turn the time column into datetimes with.
+        """
+        import pandas
+        arrays = self.to_arrays()
+        if simTime is not None:
+            arrays['time'] = simTime.to_datetimes(arrays['time'], missing=None)
+        frame = pandas.DataFrame(arrays)
+        frame['kind'] = [EventKind(k).name for k in frame['kind']]
+        return frame
+
+    def to_csv(self, path: str, simTime=None):
+        self.to_dataframe(simTime).to_csv(path, index=False)
+
+    def format_lines(self, stopNames: dict[int, str] = None, simTime=None):
+        """
+        Rebuild a human readable trace from the recorded events.
+        :param stopNames: Optional stop id -> name mapping, stop ids are printed otherwise.
+        :param simTime: simtime.SimTime to print times as timestamps with, all formatted in one go.
+        """
+        stopNames = stopNames or {}
+        arrays = self.to_arrays()
+        if simTime is not None:
+            arrays['time'] = simTime.format(arrays['time'], unit='ms')
+        for time, kind, bus, stop, passanger, count in zip(*(arrays[name].tolist() for name in self.columns)):
+            where = stopNames.get(stop, stop)
+            if kind == EventKind.BUS_DEPART:
+                yield f'bus {bus} time to fly at {time} at {where}'
+            elif kind == EventKind.BUS_ARRIVE:
+                yield f'bus {bus} arrive at {where} at time {time}'
+            elif kind == EventKind.PASSANGER_ARRIVE:
+                yield f'passanger {passanger} arrive at {where} at {time}'
+            elif kind == EventKind.PASSANGER_ON_BUS:
+                yield f'passanger {passanger} ready to on borad of bus {bus} at {time} at {where}'
+            elif kind == EventKind.PASSANGER_LEAVE_BUS:
+                yield f'passanger {passanger} ready to leave of bus {bus} at {time} at {where}'
+            elif kind == EventKind.PASSANGER_ANGRY:
+                yield f'passanger {passanger} leave angry at {time} at {where}'
+            elif kind == EventKind.PASSANGER_NO_BUS:
+                yield f'no bus for passanger {passanger} at {time} at {where}'
+            elif kind == EventKind.BATCH_ON_BUS:
+                yield f'{count} passangers on borad of bus {bus} at {time} at {where}'
+            elif kind == EventKind.BATCH_LEAVE_BUS:
+                yield f'{count} passangers leave bus {bus} at {time} at {where}'
@@ -0,0 +1,316 @@
+"""
+Streaming loader for GTFS-like feeds: a directory with stops.txt, routes.txt, trips.txt and stop_times.txt.
+Files are read blockSize rows at a time, stop / route / trip ids are interned into dense indices 0, 1, ...
+in file order and stop_times ends up as a few flat numpy arrays. Those arrays are cached in one .npz file
+next to the feed, so loading the same feed again is a single np.load instead of parsing text.
+"""
+import csv
+import gc
+import itertools
+import os
+
+import numpy as np
+
+import bus
+
+feedFiles = ('stops.txt', 'routes.txt', 'trips.txt', 'stop_times.txt')
+# bump whenever the cached arrays change
+cacheVersion = 1
+
+
+class Interner(dict):
+    """
+    id -> dense index, the next index going to each id seen for the first time.
+    """
+    def __missing__(self, key):
+        index = self[key] = len(self)
+        return index
+
+
+class TimeCache(dict):
+    """
+    'H:MM:SS' -> seconds after midnight, -1 for an empty time. Hours go past 24 for trips running over midnight.
+    Feeds repeat the same few thousand times over millions of rows, so each one is parsed once.
+    """
+    def __missing__(self, value):
+        text = value.strip()
+        if text:
+            hours, minutes, seconds = text.split(':')
+            parsed = int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+        else:
+            parsed = -1
+        self[value] = parsed
+        return parsed
+
+
+def read_blocks(path: str, columns: tuple[str, ...], required: tuple[str, ...], blockSize: int = 1 << 16):
+    """
+    Rows of a GTFS file blockSize at a time, as one list of strings per column asked for.
+    Optional columns the file does not have come back as empty strings.
+    """
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = [name.strip() for name in next(reader, [])]
+        positions = []
+        for name in columns:
+            if name in header:
+                positions.append(header.index(name))
+            elif name in required:
+                raise ValueError(f'{path} has no {name} column')
+            else:
+                positions.append(None)
+        while True:
+            rows = list(itertools.islice(reader, blockSize))
+            if not rows:
+                return
+            yield [[''] * len(rows) if position is None else [row[position] for row in rows]
+                   for position in positions]
+
+
+class Feed:
+    """
+    A whole feed as flat arrays. Stops, routes and trips are numbered in file order and
+    stopIds / routeIds / tripIds map the numbers back to the ids in the feed.
+    Stop times are sorted by trip then stop_sequence, the ones of trip t being rows tripStart[t]:tripStart[t + 1]
+    of stopTimeStop, arrival and departure. Times are seconds after midnight.
+    """
+    arrays = ('stopIds', 'stopNames', 'stopLat', 'stopLon', 'routeIds', 'routeNames', 'tripIds', 'tripRoute',
+              'tripStart', 'stopTimeStop', 'arrival', 'departure')
+
+    def __init__(self, **arrays):
+        for name in self.arrays:
+            setattr(self, name, arrays[name])
+        # trip -> stop pattern it runs, and the patterns, worked out on first use
+        self.tripPattern: np.ndarray = None
+        self.patternStops: list[tuple[int, ...]] = None
+
+    def __len__(self):
+        return len(self.tripIds)
+
+    def stop_index(self) -> dict[str, int]:
+        return {stopId: idx for idx, stopId in enumerate(self.stopIds.tolist())}
+
+    def stop_names(self) -> dict[int, str]:
+        """
+        Stop index -> name, like bus.busStopDict.
+        """
+        return dict(enumerate(self.stopNames.tolist()))
+
+    def stop_coords(self) -> dict[int, tuple[float, float]]:
+        """
+        Stop index -> (lon, lat), like Routes.stop_coords.
+        """
+        return dict(enumerate(zip(self.stopLon.tolist(), self.stopLat.tolist())))
+
+    def patterns(self) -> tuple[np.ndarray, list[tuple[int, ...]]]:
+        """
+        Distinct stop sequences trips run, and which one each trip runs.
+        """
+        if self.tripPattern is None:
+            interner = Interner()
+            stops = self.stopTimeStop.tolist()
+            starts = self.tripStart.tolist()
+            self.tripPattern = np.fromiter((interner[tuple(stops[start:end])]
+                                            for start, end in zip(starts, starts[1:])),
+                                           dtype=np.int64, count=len(self))
+            self.patternStops = list(interner)
+        return self.tripPattern, self.patternStops
+
+    def routes(self) -> dict[int, list[int]]:
+        """
+        Pattern index -> stop indices, every pattern with at least two stops, like Routes.routes.
+        """
+        return {idx: list(stops) for idx, stops in enumerate(self.patterns()[1]) if len(stops) > 1}
+
+    def distances(self) -> dict[tuple[int, int], int]:
+        """
+        (stop, stop) -> shortest scheduled travel time in seconds between them, for every pair of stops some trip
+        goes between one after the other, like Routes.distances. Pass it to build_graph_with_distances with routes().
+        """
+        sameTrip = np.ones(max(len(self.stopTimeStop) - 1, 0), dtype=bool)
+        boundaries = self.tripStart[1:-1]
+        sameTrip[boundaries[(boundaries > 0) & (boundaries < len(self.stopTimeStop))] - 1] = False
+        stop1, stop2 = self.stopTimeStop[:-1][sameTrip], self.stopTimeStop[1:][sameTrip]
+        took = np.maximum(self.arrival[1:][sameTrip].astype(np.int64) - self.departure[:-1][sameTrip], 0)
+        order = np.lexsort((took, stop2, stop1))
+        stop1, stop2, took = stop1[order], stop2[order], took[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (stop1[1:] != stop1[:-1]) | (stop2[1:] != stop2[:-1])
+        return dict(zip(zip(stop1[first].tolist(), stop2[first].tolist()), took[first].tolist()))
+
+    def timetable(self, start: int = 0, end: int = None, ticksPerSecond: float = 1000) -> bus.Timetable:
+        """
+        The trips leaving their first stop from start to before end as a bus.Timetable, tick 0 being start.
+        Bus ids are trip indices and route ids pattern indices, trips with fewer than two stops are left out.
+        :param start: Seconds after midnight.
+        :param end: Seconds after midnight, no limit by default.
+        :param ticksPerSecond: Engine ticks per second of the feed, a millonsec clock by default.
+                               1000 / 60 runs an hour of the feed in a minute, like the demo timetables.
+        """
+        tripPattern, patternStops = self.patterns()
+        trips = np.flatnonzero(self.tripStart[1:] - self.tripStart[:-1] > 1)
+        firstDeparture = np.zeros(len(self), dtype=np.int64)
+        firstDeparture[trips] = self.departure[self.tripStart[trips]]
+        trips = trips[(firstDeparture[trips] >= start) & ((firstDeparture[trips] < end) if end is not None else True)]
+        routes = {}
+        buses = []
+        for trip, pattern in zip(trips.tolist(), tripPattern[trips].tolist()):
+            route = routes.get(pattern)
+            if route is None:
+                route = routes[pattern] = bus.Route(pattern, list(patternStops[pattern]))
+            buses.append(bus.Bus(id=trip, route=route,
+                                 startTime=round(int(firstDeparture[trip] - start) * ticksPerSecond)))
+
+        # every stop time but the last one of each trip starts a segment. The engines run a bus straight on
+        # from stop to stop, so time spent standing at a stop counts towards the segment getting there
+        segments = self.tripStart[trips + 1] - self.tripStart[trips] - 1
+        width = int(segments.max(initial=0))
+        rows = np.repeat(np.arange(len(trips)), segments)
+        positions = np.arange(len(rows)) - np.repeat(np.cumsum(segments) - segments, segments)
+        stopTimes = self.tripStart[trips][rows] + positions
+        last = positions == segments[rows] - 1
+        reached = np.where(last, self.arrival[stopTimes + 1], self.departure[stopTimes + 1]).astype(np.int64)
+        duration = np.full((len(trips), width), -1, dtype=np.int64)
+        duration[rows, positions] = np.rint(np.maximum(reached - self.departure[stopTimes], 0) * ticksPerSecond)
+        depart = bus.Timetable.departures(np.array([b.get_depart_time() for b in buses], dtype=np.int64), duration)
+        return bus.Timetable(buses, depart, duration)
+
+    def save(self, path: str, signature: np.ndarray):
+        # written next to the final file and renamed, so a reader never sees half a cache
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as f:
+            np.savez(f, signature=signature, **{name: getattr(self, name) for name in self.arrays})
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path: str, signature: np.ndarray = None):
+        """
+        :return: The feed cached at path, None if there is none or it was made from other files.
+        """
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if signature is not None and not np.array_equal(data['signature'], signature):
+                    return None
+                return cls(**{name: data[name] for name in cls.arrays})
+        except (OSError, KeyError, ValueError):
+            return None
+
+
+def feed_signature(path: str) -> np.ndarray:
+    """
+    Size and modification time of every feed file, a cache made from other files than these is stale.
+    """
+    signature = [cacheVersion]
+    for name in feedFiles:
+        stat = os.stat(os.path.join(path, name))
+        signature += [stat.st_size, stat.st_mtime_ns]
+    return np.array(signature, dtype=np.int64)
+
+
+def parse_feed(path: str, blockSize: int = 1 << 16) -> Feed:
+    """
+    Read a feed from its text files, only blockSize rows of each held as strings at a time.
+    """
+    # the csv rows are millions of short lived lists, the cycle collector would keep walking them for nothing
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        return read_feed(path, blockSize)
+    finally:
+        if collecting:
+            gc.enable()
+
+
+def read_feed(path: str, blockSize: int) -> Feed:
+    stopIds, stopNames, stopLat, stopLon = [], [], [], []
+    for ids, names, lats, lons in read_blocks(os.path.join(path, 'stops.txt'),
+                                              ('stop_id', 'stop_name', 'stop_lat', 'stop_lon'), ('stop_id',),
+                                              blockSize):
+        stopIds += ids
+        stopNames += names
+        stopLat.append(np.array([float(lat) if lat.strip() else np.nan for lat in lats]))
+        stopLon.append(np.array([float(lon) if lon.strip() else np.nan for lon in lons]))
+    stopIndex = {stopId: idx for idx, stopId in enumerate(stopIds)}
+    if len(stopIndex) != len(stopIds):
+        raise ValueError('stops.txt has the same stop_id more than once')
+
+    routeIds, routeNames = [], []
+    for ids, shortNames, longNames in read_blocks(os.path.join(path, 'routes.txt'),
+                                                  ('route_id', 'route_short_name', 'route_long_name'), ('route_id',),
+                                                  blockSize):
+        routeIds += ids
+        routeNames += [short or long for short, long in zip(shortNames, longNames)]
+    routeIndex = {routeId: idx for idx, routeId in enumerate(routeIds)}
+
+    tripIds, tripRoute = [], []
+    for routes, ids in read_blocks(os.path.join(path, 'trips.txt'), ('route_id', 'trip_id'),
+                                   ('route_id', 'trip_id'), blockSize):
+        tripIds += ids
+        try:
+            tripRoute.append(np.fromiter(map(routeIndex.__getitem__, routes), dtype=np.int32, count=len(routes)))
+        except KeyError as error:
+            raise ValueError(f'trips.txt refers to route {error} missing from routes.txt') from None
+    tripIndex = {tripId: idx for idx, tripId in enumerate(tripIds)}
+
+    times = TimeCache()
+    trip, sequence, stop, arrival, departure = [], [], [], [], []
+    for trips, arrivals, departures, stops, sequences in read_blocks(
+            os.path.join(path, 'stop_times.txt'), ('trip_id', 'arrival_time', 'departure_time', 'stop_id',
+                                                   'stop_sequence'),
+            ('trip_id', 'stop_id', 'stop_sequence'), blockSize):
+        n = len(trips)
+        try:
+            trip.append(np.fromiter(map(tripIndex.__getitem__, trips), dtype=np.int32, count=n))
+            stop.append(np.fromiter(map(stopIndex.__getitem__, stops), dtype=np.int32, count=n))
+        except KeyError as error:
+            raise ValueError(f'stop_times.txt refers to trip or stop {error} that is not in the feed') from None
+        sequence.append(np.fromiter(map(int, sequences), dtype=np.int64, count=n))
+        arrival.append(np.fromiter(map(times.__getitem__, arrivals), dtype=np.int32, count=n))
+        departure.append(np.fromiter(map(times.__getitem__, departures), dtype=np.int32, count=n))
+
+    trip, sequence, stop, arrival, departure = (np.concatenate(column) if column else np.zeros(0, dtype=np.int32)
+                                                for column in (trip, sequence, stop, arrival, departure))
+    order = np.lexsort((sequence, trip))
+    trip, stop, arrival, departure = trip[order], stop[order], arrival[order], departure[order]
+    # a stop with only one of the two times leaves when it gets there,
+    # stops with neither are timed evenly between the ones around them
+    arrival = np.where(arrival < 0, departure, arrival)
+    departure = np.where(departure < 0, arrival, departure)
+    tripStart = np.searchsorted(trip, np.arange(len(tripIds) + 1)).astype(np.int64)
+    untimed = arrival < 0
+    if untimed.any():
+        nonEmpty = tripStart[:-1] < tripStart[1:]
+        if untimed[tripStart[:-1][nonEmpty]].any() or untimed[tripStart[1:][nonEmpty] - 1].any():
+            raise ValueError('the first and last stop of every trip need a time')
+        timed = np.flatnonzero(~untimed)
+        arrival[untimed] = np.rint(np.interp(np.flatnonzero(untimed), timed, arrival[timed])).astype(np.int32)
+        departure[untimed] = arrival[untimed]
+
+    return Feed(stopIds=np.array(stopIds, dtype=str), stopNames=np.array(stopNames, dtype=str),
+                stopLat=np.concatenate(stopLat) if stopLat else np.zeros(0),
+                stopLon=np.concatenate(stopLon) if stopLon else np.zeros(0),
+                routeIds=np.array(routeIds, dtype=str), routeNames=np.array(routeNames, dtype=str),
+                tripIds=np.array(tripIds, dtype=str),
+                tripRoute=np.concatenate(tripRoute) if tripRoute else np.zeros(0, dtype=np.int32),
+                tripStart=tripStart, stopTimeStop=stop, arrival=arrival, departure=departure)
+
+
+def load_feed(path: str, cache: bool = True, cachePath: str = None, blockSize: int = 1 << 16) -> Feed:
+    """
+    Load a GTFS-like feed directory, from its binary cache when the feed files have not changed since it was made.
+    :param cache: Use and refresh the cache. A feed in a directory that can't be written to is just not cached.
+    :param cachePath: Where the cache lives, feed.npz in the feed directory by default.
+    :param blockSize: Rows read from a text file at a time.
+    """
+    if not cache:
+        return parse_feed(path, blockSize)
+    cachePath = cachePath or os.path.join(path, 'feed.npz')
+    signature = feed_signature(path)
+    feed = Feed.load(cachePath, signature)
+    if feed is None:
+        feed = parse_feed(path, blockSize)
+        try:
+            feed.save(cachePath, signature)
+        except OSError:
+            pass
+    return feed
@@ -0,0 +1,188 @@
+"""
+Fixed memory statistics a BusSimulation keeps up to date while it runs, so long runs do not have to keep
+every passanger around to report waits, rides, queues and bus loads.
+"""
+import math
+
+import numpy as np
+
+
+class StreamingHistogram:
+    """
+    Histogram with logarithmic bins: bin i holds values in (gamma ** (i - 1), gamma ** i], so every quantile
+    comes back within relativeError of a value that was actually added. Memory only depends on maxValue.
+    """
+    def __init__(self, relativeError: float = 0.01, maxValue: float = 1 << 40):
+        self.relativeError = relativeError
+        self.gamma = (1 + relativeError) / (1 - relativeError)
+        self.logGamma = math.log(self.gamma)
+        # bin 0 holds zero (and anything negative)
+        self.counts = np.zeros(int(math.ceil(math.log(maxValue) / self.logGamma)) + 2, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def bin_of(self, values: np.ndarray) -> np.ndarray:
+        values = np.asarray(values, dtype=np.float64)
+        bins = np.ceil(np.log(np.maximum(values, 1e-300)) / self.logGamma)
+        return np.where(values > 0, np.clip(bins, 1, len(self.counts) - 1), 0).astype(np.int64)
+
+    def add(self, value):
+        self.add_many(np.array([value]))
+
+    def add_many(self, values):
+        values = np.asarray(values)
+        if len(values) == 0:
+            return
+        self.counts += np.bincount(self.bin_of(values), minlength=len(self.counts))
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def merge(self, other: 'StreamingHistogram'):
+        if other.gamma != self.gamma or len(other.counts) != len(self.counts):
+            raise ValueError('can only merge histograms with the same bins')
+        self.counts += other.counts
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return math.nan
+        cumulative = np.cumsum(self.counts)
+        i = int(np.searchsorted(cumulative, q * (self.count - 1), side='right'))
+        # the middle of the bin in relative terms, clamped to what was seen
+        value = 0.0 if i == 0 else 2 * self.gamma ** i / (self.gamma + 1)
+        return min(max(value, self.min), self.max)
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else math.nan
+
+    def summary(self) -> dict[str, float]:
+        return {'count': self.count, 'mean': self.mean(), 'min': self.min if self.count else math.nan,
+                'max': self.max if self.count else math.nan, 'p50': self.quantile(0.5),
+                'p95': self.quantile(0.95), 'p99': self.quantile(0.99)}
+
+
+class Metrics:
+    """
+    Collector a BusSimulation updates as passangers show up, board, give up and get off:
+        wait, ride      StreamingHistogram of millonsec from show up to boarding and from boarding to leaving
+        angry, noBus    stop -> passangers who gave up waiting there / never had a bus to wait for
+        queue length    passangers waiting at each stop, averaged over buckets of bucketWidth millonsec.
+                        At most maxBuckets per stop: a run that goes on past them doubles bucketWidth and
+                        merges neighbouring buckets, so pick bucketWidth around the expected run length / maxBuckets
+                        for the finest resolution that won't coarsen
+        bus load        passangers on board of each bus along each segment of its route
+    Scalar or array arguments both work, batched mode reports a whole busload at once.
+    """
+    def __init__(self, bucketWidth: int = 60 * 1000, relativeError: float = 0.01, maxBuckets: int = 1024):
+        self.bucketWidth = bucketWidth
+        self.maxBuckets = maxBuckets
+        self.wait = StreamingHistogram(relativeError)
+        self.ride = StreamingHistogram(relativeError)
+        self.angry: dict[int, int] = {}
+        self.noBus: dict[int, int] = {}
+        # stop -> passanger millonsec spent waiting in each time bucket
+        self.queueArea: dict[int, np.ndarray] = {}
+        self.loadChanges: np.ndarray = None
+        self.busIds: np.ndarray = None
+
+    def attach(self, timetable):
+        """
+        Size the bus load table for the trips of a bus.Timetable, called by BusSimulation.
+        """
+        self.busIds = timetable.busIds
+        # +1 where passangers get on, -1 past where they get off, summed along the route at report time
+        self.loadChanges = np.zeros((len(timetable), timetable.depart.shape[1] + 1), dtype=np.int64)
+
+    @staticmethod
+    def count_into(counts: dict[int, int], stop: int, n: int):
+        if n:
+            counts[stop] = counts.get(stop, 0) + n
+
+    def queued(self, stop: int, start, end):
+        """
+        Passangers waited at stop from start to end.
+        """
+        start, end = np.atleast_1d(np.asarray(start, dtype=np.int64)), np.atleast_1d(np.asarray(end, dtype=np.int64))
+        if len(start) == 0:
+            return
+        while np.maximum(end - 1, start).max() // self.bucketWidth >= self.maxBuckets:
+            self.coarsen()
+        width = self.bucketWidth
+        first = start // width
+        last = np.maximum(end - 1, start) // width
+        area = self.queueArea.get(stop)
+        if area is None or len(area) <= last.max():
+            grown = np.zeros(min(max(int(last.max()) + 1, 2 * (0 if area is None else len(area))), self.maxBuckets),
+                             dtype=np.int64)
+            if area is not None:
+                grown[:len(area)] = area
+            area = self.queueArea[stop] = grown
+        # split every wait over the buckets it overlaps, waits rarely span more than a couple
+        for offset in range(int((last - first).max()) + 1):
+            bucket = first + offset
+            overlap = np.minimum(end, (bucket + 1) * width) - np.maximum(start, bucket * width)
+            inside = (bucket <= last) & (overlap > 0)
+            np.add.at(area, bucket[inside], overlap[inside])
+
+    def coarsen(self):
+        """
+        Double bucketWidth, bucket i of every stop becomes the sum of the old buckets 2i and 2i + 1.
+        """
+        self.bucketWidth *= 2
+        for stop, area in self.queueArea.items():
+            if len(area) % 2:
+                area = np.append(area, 0)
+            self.queueArea[stop] = area.reshape(-1, 2).sum(axis=1)
+
+    def board(self, stop: int, showTime, now: int, busIdx: int, segId: int, landSeg: int):
+        """
+        Passangers who showed up at showTime got on bus index busIdx at the start of segment segId and
+        ride until the end of segment landSeg.
+        """
+        showTime = np.atleast_1d(np.asarray(showTime, dtype=np.int64))
+        self.wait.add_many(now - showTime)
+        self.queued(stop, showTime, np.full(len(showTime), now))
+        self.loadChanges[busIdx, segId] += len(showTime)
+        self.loadChanges[busIdx, landSeg + 1] -= len(showTime)
+
+    def alight(self, onBus, now: int):
+        self.ride.add_many(now - np.atleast_1d(np.asarray(onBus, dtype=np.int64)))
+
+    def give_up(self, stop: int, showTime, now):
+        showTime = np.atleast_1d(np.asarray(showTime, dtype=np.int64))
+        self.count_into(self.angry, stop, len(showTime))
+        self.queued(stop, showTime, np.broadcast_to(now, showTime.shape))
+
+    def no_bus(self, stops):
+        values, counts = np.unique(np.atleast_1d(stops), return_counts=True)
+        for stop, n in zip(values.tolist(), counts.tolist()):
+            self.count_into(self.noBus, stop, n)
+
+    def queue_length(self, stop: int) -> np.ndarray:
+        """
+        Mean number of passangers waiting at stop in each bucket of bucketWidth millonsec.
+        """
+        area = self.queueArea.get(stop)
+        return np.zeros(0) if area is None else np.trim_zeros(area, 'b') / self.bucketWidth
+
+    def bus_load(self) -> np.ndarray:
+        """
+        trip x segment number of passangers on board, in the trip order of the Timetable.
+        """
+        return np.cumsum(self.loadChanges, axis=1)[:, :-2]
+
+    def summary(self) -> dict:
+        load = self.bus_load()
+        return {'wait': self.wait.summary(), 'ride': self.ride.summary(),
+                'angry': sum(self.angry.values()), 'noBus': sum(self.noBus.values()),
+                'angryByStop': dict(sorted(self.angry.items())),
+                'peakQueue': {stop: float(self.queue_length(stop).max(initial=0)) for stop in sorted(self.queueArea)},
+                'peakBusLoad': int(load.max(initial=0)),
+                'meanBusLoad': float(load[load > 0].mean()) if (load > 0).any() else 0.0}
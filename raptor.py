@@ -0,0 +1,198 @@
+import collections
+
+import numpy as np
+
+Leg = collections.namedtuple('Leg', 'bus fromStop toStop departTime arriveTime')
+Journey = collections.namedtuple('Journey', 'arrival transfers legs')
+
+
+class Raptor:
+    """
+    Round based (RAPTOR) earliest arrival journey planner over an array packed bus timetable.
+    Trips running the same stop sequence without overtaking each other form a pattern, stored as
+    trip x stop departure / arrival arrays, so finding the first trip leaving a stop at or after a time
+    is one searchsorted on a column. Round k finds the best arrivals using k buses.
+    """
+    def __init__(self, trips, minTransferTime: int = 0):
+        """
+        :param trips: (bus id, stop sequence, departure times, arrival times) per trip, departure i is when the bus
+                      leaves stop i and arrival i is when it gets there.
+        :param minTransferTime: Time needed to change bus at a stop.
+        """
+        self.minTransferTime = minTransferTime
+        stops = sorted({stop for _, sequence, _, _ in trips for stop in sequence})
+        self.stops = np.array(stops)
+        self.stopIndex = {stop: i for i, stop in enumerate(stops)}
+
+        bySequence = collections.defaultdict(list)
+        for busId, sequence, depart, arrive in trips:
+            bySequence[tuple(sequence)].append((depart[0], busId, list(depart), list(arrive)))
+        # pattern -> stop indices, trip x stop departures / arrivals, bus id per trip
+        self.patternStops: list[np.ndarray] = []
+        self.departures: list[np.ndarray] = []
+        self.arrivals: list[np.ndarray] = []
+        self.patternBuses: list[np.ndarray] = []
+        for sequence, items in bySequence.items():
+            items.sort()
+            # a trip that overtakes the one before it goes to another pattern, so every column stays sorted
+            chains = []
+            for item in items:
+                for chain in chains:
+                    last = chain[-1]
+                    if all(d >= ld for d, ld in zip(item[2], last[2])) and \
+                            all(a >= la for a, la in zip(item[3], last[3])):
+                        chain.append(item)
+                        break
+                else:
+                    chains.append([item])
+            for chain in chains:
+                self.patternStops.append(np.array([self.stopIndex[s] for s in sequence]))
+                self.departures.append(np.array([item[2] for item in chain], dtype=np.int64))
+                self.arrivals.append(np.array([item[3] for item in chain], dtype=np.int64))
+                self.patternBuses.append(np.array([item[1] for item in chain]))
+        # the same tables as python lists / contiguous columns for the scan in run
+        self.never = np.iinfo(np.int64).max
+        self.patternStopLists = [stops.tolist() for stops in self.patternStops]
+        self.departColumns = [[np.ascontiguousarray(d[:, i]) for i in range(d.shape[1])] for d in self.departures]
+        self.tripDepartures = [d.tolist() for d in self.departures]
+        self.tripArrivals = [a.tolist() for a in self.arrivals]
+        # stop -> (pattern, position) of every pattern stopping there
+        self.stopPatterns: list[list[tuple[int, int]]] = [[] for _ in stops]
+        for pattern, patternStops in enumerate(self.patternStops):
+            for position, stop in enumerate(patternStops.tolist()):
+                self.stopPatterns[stop].append((pattern, position))
+
+    @classmethod
+    def from_buses(cls, buses, busTable: dict, minTransferTime: int = 0):
+        """
+        Pack the timetable of bus.Bus objects whose segments are BusTime lists in busTable (bus.flyTime).
+        """
+        trips = []
+        for b in buses:
+            segments = busTable[b.id]
+            if not segments:
+                continue
+            sequence = [segments[0].departureId] + [seg.arriveId for seg in segments]
+            arrive = [segments[0].departureTime] + [seg.departureTime + seg.duration for seg in segments]
+            # the bus never leaves its last stop, nobody can board there
+            depart = [seg.departureTime for seg in segments] + [np.iinfo(np.int64).max]
+            trips.append((b.id, sequence, depart, arrive))
+        return cls(trips, minTransferTime)
+
+    @classmethod
+    def from_timetable(cls, timetable, minTransferTime: int = 0):
+        """
+        Pack the trips of a bus.Timetable.
+        """
+        trips = []
+        for trip, bus in enumerate(timetable.buses):
+            segments = int(timetable.segments[trip])
+            if not segments:
+                continue
+            depart = timetable.depart[trip, :segments].tolist() + [np.iinfo(np.int64).max]
+            trips.append((bus.id, timetable.stopSequence[trip, :segments + 1].tolist(), depart,
+                          timetable.arrive[trip, :segments + 1].tolist()))
+        return cls(trips, minTransferTime)
+
+    def run(self, source, departTime: int, maxTransfers: int, target=None):
+        """
+        :return: best arrival per round and stop index, and the leg that got there
+                 as (pattern, trip, board position, alight position).
+        """
+        n = len(self.stops)
+        never = self.never
+        arrival = [[never] * n]
+        parent = [{}]
+        best = [never] * n
+        sourceIdx = self.stopIndex[source]
+        targetIdx = self.stopIndex.get(target) if target is not None else None
+        arrival[0][sourceIdx] = best[sourceIdx] = departTime
+        marked = {sourceIdx}
+
+        for k in range(1, maxTransfers + 2):
+            previous = arrival[-1]
+            current = list(previous)
+            legs = {}
+            transferTime = self.minTransferTime if k > 1 else 0
+            # earliest marked position on every pattern touching a marked stop
+            queue = {}
+            for stop in marked:
+                for pattern, position in self.stopPatterns[stop]:
+                    if position < queue.get(pattern, never):
+                        queue[pattern] = position
+            marked = set()
+
+            for pattern, start in queue.items():
+                patternStops = self.patternStopLists[pattern]
+                departColumns = self.departColumns[pattern]
+                tripDepartures = self.tripDepartures[pattern]
+                tripArrivals = self.tripArrivals[pattern]
+                trip = None
+                boardPosition = None
+                for position in range(start, len(patternStops)):
+                    stop = patternStops[position]
+                    if trip is not None:
+                        arrive = tripArrivals[trip][position]
+                        if arrive < best[stop] and (targetIdx is None or arrive < best[targetIdx]):
+                            current[stop] = best[stop] = arrive
+                            legs[stop] = (pattern, trip, boardPosition, position)
+                            marked.add(stop)
+                    if previous[stop] == never:
+                        continue
+                    ready = previous[stop] + transferTime
+                    if trip is not None and ready > tripDepartures[trip][position]:
+                        continue
+                    earliest = int(departColumns[position].searchsorted(ready))
+                    if earliest < len(tripDepartures) and (trip is None or earliest < trip):
+                        trip = earliest
+                        boardPosition = position
+            arrival.append(current)
+            parent.append(legs)
+            if not marked:
+                break
+        return arrival, parent
+
+    def journey(self, parent, round: int, targetIdx: int):
+        legs = []
+        stop = targetIdx
+        for k in range(round, 0, -1):
+            if stop not in parent[k]:
+                # reached with fewer buses, the same label carries over from an earlier round
+                continue
+            pattern, trip, boardPosition, alightPosition = parent[k][stop]
+            boardStop = int(self.patternStops[pattern][boardPosition])
+            legs.append(Leg(bus=self.patternBuses[pattern][trip].item(), fromStop=self.stops[boardStop].item(),
+                            toStop=self.stops[stop].item(),
+                            departTime=int(self.departures[pattern][trip, boardPosition]),
+                            arriveTime=int(self.arrivals[pattern][trip, alightPosition])))
+            stop = boardStop
+        legs.reverse()
+        return legs
+
+    def pareto(self, source, target, departTime: int, maxTransfers: int = 5) -> list[Journey]:
+        """
+        Journeys from source leaving at or after departTime to target that are not beaten on both
+        arrival time and number of transfers, fewest transfers first.
+        """
+        if source == target:
+            return [Journey(arrival=departTime, transfers=0, legs=[])]
+        if source not in self.stopIndex or target not in self.stopIndex:
+            return []
+        arrival, parent = self.run(source, departTime, maxTransfers, target)
+        targetIdx = self.stopIndex[target]
+        journeys = []
+        bestSoFar = self.never
+        for k in range(1, len(arrival)):
+            arrive = arrival[k][targetIdx]
+            if arrive < bestSoFar:
+                bestSoFar = arrive
+                legs = self.journey(parent, k, targetIdx)
+                journeys.append(Journey(arrival=arrive, transfers=len(legs) - 1, legs=legs))
+        return journeys
+
+    def earliest_arrival(self, source, target, departTime: int, maxTransfers: int = 5):
+        """
+        :return: The earliest arriving Journey from source at departTime to target, or None if there's no way there.
+        """
+        journeys = self.pareto(source, target, departTime, maxTransfers)
+        return journeys[-1] if journeys else None
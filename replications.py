@@ -0,0 +1,76 @@
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import bus
+
+# per replication statistics, all in millonsec except servedRate
+statNames = ('servedRate', 'meanWait', 'p50Wait', 'p95Wait', 'meanRide', 'p50Ride', 'p95Ride')
+
+
+def replication_stats(table: bus.PassengerTable) -> dict[str, float]:
+    """
+    Wait (show up -> on bus) and ride (on bus -> leave bus) summary of one finished run.
+    """
+    served = table.onBus >= 0
+    wait = (table.onBus - table.timeAtStop)[served]
+    ride = (table.leaveBus - table.onBus)[served]
+    stats = {'servedRate': served.mean() if len(served) else np.nan}
+    for name, values in (('Wait', wait), ('Ride', ride)):
+        if len(values):
+            stats['mean' + name] = values.mean()
+            stats['p50' + name], stats['p95' + name] = np.percentile(values, [50, 95])
+        else:
+            stats['mean' + name] = stats['p50' + name] = stats['p95' + name] = np.nan
+    return {name: float(value) for name, value in stats.items()}
+
+
+def run_replication(seed: int, mode: str = 'batched', engine: str = 'simpy') -> dict[str, float]:
+    """
+    Generate demand and buses from their own random stream and simulate them once.
+    """
+    rng = random.Random(seed)
+    passangers = bus.generatePassangers(rng)
+    timetable = bus.generateTimetable(rng)
+    bus.BusSimulation(buses=timetable, passangers=passangers, mode=mode, engine=engine).runAirSim()
+    return replication_stats(passangers)
+
+
+def replication_seeds(replications: int, seed: int = 0) -> list[int]:
+    """
+    Independent seeds for each replication, the same list every time for the same seed.
+    """
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(replications)]
+
+
+def run_replications(replications: int, seed: int = 0, workers: int = None, mode: str = 'batched',
+                     engine: str = 'simpy'):
+    """
+    Run independent seeded replications of demand generation plus BusSimulation across processes.
+    :param replications: Number of replications to run.
+    :param seed: Master seed, every replication gets its own stream spawned from it.
+    :param workers: Number of worker processes, defaults to the number of cpus. 1 runs everything in this process.
+    :param mode: BusSimulation mode used by every replication.
+    :param engine: BusSimulation engine used by every replication.
+    :return: Per statistic the mean, standard deviation and 95% confidence interval (normal approximation)
+             across replications, plus the raw per replication values under 'samples'.
+    """
+    seeds = replication_seeds(replications, seed)
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        runs = [run_replication(s, mode, engine) for s in seeds]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            runs = list(pool.map(run_replication, seeds, [mode] * replications, [engine] * replications,
+                                 chunksize=max(1, replications // (4 * workers))))
+
+    samples = {name: np.array([run[name] for run in runs]) for name in statNames}
+    summary = {'replications': replications, 'samples': samples}
+    for name, values in samples.items():
+        mean = np.nanmean(values)
+        std = np.nanstd(values, ddof=1) if np.count_nonzero(~np.isnan(values)) > 1 else 0.0
+        halfWidth = 1.96 * std / np.sqrt(max(np.count_nonzero(~np.isnan(values)), 1))
+        summary[name] = {'mean': float(mean), 'std': float(std), 'ci95': (float(mean - halfWidth), float(mean + halfWidth))}
+    return summary
@@ -0,0 +1,140 @@
+import glob
+import os
+
+import numpy as np
+
+# one int64 column per field, stops are stop ids and -1 marks a passanger who never got on / off a bus
+columns = ('id', 'start', 'dest', 'show time', 'on bus', 'bus', 'leave')
+# columns holding engine clock ticks
+timeColumns = ('show time', 'on bus', 'leave')
+
+
+class ResultsWriter:
+    """
+    Streams finished passangers to disk in fixed size chunks instead of keeping every record until the end.
+    Formats:
+        'csv'     - one text file with a header row
+        'npy'     - a directory of column-major chunk-NNNNN.npy files, see read_results
+        'parquet' - one parquet file with a row group per chunk, needs pyarrow
+    """
+    def __init__(self, path: str, format: str = 'csv', chunkSize: int = 1 << 16):
+        if format not in ('csv', 'npy', 'parquet'):
+            raise ValueError(f'unknown results format {format}')
+        self.path = path
+        self.format = format
+        self.chunkSize = chunkSize
+        self.chunk = np.empty((chunkSize, len(columns)), dtype=np.int64)
+        self.size = 0
+        self.chunksWritten = 0
+        self.file = None
+        self.parquetWriter = None
+        if format == 'csv':
+            self.file = open(path, 'w')
+            self.file.write(','.join(columns) + '\n')
+        elif format == 'npy':
+            os.makedirs(path, exist_ok=True)
+            for old in glob.glob(os.path.join(path, 'chunk-*.npy')):
+                os.remove(old)
+
+    def add(self, id: int, start: int, dest: int, showTime: int, onBus, bus, leave):
+        self.chunk[self.size] = (id, start, dest, showTime,
+                                 -1 if onBus is None else onBus,
+                                 -1 if bus is None else bus,
+                                 -1 if leave is None else leave)
+        self.size += 1
+        if self.size == self.chunkSize:
+            self.flush()
+
+    def add_arrays(self, arrays: dict[str, np.ndarray]):
+        """
+        Append a block of finished passangers given as one array per column.
+        """
+        block = [np.asarray(arrays[name], dtype=np.int64) for name in columns]
+        start = 0
+        while start < len(block[0]):
+            take = min(self.chunkSize - self.size, len(block[0]) - start)
+            for i, column in enumerate(block):
+                self.chunk[self.size:self.size + take, i] = column[start:start + take]
+            self.size += take
+            start += take
+            if self.size == self.chunkSize:
+                self.flush()
+
+    def flush(self):
+        if self.size:
+            self.write_chunk(self.chunk[:self.size])
+            self.size = 0
+
+    def write_chunk(self, rows: np.ndarray):
+        if self.format == 'csv':
+            np.savetxt(self.file, rows, fmt='%d', delimiter=',')
+        elif self.format == 'npy':
+            np.save(os.path.join(self.path, f'chunk-{self.chunksWritten:05d}.npy'), np.ascontiguousarray(rows.T))
+        else:
+            import pyarrow
+            import pyarrow.parquet
+            table = pyarrow.table({name: rows[:, i] for i, name in enumerate(columns)})
+            if self.parquetWriter is None:
+                self.parquetWriter = pyarrow.parquet.ParquetWriter(self.path, table.schema)
+            self.parquetWriter.write_table(table)
+        self.chunksWritten += 1
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.format == 'parquet':
+            if self.parquetWriter is None:
+                # nobody finished, still leave a readable empty file behind
+                import pyarrow
+                import pyarrow.parquet
+                empty = pyarrow.table({name: np.zeros(0, dtype=np.int64) for name in columns})
+                pyarrow.parquet.write_table(empty, self.path)
+            else:
+                self.parquetWriter.close()
+                self.parquetWriter = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def with_datetimes(results: dict[str, np.ndarray], simTime) -> dict[str, np.ndarray]:
+    """
+    Results with their show time, on bus and leave columns turned into datetime64 by a simtime.SimTime,
+    NaT where a passanger never got on / off. Each column is converted in one go.
+    """
+    converted = dict(results)
+    for name in timeColumns:
+        converted[name] = simTime.to_datetimes(results[name])
+    return converted
+
+
+def read_results(path: str, format: str = None) -> dict[str, np.ndarray]:
+    """
+    Read back what ResultsWriter wrote, as one int64 array per column in the order passangers finished.
+    :param format: 'csv', 'npy' or 'parquet', guessed from the path when not given.
+    """
+    if format is None:
+        if os.path.isdir(path):
+            format = 'npy'
+        elif path.endswith('.parquet'):
+            format = 'parquet'
+        else:
+            format = 'csv'
+
+    if format == 'npy':
+        chunks = [np.load(f) for f in sorted(glob.glob(os.path.join(path, 'chunk-*.npy')))]
+        data = np.concatenate(chunks, axis=1) if chunks else np.zeros((len(columns), 0), dtype=np.int64)
+        return {name: data[i] for i, name in enumerate(columns)}
+    if format == 'parquet':
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(path)
+        return {name: table.column(name).to_numpy() for name in columns}
+    if format == 'csv':
+        data = np.loadtxt(path, dtype=np.int64, delimiter=',', skiprows=1, ndmin=2)
+        return {name: data[:, i] for i, name in enumerate(columns)}
+    raise ValueError(f'unknown results format {format}')
@@ -0,0 +1,102 @@
+"""
+Wall clock view of the integer clock the simulation engines run on.
+The engines only ever count ticks (millonsec by default), SimTime turns ticks into datetimes at the edges:
+one at a time for printing, or whole result columns at once with numpy when exporting.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+
+
+class SimTime:
+    def __init__(self, base_time=None, clock=None, tick: timedelta = timedelta(milliseconds=1)):
+        """
+        Initializes the simulation time with a base time and a tick count of zero.
+        :param base_time: Base datetime object, tick 0. Defaults to '2024-12-28 00:00:00'.
+        :param clock: Anything with an integer `now`, like a BusSimulation's env, to read the ticks from
+                      instead of keeping its own count.
+        :param tick: Wall clock length of one tick.
+        """
+        self.base_time = base_time or datetime(2024, 12, 28, 0, 0)
+        self.clock = clock
+        self.tick = tick
+        self.count = 0  # ticks advanced so far when there is no clock
+
+    @property
+    def ticks(self) -> int:
+        return self.clock.now if self.clock is not None else self.count
+
+    @property
+    def offset(self) -> timedelta:
+        return self.ticks * self.tick
+
+    def to_ticks(self, when) -> int:
+        """
+        Ticks from base_time to a datetime, or in a timedelta.
+        """
+        if isinstance(when, datetime):
+            when = when - self.base_time
+        return when // self.tick
+
+    def advance(self, ticks: int = 0, **kwargs):
+        """
+        Advances the simulation time by a number of ticks and / or a timedelta.
+        :param kwargs: Time to advance in timedelta-compatible units
+                       (e.g., days=1, hours=3, minutes=30, seconds=10).
+        """
+        if self.clock is not None:
+            raise ValueError('a SimTime reading an engine clock moves with the engine')
+        self.count += ticks + (self.to_ticks(timedelta(**kwargs)) if kwargs else 0)
+
+    def now(self):
+        """
+        Returns the current simulated time as a datetime object.
+        """
+        return self.to_datetime(self.ticks)
+
+    def to_datetime(self, ticks: int) -> datetime:
+        return self.base_time + ticks * self.tick
+
+    def to_datetimes(self, ticks, missing: int = -1) -> np.ndarray:
+        """
+        datetime64[us] for a whole array of ticks in one go, NaT wherever ticks is missing
+        (results use -1 for a passanger who never got on or off).
+        """
+        ticks = np.asarray(ticks, dtype=np.int64)
+        step = np.timedelta64(self.tick // timedelta(microseconds=1), 'us')
+        times = np.datetime64(self.base_time, 'us') + ticks * step
+        if missing is not None:
+            times[ticks == missing] = np.datetime64('NaT')
+        return times
+
+    def format(self, ticks, unit: str = 's') -> np.ndarray:
+        """
+        ISO 8601 strings for a whole array of ticks, down to unit ('s', 'ms', ...).
+        """
+        return np.datetime_as_string(self.to_datetimes(ticks), unit=unit)
+
+    def reset(self):
+        """
+        Resets the simulated time offset to zero.
+        """
+        if self.clock is not None:
+            raise ValueError('a SimTime reading an engine clock moves with the engine')
+        self.count = 0
+
+    def time_difference(self, other_sim_time):
+        """
+        Computes the time difference between this SimTime and another SimTime or datetime.
+        :param other_sim_time: SimTime or datetime object to compare to.
+        :return: timedelta object representing the difference.
+        """
+        if isinstance(other_sim_time, SimTime):
+            other_time = other_sim_time.now()
+        else:
+            other_time = other_sim_time
+        return self.now() - other_time
+
+    def __str__(self):
+        """
+        Provides a string representation of the current simulated time.
+        """
+        return self.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -0,0 +1,46 @@
+"""
+ArrivalStream.from_csv has to replay what the repo and ResultsWriter write.
+Run with python -m pytest.
+"""
+import random
+
+import numpy as np
+import pytest
+
+import bus
+from results import ResultsWriter, read_results
+
+def test_from_csv_reads_stop_names(tmp_path):
+    # the repo's old output names its stops and lists passangers in no particular order
+    path = tmp_path / 'named.csv'
+    path.write_text('id,start,dest,show time,on bus,leave\n'
+                    '1,Oruamo Domain,Birkenhead Avenue,808,5000.0,8500.0\n'
+                    '0,Oruamo Domain,Roberts Road,297,5000.0,5500.0\n'
+                    '2,Roberts Road,Pupuke Road,1359,5000.0,7500.0\n')
+    with pytest.raises(ValueError, match='show up order'):
+        bus.ArrivalStream.from_csv(str(path), blockSize=2).to_table()
+    table = bus.ArrivalStream.from_csv(str(path), blockSize=2, sort=True).to_table()
+    assert table.id.tolist() == [0, 1, 2]
+    assert table.departBusStop.tolist() == [bus.busNameToId['Oruamo Domain']] * 2 + [bus.busNameToId['Roberts Road']]
+    assert table.arriveBusStop.tolist() == [bus.busNameToId[name] for name in
+                                            ('Roberts Road', 'Birkenhead Avenue', 'Pupuke Road')]
+    assert table.timeAtStop.tolist() == [297, 808, 1359]
+    path.write_text('id,start,dest,show time,on bus,leave\n0,Nowhere,Roberts Road,297,-1,-1\n')
+    with pytest.raises(ValueError, match='Nowhere'):
+        bus.ArrivalStream.from_csv(str(path), blockSize=2).to_table()
+
+
+def test_replay_results(tmp_path):
+    rng = random.Random(3)
+    passangers = bus.generatePassangers(rng, perStop=30)
+    timetable = bus.generateTimetable(rng)
+    paths = tmp_path / 'first.csv', tmp_path / 'replay.csv'
+    with ResultsWriter(str(paths[0])) as resultsWriter:
+        bus.BusSimulation(timetable, passangers, resultsWriter=resultsWriter).runAirSim()
+    stream = bus.ArrivalStream.from_csv(str(paths[0]), blockSize=64, sort=True)
+    with ResultsWriter(str(paths[1])) as resultsWriter:
+        bus.BusSimulation(timetable, stream, resultsWriter=resultsWriter).runAirSim()
+    first, replay = (read_results(str(path)) for path in paths)
+    for name in first:
+        np.testing.assert_array_equal(first[name][np.argsort(first['id'])], replay[name][np.argsort(replay['id'])],
+                                      err_msg=name)
@@ -0,0 +1,19 @@
+"""
+generate_demand has to leave out stops nobody shows up at.
+Run with python -m pytest.
+"""
+import numpy as np
+import pytest
+
+import demand
+
+
+@pytest.mark.parametrize('mode', [{'perStop': 50}, {'horizon': 100000}])
+def test_stops_with_no_rate_get_nobody(mode):
+    rates = demand.RateProfile([0], [[demand.defaultRate, 0.0, demand.defaultRate, 0.0]])
+    table = demand.generate_demand(0, stops=[1, 2, 3, 4], rates=rates, **mode)
+    assert set(table.departBusStop.tolist()) == {1, 3}
+    assert (table.timeAtStop >= 0).all() and (table.timeAtStop <= 100000).all()
+    assert (np.diff(table.timeAtStop[table.departBusStop == 1]) >= 0).all()
+    if 'perStop' in mode:
+        assert len(table) == 100
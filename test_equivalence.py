@@ -0,0 +1,93 @@
+"""
+Every way of running BusSimulation has to put each passanger on the same bus at the same times.
+Run with python -m pytest.
+"""
+import random
+
+import numpy as np
+import pytest
+
+import bus
+
+
+def scenario(seed: int, stops: int = 15, routes: int = 3, buses: int = 20, passangers: int = 800):
+    """
+    Random routes, some of them running backwards, with buses and passangers on a coarse time grid
+    so departures tie and passangers show up exactly leaveAngryTime before a bus.
+    """
+    rng = random.Random(seed)
+    sequences = []
+    for _ in range(routes):
+        sequence = rng.sample(range(1, stops + 1), rng.randint(2, stops))
+        sequences.append(sorted(sequence) if rng.random() < 0.5 else sequence)
+    fleet = []
+    durations = []
+    for busId in range(buses):
+        sequence = rng.choice(sequences)
+        fleet.append(bus.Bus(id=busId, route=bus.Route(busId, sequence),
+                             startTime=rng.randrange(0, 60000, rng.choice([1, 500, 1000]))))
+        durations.append([rng.choice([500, 1000, rng.randint(1, 3000)]) for _ in range(len(sequence) - 1)])
+    duration = np.full((buses, stops), -1, dtype=np.int64)
+    for trip, row in enumerate(durations):
+        duration[trip, :len(row)] = row
+    start = np.array([b.get_depart_time() for b in fleet], dtype=np.int64)
+    timetable = bus.Timetable(fleet, bus.Timetable.departures(start, duration), duration)
+
+    departStop, arriveStop, timeAtStop = [], [], []
+    for _ in range(passangers):
+        a, b = rng.sample(range(1, stops + 1), 2)
+        departStop.append(a)
+        arriveStop.append(b)
+        timeAtStop.append(rng.randrange(0, 200000, rng.choice([1, 500])))
+    return timetable, (departStop, arriveStop, timeAtStop)
+
+
+def simulate(timetable, passangers, **kwargs):
+    table = bus.PassengerTable.from_arrays(*passangers)
+    bus.BusSimulation(timetable, table, **kwargs).runAirSim()
+    return table.onBus.copy(), table.busId.astype(np.int64), table.leaveBus.copy()
+
+
+def assert_same(expected, actual):
+    for name, a, b in zip(('on bus', 'bus', 'leave bus'), expected, actual):
+        np.testing.assert_array_equal(a, b, err_msg=name)
+
+
+@pytest.mark.parametrize('seed', range(12))
+def test_batched_matches_passanger(seed):
+    timetable, passangers = scenario(seed)
+    assert_same(simulate(timetable, passangers, mode='passanger'), simulate(timetable, passangers, mode='batched'))
+
+
+@pytest.mark.parametrize('mode', ['passanger', 'batched'])
+@pytest.mark.parametrize('seed', range(12))
+def test_heap_matches_simpy(seed, mode):
+    timetable, passangers = scenario(seed)
+    assert_same(simulate(timetable, passangers, mode=mode), simulate(timetable, passangers, mode=mode, engine='heap'))
+
+
+@pytest.mark.parametrize('seed', range(12))
+def test_solve_analytic_matches_simulation(seed):
+    timetable, passangers = scenario(seed)
+    table = bus.PassengerTable.from_arrays(*passangers)
+    assert_same(simulate(timetable, passangers), bus.solve_analytic(timetable, table))
+
+
+def test_tied_departures_and_angry_cutoff():
+    route = bus.Route(0, [1, 2, 3])
+    fleet = [bus.Bus(id=busId, route=route, startTime=start) for busId, start in ((0, 1000), (1, 1000), (2, 150000))]
+    duration = np.full((3, 2), 500, dtype=np.int64)
+    start = np.array([1000, 1000, 150000], dtype=np.int64)
+    timetable = bus.Timetable(fleet, bus.Timetable.departures(start, duration), duration)
+    angry = bus.leaveAngryTime
+    passangers = ([1, 1, 1, 1, 2],
+                  [3, 3, 3, 3, 3],
+                  # tie on buses 0 and 1 / shows just in time for bus 2 / shows exactly leaveAngryTime before it /
+                  # the bus leaves at the very millonsec he shows up / stop 2 sees both buses at 1500
+                  [0, 150000 - angry + 1, 150000 - angry, 1000, 1500])
+    expected = (np.array([1000, 150000, -1, 1000, 1500]), np.array([0, 2, -1, 0, 0]),
+                np.array([2000, 151000, -1, 2000, 2000]))
+    for mode in ('passanger', 'batched'):
+        for engine in ('simpy', 'heap'):
+            assert_same(expected, simulate(timetable, passangers, mode=mode, engine=engine))
+    assert_same(expected, bus.solve_analytic(timetable, bus.PassengerTable.from_arrays(*passangers)))
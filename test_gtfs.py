@@ -0,0 +1,110 @@
+"""
+gtfs.load_feed on a feed small enough to check every number by hand.
+Run with python -m pytest.
+"""
+import os
+
+import numpy as np
+import pytest
+
+import gtfs
+
+feedText = {
+    'stops.txt': ['stop_id,stop_name,stop_lat,stop_lon',
+                  'B,Bravo,-36.85,174.76',
+                  'A,"Alpha, Main St",-36.84,174.75',
+                  'C,Charlie,,',
+                  'D,Delta,-36.86,174.77'],
+    'routes.txt': ['route_id,agency_id,route_short_name,route_long_name',
+                   'R1,X,1,Day Line',
+                   'R2,X,,Night Line'],
+    'trips.txt': ['route_id,service_id,trip_id',
+                  'R1,WK,T1',
+                  'R1,WK,T2',
+                  'R2,WK,N1'],
+    # out of order, with gaps in stop_sequence, an untimed stop and a trip running past midnight
+    'stop_times.txt': ['trip_id,arrival_time,departure_time,stop_id,stop_sequence',
+                       'T2,06:35:00,06:35:00,A,2',
+                       'T1,06:15:30,06:15:30,D,7',
+                       'N1,24:50:00,24:50:00,D,1',
+                       'T1,,,C,5',
+                       'T1,06:00:00,06:00:00,B,1',
+                       'T2,06:30:00,06:30:00,B,1',
+                       'T1,06:05:00,06:05:30,A,3',
+                       'T2,06:40:00,06:40:00,C,3',
+                       'N1,25:05:00,25:05:00,B,2',
+                       'T2,06:45:00,,D,4'],
+}
+
+
+def hms(hours, minutes, seconds=0):
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def write_feed(path):
+    for name, lines in feedText.items():
+        (path / name).write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+
+def test_parse(tmp_path):
+    feed = gtfs.load_feed(write_feed(tmp_path), cache=False)
+    # ids are numbered in file order
+    assert feed.stopIds.tolist() == ['B', 'A', 'C', 'D']
+    assert feed.stop_names() == {0: 'Bravo', 1: 'Alpha, Main St', 2: 'Charlie', 3: 'Delta'}
+    assert feed.routeNames.tolist() == ['1', 'Night Line']
+    assert feed.tripRoute.tolist() == [0, 0, 1]
+    assert feed.tripStart.tolist() == [0, 4, 8, 10]
+    assert feed.stopTimeStop.tolist() == [0, 1, 2, 3, 0, 1, 2, 3, 3, 0]
+    assert np.isnan(feed.stopLat[2]) and feed.stop_coords()[3] == (174.77, -36.86)
+    # C is timed halfway between A and D, D of T2 leaves when it gets there
+    assert feed.arrival[:4].tolist() == [hms(6, 0, 0), hms(6, 5, 0), hms(6, 10, 15), hms(6, 15, 30)]
+    assert feed.departure[:4].tolist() == [hms(6, 0, 0), hms(6, 5, 30), hms(6, 10, 15), hms(6, 15, 30)]
+    assert feed.departure[7] == hms(6, 45, 0)
+    assert feed.arrival[8:].tolist() == [hms(24, 50, 0), hms(25, 5, 0)]
+    tripPattern, patternStops = feed.patterns()
+    assert tripPattern.tolist() == [0, 0, 1] and patternStops == [(0, 1, 2, 3), (3, 0)]
+    assert feed.distances() == {(0, 1): 300, (1, 2): 285, (2, 3): 300, (3, 0): 900}
+
+
+def test_timetable(tmp_path):
+    feed = gtfs.load_feed(write_feed(tmp_path), cache=False)
+    timetable = feed.timetable(start=6 * 3600, ticksPerSecond=1)
+    assert timetable.busIds.tolist() == [0, 1, 2]
+    # standing 30 seconds at A counts towards getting there
+    assert timetable.duration[:, :3].tolist() == [[330, 285, 315], [300, 300, 300], [900, -1, -1]]
+    assert timetable.depart[:, 0].tolist() == [0, 1800, hms(24, 50) - hms(6, 0)]
+    assert timetable.depart[0, :3].tolist() == [0, 330, 615]
+    assert feed.timetable(start=6 * 3600, end=7 * 3600).busIds.tolist() == [0, 1]
+    assert feed.timetable(start=6 * 3600).duration[0, 0] == 330000
+
+
+def test_cache(tmp_path, monkeypatch):
+    path = write_feed(tmp_path)
+    parsed = []
+    parse_feed = gtfs.parse_feed
+    monkeypatch.setattr(gtfs, 'parse_feed', lambda *args: parsed.append(args) or parse_feed(*args))
+    feed = gtfs.load_feed(path)
+    assert len(parsed) == 1 and os.path.exists(tmp_path / 'feed.npz')
+    cached = gtfs.load_feed(path)
+    assert len(parsed) == 1
+    for name in gtfs.Feed.arrays:
+        np.testing.assert_array_equal(getattr(feed, name), getattr(cached, name), err_msg=name)
+        assert getattr(feed, name).dtype == getattr(cached, name).dtype
+
+    # same size, new times: only the modification time tells the cache is stale
+    stopTimes = tmp_path / 'stop_times.txt'
+    stat = stopTimes.stat()
+    stopTimes.write_text(stopTimes.read_text().replace('25:05:00,25:05:00', '25:06:00,25:06:00'))
+    os.utime(stopTimes, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert gtfs.load_feed(path).arrival[-1] == hms(25, 6)
+    assert len(parsed) == 2
+    assert gtfs.load_feed(path).arrival[-1] == hms(25, 6)
+    assert len(parsed) == 2
+
+
+def test_missing_column(tmp_path):
+    path = write_feed(tmp_path)
+    (tmp_path / 'trips.txt').write_text('route_id,service_id\nR1,WK\n')
+    with pytest.raises(ValueError, match='trip_id'):
+        gtfs.load_feed(path, cache=False)
@@ -0,0 +1,27 @@
+"""
+Metrics has to stay fixed memory however long a run goes on.
+Run with python -m pytest.
+"""
+import numpy as np
+
+from metrics import Metrics
+
+
+def test_queue_buckets():
+    metrics = Metrics(bucketWidth=1000)
+    metrics.queued(1, [500, 1500], [2500, 1500])
+    np.testing.assert_array_equal(metrics.queue_length(1), [0.5, 1, 0.5])
+
+
+def test_queue_coarsens_past_max_buckets():
+    metrics = Metrics(bucketWidth=1000, maxBuckets=8)
+    metrics.queued(1, [0, 2000], [1000, 3000])
+    metrics.queued(2, [0], [8000])
+    np.testing.assert_array_equal(metrics.queue_length(1), [1, 0, 1])
+    # one passanger waiting far past 8 buckets of 1000 millonsec
+    metrics.queued(1, [100000], [100500])
+    assert metrics.bucketWidth == 16000
+    assert all(len(area) <= 8 for area in metrics.queueArea.values())
+    assert {stop: int(area.sum()) for stop, area in metrics.queueArea.items()} == {1: 2500, 2: 8000}
+    np.testing.assert_array_equal(metrics.queue_length(1), np.array([2000, 0, 0, 0, 0, 0, 500]) / 16000)
+    np.testing.assert_array_equal(metrics.queue_length(2), [0.5])
@@ -0,0 +1,111 @@
+"""
+Raptor has to find every journey not beaten on both arrival time and transfers.
+Run with python -m pytest.
+"""
+import random
+
+import pytest
+
+from raptor import Journey, Leg, Raptor
+
+never = 2 ** 63 - 1
+
+
+def trip(busId, sequence, times):
+    """
+    A trip reaching sequence[i] at times[i] and leaving it straight away, it never leaves its last stop.
+    """
+    return busId, sequence, list(times[:-1]) + [never], list(times)
+
+
+def small_network():
+    # 1 -> 4 direct is slow, changing at 2 is faster, changing at 2 and 3 is fastest
+    return [trip(10, [1, 4], [0, 1000]),
+            trip(11, [1, 2], [0, 100]),
+            trip(12, [2, 4], [200, 300]),
+            trip(13, [2, 3], [150, 180]),
+            trip(14, [3, 4], [190, 250])]
+
+
+def test_pareto_trades_transfers_for_arrival():
+    planner = Raptor(small_network())
+    journeys = planner.pareto(1, 4, 0)
+    assert [(j.arrival, j.transfers) for j in journeys] == [(1000, 0), (300, 1), (250, 2)]
+    assert journeys[0].legs == [Leg(bus=10, fromStop=1, toStop=4, departTime=0, arriveTime=1000)]
+    assert journeys[1].legs == [Leg(bus=11, fromStop=1, toStop=2, departTime=0, arriveTime=100),
+                                Leg(bus=12, fromStop=2, toStop=4, departTime=200, arriveTime=300)]
+    assert [leg.bus for leg in journeys[2].legs] == [11, 13, 14]
+    assert planner.earliest_arrival(1, 4, 0) == journeys[2]
+
+
+def test_max_transfers_and_transfer_time():
+    planner = Raptor(small_network())
+    assert [(j.arrival, j.transfers) for j in planner.pareto(1, 4, 0, maxTransfers=1)] == [(1000, 0), (300, 1)]
+    assert [(j.arrival, j.transfers) for j in planner.pareto(1, 4, 0, maxTransfers=0)] == [(1000, 0)]
+    assert planner.earliest_arrival(1, 4, 0, maxTransfers=0).arrival == 1000
+    # 60 to change bus misses the 150 from stop 2
+    slow = Raptor(small_network(), minTransferTime=60)
+    assert [(j.arrival, j.transfers) for j in slow.pareto(1, 4, 0)] == [(1000, 0), (300, 1)]
+    # every bus from 1 has left
+    assert planner.pareto(1, 4, 1) == []
+    assert planner.earliest_arrival(4, 1, 0) is None
+
+
+@pytest.mark.parametrize('stop', [1, 99])
+def test_source_is_target(stop):
+    assert Raptor(small_network()).pareto(stop, stop, 5) == [Journey(arrival=5, transfers=0, legs=[])]
+    assert Raptor(small_network()).pareto(99, 4, 5) == []
+
+
+def brute_force(trips, source, departTime, maxTransfers, minTransferTime):
+    """
+    Best arrival per stop using at most 1, 2, ... maxTransfers + 1 buses, trying every trip in every round.
+    """
+    labels = {source: departTime}
+    rounds = []
+    for k in range(maxTransfers + 1):
+        ready = {stop: time + (minTransferTime if k else 0) for stop, time in labels.items()}
+        current = dict(labels)
+        for _, sequence, depart, arrive in trips:
+            for i, stop in enumerate(sequence):
+                if stop in ready and depart[i] >= ready[stop]:
+                    for j in range(i + 1, len(sequence)):
+                        current[sequence[j]] = min(current.get(sequence[j], never), arrive[j])
+                    break
+        labels = current
+        rounds.append(labels)
+    return rounds
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_matches_brute_force(seed):
+    rng = random.Random(seed)
+    trips = []
+    for busId in range(rng.randint(5, 25)):
+        sequence = rng.sample(range(1, 9), rng.randint(2, 5))
+        times = [rng.randrange(0, 1000, 10)]
+        for _ in sequence[1:]:
+            times.append(times[-1] + rng.randrange(10, 300, 10))
+        trips.append(trip(busId, sequence, times))
+    minTransferTime = rng.choice([0, 0, 50])
+    planner = Raptor(trips, minTransferTime)
+    for _ in range(10):
+        source, target = rng.sample(range(1, 9), 2)
+        departTime = rng.randrange(0, 800, 10)
+        maxTransfers = rng.randint(0, 3)
+        rounds = brute_force(trips, source, departTime, maxTransfers, minTransferTime)
+        expected = []
+        for k, labels in enumerate(rounds):
+            if target in labels and (not expected or labels[target] < expected[-1][0]):
+                expected.append((labels[target], k))
+        journeys = planner.pareto(source, target, departTime, maxTransfers)
+        assert [(j.arrival, j.transfers) for j in journeys] == expected
+        for journey in journeys:
+            stop, time = source, departTime - minTransferTime
+            for leg in journey.legs:
+                assert leg.fromStop == stop and leg.departTime >= time + minTransferTime
+                _, sequence, depart, arrive = next(t for t in trips if t[0] == leg.bus)
+                assert depart[sequence.index(leg.fromStop)] == leg.departTime
+                assert arrive[sequence.index(leg.toStop)] == leg.arriveTime
+                stop, time = leg.toStop, leg.arriveTime
+            assert (stop, time) == (target, journey.arrival)
@@ -0,0 +1,82 @@
+"""
+Shortest paths over Routes.StopGraph have to follow every change made to the graph.
+Run with python -m pytest.
+"""
+import copy
+import pickle
+
+import Routes
+
+
+def graph():
+    return Routes.build_graph_with_distances(Routes.routes, Routes.distances)
+
+
+def fresh(g, start, end):
+    return Routes.CSRGraph.from_graph({stop: dict(neighbors) for stop, neighbors in g.items()}).shortest_path(start, end)
+
+
+def test_every_mutator_reaches_dijkstra():
+    g = graph()
+    assert Routes.dijkstra_shortest_path(g, 1, 8) == (25, [1, 2, 3, 4, 5, 6, 7, 8])
+    g[7].pop(8)
+    g[8].pop(7)
+    assert Routes.dijkstra_shortest_path(g, 1, 8) == (None, None)
+    g[7].update({8: 1})
+    g[8].setdefault(7, 1)
+    assert Routes.dijkstra_shortest_path(g, 1, 8) == (23, [1, 2, 3, 4, 5, 6, 7, 8])
+    g[7] |= {8: 2}
+    assert Routes.dijkstra_shortest_path(g, 1, 8) == (24, [1, 2, 3, 4, 5, 6, 7, 8])
+    g[7].clear()
+    assert Routes.dijkstra_shortest_path(g, 1, 8) == (None, None)
+    g.pop(7)
+    g.update({7: {8: 1}})
+    g.setdefault(6, {})[7] = 1
+    assert Routes.dijkstra_shortest_path(g, 1, 8) == fresh(g, 1, 8) == (22, [1, 2, 3, 4, 5, 6, 7, 8])
+    g.clear()
+    assert Routes.dijkstra_shortest_path(g, 1, 8) == (None, None)
+
+
+def test_astar_scale_follows_weights():
+    g = graph()
+    coords = Routes.stop_coords
+    for start, end in ((1, 8), (1, 11), (12, 3)):
+        assert Routes.astar_shortest_path(g, start, end, coords) == Routes.dijkstra_shortest_path(g, start, end)
+    csr = g.csr()
+    scale = csr.heuristic_scale(coords)
+    assert csr.scale_cache == (coords, scale)
+    # a cheaper edge lowers the admissible scale, a stale one would overestimate and miss the shortcut
+    g[1][2] = 0.01
+    g[2][1] = 0.01
+    assert g.csr() is csr and csr.scale_cache is None
+    assert csr.heuristic_scale(coords) < scale
+    assert Routes.astar_shortest_path(g, 1, 8, coords) == Routes.dijkstra_shortest_path(g, 1, 8)
+    assert csr.heuristic_scale(dict(coords)) == csr.heuristic_scale(coords)
+
+
+def test_table_follows_direct_changes():
+    for dense_limit in (1000, 0):
+        g = graph()
+        table = Routes.ShortestPathTable(g, dense_limit=dense_limit)
+        assert table.distance(1, 8) == 25
+        g[1][2] = 100
+        assert table.shortest_path(1, 8) == Routes.dijkstra_shortest_path(g, 1, 8) == (120, [1, 2, 3, 4, 5, 6, 7, 8])
+        table.update_edge(1, 2, 5)
+        assert table.distance(1, 8) == 25
+        g[7].pop(8)
+        assert table.path(1, 8) is None
+        table.update_edge(7, 8, 1)
+        assert table.shortest_path(1, 8) == Routes.dijkstra_shortest_path(g, 1, 8)
+
+
+def test_pickle_and_copy_keep_the_graph_working():
+    g = graph()
+    weight = g[1][2]
+    for other in (pickle.loads(pickle.dumps(g)), copy.copy(g), g.copy(), copy.deepcopy(g)):
+        assert type(other) is Routes.StopGraph and other == g
+        assert Routes.dijkstra_shortest_path(other, 1, 8) == (25, [1, 2, 3, 4, 5, 6, 7, 8])
+        other[1][2] = 100
+        assert all(neighbors.owner is other for neighbors in other.values())
+        assert Routes.dijkstra_shortest_path(other, 1, 8) == fresh(other, 1, 8) == (120, [1, 2, 3, 4, 5, 6, 7, 8])
+        assert g[1][2] == weight and Routes.dijkstra_shortest_path(g, 1, 8) == (25, [1, 2, 3, 4, 5, 6, 7, 8])
+    assert pickle.loads(pickle.dumps(g[1])) == copy.copy(g[1]) == dict(g[1])
@@ -0,0 +1,40 @@
+"""
+Passangers changing bus have to follow the direction buses run in.
+Run with python -m pytest.
+"""
+import numpy as np
+import pytest
+
+import bus
+
+
+def one_way_loop():
+    """
+    Buses go 1 -> 2 -> 3 on one route and 3 -> 4 -> 1 on the other, never backwards.
+    """
+    return bus.Timetable.concat([bus.Timetable.from_headway(bus.Route(0, [1, 2, 3]), 3, 10000, durations=500),
+                                 bus.Timetable.from_headway(bus.Route(1, [3, 4, 1]), 3, 10000, firstId=3,
+                                                            durations=700)])
+
+
+def test_planner_follows_one_way_loop():
+    planner = bus.BusSimulation(one_way_loop(), bus.PassengerTable.from_arrays([3], [2], [0]), transfers=True).planner
+    assert planner.plan(3, 2) == ((3, 1), (1, 2))
+    assert planner.plan(2, 4) == ((2, 3), (3, 4))
+    assert planner.plan(1, 3) == ((1, 3),)
+
+
+@pytest.mark.parametrize('engine', ['simpy', 'heap'])
+def test_change_bus_round_one_way_loop(engine):
+    timetable = one_way_loop()
+    # 3 -> 4 -> 1 on bus 3, then the 10000 bus 1 -> 2
+    expected = (np.array([0]), np.array([3]), np.array([10500]))
+    table = bus.PassengerTable.from_arrays([3], [2], [0])
+    bus.BusSimulation(timetable, table, engine=engine, transfers=True).runAirSim()
+    np.testing.assert_array_equal(table.status, [bus.PassengerTable.ARRIVED])
+    np.testing.assert_array_equal(table.transfers, [1])
+    for a, b in zip(expected, (table.onBus, table.busId, table.leaveBus)):
+        np.testing.assert_array_equal(a, b)
+    for a, b in zip(expected, bus.solve_analytic(timetable, bus.PassengerTable.from_arrays([3], [2], [0]),
+                                                 transfers=True)):
+        np.testing.assert_array_equal(a, b)
@@ -0,0 +1,31 @@
+"""
+Travel time noise has to draw from whatever rng the rest of the model was given.
+Run with python -m pytest.
+"""
+import random
+
+import numpy as np
+
+import bus
+import cli
+import traveltime
+
+
+def test_as_generator_takes_the_random_module():
+    for rng in (random, None):
+        random.seed(7)
+        first = traveltime.as_generator(rng).integers(1 << 30, size=4)
+        random.seed(7)
+        np.testing.assert_array_equal(first, traveltime.as_generator(rng).integers(1 << 30, size=4))
+
+
+def test_noisy_timetable_with_default_rng():
+    model = traveltime.TravelTimeModel(noise=0.2)
+    timetable = bus.Timetable.from_headway(bus.Route(0, [1, 2, 3, 4]), 5, 10000, model=model)
+    assert (timetable.duration[timetable.isSegment] > 0).all()
+
+
+def test_cli_travel_noise_without_seed(tmp_path):
+    output = tmp_path / 'passangers.csv'
+    cli.main(['simulate', '--travel-noise', '0.2', '--passangers-per-stop', '5', '--output', str(output)])
+    assert output.stat().st_size > 0
@@ -0,0 +1,78 @@
+"""
+Journeys over several bus routes: the legs a passanger rides to get between two stops, one bus each,
+planned along shortest paths through the route network from Routes.py.
+"""
+import numpy as np
+
+import Routes
+
+
+class TransferPlanner:
+    """
+    Legs from an origin to a destination stop as (from stop, to stop) pairs, cached per origin / destination pair.
+    Pairs some bus runs between directly are one leg. Others follow the shortest path through the routes and
+    change bus wherever no bus goes on any further along it, so every leg is as long as it can be.
+    """
+    def __init__(self, timetable, departureIndex, distances: dict[tuple[int, int], float] = None):
+        """
+        :param timetable: bus.Timetable whose stop sequences make up the route network.
+        :param departureIndex: bus.DepartureIndex of that timetable, answers which legs a bus can do.
+        :param distances: Edge weights in the style of Routes.distances,
+                          defaults to the shortest scheduled travel time between neighbouring stops.
+        """
+        self.departureIndex = departureIndex
+        trips, positions = np.nonzero(timetable.isSegment)
+        segments = zip(timetable.stopSequence[trips, positions].tolist(),
+                       timetable.stopSequence[trips, positions + 1].tolist(),
+                       timetable.duration[trips, positions].tolist())
+        # one edge per direction buses actually run, a one way loop can't be ridden backwards
+        edges = {}
+        for stop1, stop2, duration in segments:
+            weight = duration if distances is None else distances.get((stop1, stop2), distances.get((stop2, stop1), 1))
+            edges[stop1, stop2] = min(weight, edges.get((stop1, stop2), weight))
+        stops = timetable.stops.tolist()
+        index = {stop: i for i, stop in enumerate(stops)}
+        self.graph = Routes.CSRGraph(stops, [(index[stop1], index[stop2], weight)
+                                             for (stop1, stop2), weight in edges.items()])
+        self.legs: dict[tuple[int, int], tuple[tuple[int, int], ...]] = {}
+
+    def plan(self, departStop: int, arriveStop: int) -> tuple[tuple[int, int], ...]:
+        """
+        :return: The legs from departStop to arriveStop, empty if no buses can get there.
+        """
+        key = (departStop, arriveStop)
+        legs = self.legs.get(key)
+        if legs is None:
+            if self.departureIndex.sequences_between(departStop, arriveStop):
+                legs = (key,)
+            else:
+                _, path = self.graph.shortest_path(departStop, arriveStop)
+                legs = self.split(path) if path else ()
+            self.legs[key] = legs
+        return legs
+
+    def split(self, path: list[int]) -> tuple[tuple[int, int], ...]:
+        legs = []
+        start = 0
+        while start < len(path) - 1:
+            # the furthest stop along the path one bus takes you to
+            end = next((end for end in range(len(path) - 1, start, -1)
+                        if self.departureIndex.sequences_between(path[start], path[end])), None)
+            if end is None:
+                return ()
+            legs.append((path[start], path[end]))
+            start = end
+        return tuple(legs)
+
+    def leg_ends(self, departStop: np.ndarray, arriveStop: np.ndarray, leg: int = 0) -> np.ndarray:
+        """
+        Where leg number leg of every passanger's journey ends, planned once per origin / destination pair.
+        :return: The stop per passanger, -1 for the ones with fewer legs or who can't get anywhere.
+        """
+        departStop, arriveStop = np.asarray(departStop, dtype=np.int64), np.asarray(arriveStop, dtype=np.int64)
+        if len(departStop) == 0:
+            return np.zeros(0, dtype=np.int64)
+        pairs, inverse = np.unique(np.stack((departStop, arriveStop)), axis=1, return_inverse=True)
+        ends = np.array([legs[leg][1] if leg < len(legs) else -1
+                         for legs in (self.plan(o, d) for o, d in zip(*pairs.tolist()))], dtype=np.int64)
+        return ends[inverse.reshape(-1)]
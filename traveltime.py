@@ -0,0 +1,125 @@
+"""
+Travel times for a whole fleet in one vectorised pass: a base time per pair of neighbouring stops,
+a time of day multiplier on top and lognormal noise drawn with a numpy Generator.
+"""
+import random
+
+import numpy as np
+
+# bus.travel_time takes 500 millonsec per stop id apart
+defaultMsPerStop = 500
+
+
+def as_generator(rng) -> np.random.Generator:
+    """
+    numpy Generator from a Generator, a seed, or a random.Random whose stream seeds it.
+    The random module itself or None, the default rng everywhere else, seed it from the module's shared stream
+    so random.seed still makes a run repeatable.
+    """
+    if isinstance(rng, np.random.Generator):
+        return rng
+    if isinstance(rng, random.Random):
+        return np.random.default_rng(rng.getrandbits(64))
+    if rng is random or rng is None:
+        return np.random.default_rng(random.getrandbits(64))
+    return np.random.default_rng(rng)
+
+
+class TravelTimeModel:
+    """
+    Segment travel time = base time x multiplier of the time of day band the bus leaves in x noise.
+    Band i runs from bandStarts[i] to bandStarts[i + 1], the last one runs on until dayLength
+    (forever if it's None) and buses leaving before bandStarts[0] get a multiplier of 1.
+    The noise has mean 1 and a coefficient of variation of noise, 0 makes the model deterministic.
+    """
+    def __init__(self, base: dict[tuple[int, int], float] = None, msPerUnit: float = 1, fallback: float = defaultMsPerStop,
+                 bandStarts=(0,), multipliers=(1.0,), dayLength: int = None, noise: float = 0.0):
+        """
+        :param base: (stop, stop) -> base travel time either way, in the style of Routes.distances.
+        :param msPerUnit: Millonsec per unit of base.
+        :param fallback: Millonsec per stop id apart for pairs missing from base, like travel_time.
+                         None makes a missing pair a KeyError.
+        :param bandStarts: Start time of each band in millonsec into the day, increasing.
+        :param multipliers: Travel time multiplier per band.
+        :param dayLength: Millonsec after which the bands start over.
+        :param noise: Coefficient of variation of the random multiplier drawn for each segment.
+        """
+        self.base = {(min(pair), max(pair)): value * msPerUnit for pair, value in (base or {}).items()}
+        self.fallback = fallback
+        self.bandStarts = np.asarray(bandStarts, dtype=np.float64)
+        self.multipliers = np.asarray(multipliers, dtype=np.float64)
+        if len(self.bandStarts) != len(self.multipliers) or np.any(np.diff(self.bandStarts) <= 0):
+            raise ValueError('need one increasing start time per multiplier')
+        if np.any(self.multipliers <= 0) or noise < 0:
+            raise ValueError('multipliers must be positive and noise can not be negative')
+        self.dayLength = dayLength
+        self.noise = noise
+        # stop sequence -> base time of each of its segments, they never change
+        self.baseTimes: dict[tuple, np.ndarray] = {}
+
+    @classmethod
+    def from_distances(cls, distances: dict[tuple[int, int], float], msPerUnit: float = defaultMsPerStop, **kwargs):
+        """
+        Base times from a Routes.distances style table, msPerUnit millonsec per unit of distance.
+        """
+        return cls(base=distances, msPerUnit=msPerUnit, **kwargs)
+
+    def base_time(self, start: int, finish: int) -> float:
+        value = self.base.get((min(start, finish), max(start, finish)))
+        if value is None:
+            if self.fallback is None:
+                raise KeyError(f'no base travel time between stops {start} and {finish}')
+            value = self.fallback * abs(finish - start)
+        return value
+
+    def base_times(self, sequence) -> np.ndarray:
+        """
+        Base time of every segment along a stop sequence, worked out once per sequence.
+        """
+        key = tuple(sequence)
+        times = self.baseTimes.get(key)
+        if times is None:
+            times = np.array([self.base_time(a, b) for a, b in zip(key, key[1:])], dtype=np.float64)
+            times.setflags(write=False)
+            self.baseTimes[key] = times
+        return times
+
+    def multiplier(self, times: np.ndarray) -> np.ndarray:
+        times = np.asarray(times, dtype=np.float64)
+        if self.dayLength is not None:
+            times = times % self.dayLength
+        band = np.searchsorted(self.bandStarts, times, side='right') - 1
+        return np.where(band >= 0, self.multipliers[np.maximum(band, 0)], 1.0)
+
+    def schedule(self, sequences: list, starts, rng=None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Departure and travel times of trips running stop sequences and leaving their first stop at starts.
+        All the noise is drawn in one go, then every trip moves down its route together, one segment at a time.
+        :param rng: numpy Generator, seed or random.Random, only used when there is noise.
+        :return: trip x segment departure and duration arrays in the layout of bus.Timetable, -1 past the route end.
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        segments = np.array([max(len(sequence) - 1, 0) for sequence in sequences], dtype=np.int64)
+        width = int(segments.max(initial=0))
+        base = np.zeros((len(sequences), width))
+        rowsBySequence: dict[tuple, list[int]] = {}
+        for trip, sequence in enumerate(sequences):
+            rowsBySequence.setdefault(tuple(sequence), []).append(trip)
+        for sequence, rows in rowsBySequence.items():
+            base[rows, :len(sequence) - 1] = self.base_times(sequence)
+        if self.noise > 0:
+            # lognormal with mean 1
+            sigma = np.sqrt(np.log1p(self.noise ** 2))
+            base *= as_generator(rng).lognormal(-sigma ** 2 / 2, sigma, base.shape)
+
+        depart = np.full(base.shape, -1, dtype=np.int64)
+        duration = np.full(base.shape, -1, dtype=np.int64)
+        now = starts.copy()
+        for column in range(width):
+            live = column < segments
+            # never quicker than a millonsec
+            took = np.maximum(np.rint(base[:, column] * self.multiplier(now)), 1).astype(np.int64)
+            depart[live, column] = now[live]
+            duration[live, column] = took[live]
+            now += np.where(live, took, 0)
+        return depart, duration